@@ -0,0 +1,156 @@
+import re
+import time
+import random
+import string
+import urlparse
+import argparse
+
+import utils
+from utils import HTTP
+from ranker.dialogue_store import iter_json_array
+
+# Equivalence check and micro-benchmark of utils.tokenize_utterance.
+# Every message of the round-1 dump (and of the optional text files, one utterance
+# per line) is tokenized by utils.tokenize_utterance and by the rule-by-rule reference
+# below, as a unicode string and as a utf-8 byte string, and the outputs (or the
+# raised exceptions) must be identical. --fuzz adds random strings made of the
+# characters and strings the rules act on. Then both functions are timed on the same messages.
+#
+#   python benchmark_tokenizer.py --round1 round1.json --fuzz 100000 --repeat 3
+
+# pieces of the random strings: the characters and strings used by the rules, and some others
+FUZZ_FRAGMENTS = (list(u" \t\n.,;:!?~-*()[]<>/'\"`@#&_%+=^") + list(u"ltgcontwhpsfa") + list(u"0123456789") +
+                  list(u"\xa0\xe9\u2003\x1c\x85") +
+                  [u" (cont) ", u"& lt", u"& gt", u"&lt;", u"&gt;", u"...", u",,", u"http://", u"https://",
+                   u"ftp://", u"www.", u".com", u"a.b", u"/x?y=1&z#", u":8080", u"user:pw@", u"@user", u"#tag", u" 42"])
+
+
+def reference_tokenize_utterance(utterance):
+    """ utils.tokenize_utterance applied one rule after the other """
+    utterance = utterance.lower()
+    res = HTTP.search(utterance)
+    while res is not None:
+        url_string = utterance[res.start():res.end()]
+        url_tld = urlparse.urlparse(url_string).netloc
+        url_tag = url_tld.replace('www.', '')
+        for p in string.punctuation:
+            url_tag = url_tag.replace(p, '_')
+        url_tag = '<' + url_tag.strip() + '>'
+        utterance = utterance.replace(url_string, url_tag)
+        res = HTTP.search(utterance)
+
+    utterance = utterance.replace(" (cont) ", "<cont>")
+    utterance = utterance.replace('& lt', '<')
+    utterance = utterance.replace('& gt', '>')
+    utterance = utterance.replace('&lt;', '<')
+    utterance = utterance.replace('&gt;', '>')
+    utterance = utterance.replace('\'', ' \'')
+    utterance = utterance.replace('"', ' " ')
+    utterance = utterance.replace(";", " ")
+    utterance = utterance.replace("`", " ")
+    utterance = re.sub('\.+', '.', utterance)
+    utterance = re.sub(',+', ',', utterance)
+    utterance = utterance.replace('.', ' . ')
+    utterance = utterance.replace('!', ' ! ')
+    utterance = utterance.replace('?', ' ? ')
+    utterance = utterance.replace(',', ' , ')
+    utterance = utterance.replace('~', '')
+    utterance = utterance.replace('-', ' - ')
+    utterance = utterance.replace('*', ' * ')
+    utterance = utterance.replace('(', ' ')
+    utterance = utterance.replace(')', ' ')
+    utterance = utterance.replace('[', ' ')
+    utterance = utterance.replace(']', ' ')
+    utterance = utterance.replace('>', '> ')
+    utterance = utterance.replace('/', ' ')
+    utterance = re.sub('\s+', ' ', utterance)
+    utterance = utterance.strip()
+
+    # Convert @username to AT_USER
+    utterance = re.sub('@[^\s]+', '<at>', utterance)
+
+    # Remove hashtag sign from hashtags
+    utterance = re.sub(r'#([^\s]+)', r'\1', utterance)
+
+    # Replace numbers with <number> token
+    utterance = re.sub(" \d+", " <number> ", utterance)
+
+    utterance = utterance.replace('@', '')
+
+    return unicode(utterance)
+
+
+def load_messages(round1_files, text_files):
+    messages = []
+    for path in round1_files:
+        for dialog in iter_json_array(path):
+            messages.extend(msg['text'] for msg in dialog['thread'] if msg.get('text'))
+    for path in text_files:
+        with open(path, 'r') as handle:
+            messages.extend(line.decode('utf-8').rstrip(u'\n') for line in handle)
+    return messages
+
+
+def fuzz_messages(n, max_length=30, seed=1234):
+    rng = random.Random(seed)
+    return [u''.join(rng.choice(FUZZ_FRAGMENTS) for _ in range(rng.randint(0, max_length))) for _ in range(n)]
+
+
+def _result(function, utterance):
+    try:
+        return function(utterance)
+    except Exception as e:
+        return type(e)
+
+
+def check(messages, max_reports=10):
+    """ :return: number of inputs whose outputs differ """
+    mismatches = 0
+    for message in messages:
+        for utterance in (message, message.encode('utf-8')):
+            expected = _result(reference_tokenize_utterance, utterance)
+            got = _result(utils.tokenize_utterance, utterance)
+            if expected != got or type(expected) != type(got):
+                mismatches += 1
+                if mismatches <= max_reports:
+                    print "MISMATCH %r\n  expected %r\n  got      %r" % (utterance, expected, got)
+    return mismatches
+
+
+def timing(function, messages, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for message in messages:
+            function(message)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--round1', nargs='*', default=[], help="round-1 json dumps")
+    parser.add_argument('--text', nargs='*', default=[], help="text files, one utterance per line")
+    parser.add_argument('--fuzz', type=int, default=10000, help="number of random strings to check")
+    parser.add_argument('--repeat', type=int, default=3, help="number of timing runs, the best one is reported")
+    args = parser.parse_args()
+
+    messages = load_messages(args.round1, args.text)
+    print "checking %d messages and %d random strings..." % (len(messages), args.fuzz)
+    mismatches = check(messages + fuzz_messages(args.fuzz))
+    print "mismatches: %d" % mismatches
+
+    # messages with urls take another path, they are timed apart
+    with_urls = [message for message in messages if u'://' in message]
+    for name, subset in [('all', messages), ('without urls', [m for m in messages if u'://' not in m]),
+                         ('with urls', with_urls)]:
+        if len(subset) == 0:
+            continue
+        reference = timing(reference_tokenize_utterance, subset, args.repeat)
+        fast = timing(utils.tokenize_utterance, subset, args.repeat)
+        print "%s (%d messages)" % (name, len(subset))
+        print "  reference: %.2f us/message" % (1e6 * reference / len(subset))
+        print "  tokenize_utterance: %.2f us/message (x%.2f)" % (1e6 * fast / len(subset), reference / fast)
+    if mismatches > 0:
+        raise SystemExit(1)
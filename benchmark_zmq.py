@@ -0,0 +1,271 @@
+import zmq
+import json
+import time
+import random
+import argparse
+import BaseHTTPServer
+from threading import Thread, Lock, Semaphore
+from Queue import Queue, Empty
+import numpy as np
+import config
+import logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s',
+)
+conf = config.get_config()
+
+# Offline load generator for model_selection_zmq.py
+# Plays the role of bot_zmq.py: replays recorded conversations through the
+# PARENT_PULL_PIPE / PARENT_PIPE protocol at a given rate and concurrency,
+# then reports throughput, latency percentiles and per model timeouts.
+# NQG and DrQA HTTP backends are replaced by local stubs unless --no_stubs.
+#
+# Start model_selection_zmq.py, then:
+#   python benchmark_zmq.py round1.json --rate 2 --concurrency 10 --n_chats 100
+
+# same pipes as bot_zmq.py: the harness binds them instead of the bot
+PARENT_PIPE = conf.zmq['parent_push']
+PARENT_PULL_PIPE = conf.zmq['parent_pull']
+
+# same endpoints as models/wrapper.py
+NQG_PORT = 8080
+DRQA_PORT = 8888
+
+MAX_CONTEXT = 3
+
+
+def load_round1(path):
+    """
+    Load conversations from the round1 json dump (as read by
+    ranker/extract_dialogues_from_round1.py)
+    :return: list of (article, list of user turns)
+    """
+    with open(path, 'rb') as handle:
+        dialogs = json.load(handle)
+    conversations = []
+    for dialog in dialogs:
+        bots = [usr['id'] for usr in dialog['users'] if usr['userType'] == 'Bot']
+        # replay the messages of the first human of the conversation
+        humans = [msg['userId'] for msg in dialog['thread'] if msg['userId'] not in bots]
+        if len(humans) == 0:
+            continue
+        turns = [msg['text'] for msg in dialog['thread']
+                 if msg['userId'] == humans[0] and len(msg['text'].strip()) > 0]
+        if len(turns) > 0:
+            conversations.append((dialog['context'], turns))
+    return conversations
+
+
+def load_jsonl(path):
+    """
+    Load conversations from a json lines file:
+    one {"article": <str>, "turns": [<str>, ...]} per line
+    :return: list of (article, list of user turns)
+    """
+    conversations = []
+    with open(path, 'rb') as handle:
+        for line in handle:
+            if line.strip():
+                conv = json.loads(line)
+                conversations.append((conv['article'], conv['turns']))
+    return conversations
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Replies like the NQG (`/`) and DrQA (`/ask`) servers after `delay` seconds
+    """
+    delay = 0.
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length', 0))
+        data = json.loads(self.rfile.read(length))
+        time.sleep(self.delay)
+        if self.path.startswith('/ask'):
+            words = data['article'].split()
+            reply = {'reply': {'text': ' '.join(words[:random.randint(1, 5)])}}
+        else:
+            reply = [{'pred': 'what about %s ?' % ' '.join(sent.split()[:3]),
+                      'score': random.random()} for sent in data['sents']]
+        body = json.dumps(reply)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(port, delay):
+    handler = type('Stub%d' % port, (StubHandler,), {'delay': delay})
+    server = BaseHTTPServer.HTTPServer(('localhost', port), handler)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logging.info("Stub backend listening on port {}".format(port))
+    return server
+
+
+class Benchmark(object):
+    """
+    Replay conversations against a running model_selection_zmq.py
+    """
+
+    def __init__(self, conversations, rate, concurrency, timeout, think_time):
+        """
+        :param conversations: list of (article, list of user turns)
+        :param rate: new conversations per second, 0 to start them as fast as possible
+        :param concurrency: maximum number of simultaneous conversations
+        :param timeout: seconds to wait for a reply before giving up on a conversation
+        :param think_time: seconds to wait between a reply and the next user turn
+        """
+        self.conversations = conversations
+        self.rate = rate
+        self.slots = Semaphore(concurrency)
+        self.timeout = timeout
+        self.think_time = think_time
+        self.outgoing = Queue()
+        self.replies = {}  # chat_id -> Queue of replies
+        self.lock = Lock()
+        # results
+        self.latencies = []
+        self.selected = {}   # model -> nb of turns where it was selected
+        self.responded = []  # list of (models that got the job, models that answered in time), per turn
+        self.timeouts = 0
+
+    def sender(self):
+        context = zmq.Context()
+        socket = context.socket(zmq.PUSH)
+        socket.bind(PARENT_PULL_PIPE)
+        while True:
+            socket.send_json(self.outgoing.get())
+
+    def receiver(self):
+        context = zmq.Context()
+        socket = context.socket(zmq.PULL)
+        socket.bind(PARENT_PIPE)
+        while True:
+            msg = socket.recv_json()
+            replies = self.replies.get(msg.get('chat_id'))
+            if replies is not None:
+                replies.put(msg)
+
+    def chat(self, chat_id, article, turns):
+        """ Play one conversation turn by turn """
+        self.replies[chat_id] = Queue()
+        context = []
+        try:
+            for text in ['/start ' + article] + turns:
+                start = time.time()
+                self.outgoing.put({'chat_id': chat_id, 'text': text,
+                                   'context': context, 'allowed_model': 'all'})
+                try:
+                    reply = self.replies[chat_id].get(timeout=self.timeout)
+                except Empty:
+                    with self.lock:
+                        self.timeouts += 1
+                    logging.warn("No reply for chat {} after {}s".format(chat_id, self.timeout))
+                    break
+                with self.lock:
+                    self.latencies.append(time.time() - start)
+                    model = reply.get('model_name', 'none')
+                    self.selected[model] = self.selected.get(model, 0) + 1
+                    if 'responded' in reply:
+                        self.responded.append((reply.get('dispatched', []), reply['responded']))
+                context = reply.get('context', context)[-MAX_CONTEXT:]
+                time.sleep(self.think_time)
+        finally:
+            self.outgoing.put({'control': 'clean', 'chat_id': chat_id})
+            del self.replies[chat_id]
+            self.slots.release()
+
+    def run(self, n_chats):
+        for target in [self.sender, self.receiver]:
+            thread = Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        chats = []
+        self.start_time = time.time()
+        base_id = random.randint(1, 1000000)
+        for idx in range(n_chats):
+            article, turns = self.conversations[idx % len(self.conversations)]
+            if self.rate > 0:
+                time.sleep(random.expovariate(self.rate))
+            self.slots.acquire()
+            chat = Thread(target=self.chat, args=(base_id + idx, article, turns))
+            chat.daemon = True
+            chat.start()
+            chats.append(chat)
+        for chat in chats:
+            chat.join()
+        self.end_time = time.time()
+
+    def report(self):
+        duration = self.end_time - self.start_time
+        report = {
+            'duration': duration,
+            'turns': len(self.latencies),
+            'throughput': len(self.latencies) / duration,
+            'timeouts': self.timeouts,
+            'selected': self.selected,
+        }
+        if self.latencies:
+            report['latency'] = {
+                'mean': float(np.mean(self.latencies)),
+                'p50': float(np.percentile(self.latencies, 50)),
+                'p95': float(np.percentile(self.latencies, 95)),
+                'p99': float(np.percentile(self.latencies, 99)),
+                'max': float(np.max(self.latencies))
+            }
+        # models which got the job but did not answer before the response was selected,
+        # counted over the dispatched models so that a model which never answers shows up
+        model_timeouts = {}
+        for dispatched, responded in self.responded:
+            for m in set(dispatched):
+                model_timeouts.setdefault(m, 0)
+                if m not in responded:
+                    model_timeouts[m] += 1
+        report['model_timeouts'] = model_timeouts
+        return report
+
+
+def main(args):
+    if args.data.endswith('.jsonl'):
+        conversations = load_jsonl(args.data)
+    else:
+        conversations = load_round1(args.data)
+    if args.max_turns:
+        conversations = [(a, t[:args.max_turns]) for a, t in conversations]
+    logging.info("Loaded {} conversations".format(len(conversations)))
+
+    if not args.no_stubs:
+        start_stub(NQG_PORT, args.stub_delay)
+        start_stub(DRQA_PORT, args.stub_delay)
+
+    benchmark = Benchmark(conversations, args.rate, args.concurrency,
+                          args.timeout, args.think_time)
+    benchmark.run(args.n_chats or len(conversations))
+    report = benchmark.report()
+    print json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data", type=str, help="round1 json dump, or .jsonl file of {article, turns}")
+    parser.add_argument("-n", "--n_chats", type=int, default=None, help="number of conversations to replay, default all")
+    parser.add_argument("-r", "--rate", type=float, default=1., help="new conversations per second, 0 for no pause")
+    parser.add_argument("-c", "--concurrency", type=int, default=10, help="maximum number of simultaneous conversations")
+    parser.add_argument("-t", "--timeout", type=float, default=60., help="seconds to wait for each reply")
+    parser.add_argument("--think_time", type=float, default=0., help="seconds between a reply and the next user turn")
+    parser.add_argument("--max_turns", type=int, default=None, help="maximum number of user turns per conversation")
+    parser.add_argument("--stub_delay", type=float, default=0.1, help="response time of the NQG/DrQA stubs")
+    parser.add_argument("--no_stubs", action='store_true', help="use the real NQG/DrQA servers")
+    parser.add_argument("-o", "--output", type=str, default=None, help="json file to save the report, to compare runs")
+    args = parser.parse_args()
+    main(args)
@@ -14,6 +14,7 @@ import random
 import emoji
 import numpy as np
 # import storage
+import tracing
 from model_selection_zmq import ModelID
 from Queue import Queue
 from threading import Thread
@@ -51,11 +52,16 @@ chat_timing = {} # just for testing response time
 processing_msg_queue = Queue()
 outgoing_msg_queue = Queue()
 
+# Turn tracing, dumped every TRACE_DUMP_PERIOD seconds
+TRACE_FILE = '/tmp/bot_trace.json'
+TRACE_DUMP_PERIOD = 60
+tracer = tracing.Tracer('bot')
+
 # Pipes
 # parent to bot caller
-PARENT_PIPE = 'ipc:///tmp/parent_push.pipe'
+PARENT_PIPE = conf.zmq['parent_push']
 # bot to parent caller
-PARENT_PULL_PIPE = 'ipc:///tmp/parent_pull.pipe'
+PARENT_PULL_PIPE = conf.zmq['parent_pull']
 
 
 class ChatState:
@@ -163,7 +169,8 @@ class ConvAIRLLBot:
                 'chat_id': chat_id,
                 'text': self.ai[chat_id]['observation'],
                 'context': self.ai[chat_id]['context'],
-                'allowed_model': self.ai[chat_id]['allowed_model']
+                'allowed_model': self.ai[chat_id]['allowed_model'],
+                'trace': tracing.stamp({}, 'intake')
             })
 
 
@@ -192,6 +199,9 @@ def consumer():
     while True:
         msg = socket.recv_json()
         logging.info(msg)
+        trace = msg.get('trace')
+        tracer.record_since(trace, 'reply_sent', 'transport_out')
+        tracer.record_since(trace, 'intake', 'turn')
         # do not put test type msgs in outgoing queue
         if 'control' in msg and msg['control'] == 'test':
             # count the responses per min
@@ -220,6 +230,9 @@ def producer():
     logging.info("Main push channel active")
     while True:
         msg = processing_msg_queue.get()
+        if msg.get('trace') is not None:
+            tracing.stamp(msg['trace'], 'producer')
+            tracer.record_since(msg['trace'], 'intake', 'bot_queue')
         socket.send_json(msg)
         processing_msg_queue.task_done()
         logging.info("Sending msg to response selector:{}".format(json.dumps(msg)))
@@ -300,9 +313,11 @@ def reply_sender():
             chat_history[chat_id].append(data)
 
         logging.info("Send response to server.")
+        start = tracing.now()
         res = requests.post(os.path.join(BOT_URL, 'sendMessage'),
                             json=message,
                             headers={'Content-Type': 'application/json'})
+        tracer.record('telegram_reply', tracing.now() - start)
         if res.status_code != 200:
             logging.info(res.text)
             res.raise_for_status()
@@ -329,7 +344,8 @@ def test_app():
         'text': text,
         'context': context,
         'allowed_model': allowed_model,
-        'control' : 'test'
+        'control' : 'test',
+        'trace': tracing.stamp({}, 'intake')
     })
     chat_timing[chat_id] = datetime.now()
     
@@ -354,6 +370,7 @@ if __name__ == '__main__':
     reply_thread = Thread(target=reply_sender)
     reply_thread.daemon = True
     reply_thread.start()
+    tracer.start_dumping(TRACE_FILE, TRACE_DUMP_PERIOD)
     try:
         while True:
             if MODE == 'test':
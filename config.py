@@ -44,9 +44,28 @@ config_data = {
             'top_k' : 2
         },
         "socket_port" : 8094,
+        # ZMQ endpoints. The parent binds `*_bind` and the bot / model clients
+        # connect to `*_connect`. Use tcp://<host>:<port> endpoints to spread
+        # model clients over several machines.
+        "zmq": {
+            "command_bind" : "ipc:///tmp/command.pipe",
+            "command_connect" : "ipc:///tmp/command.pipe",
+            "bus_bind" : "ipc:///tmp/bus.pipe",
+            "bus_connect" : "ipc:///tmp/bus.pipe",
+            "parent_push" : "ipc:///tmp/parent_push.pipe",
+            "parent_pull" : "ipc:///tmp/parent_pull.pipe",
+            # number of ModelClient processes to start per model id on this host
+            # models not listed here get a single replica
+            "replicas" : {
+                "hred-reddit" : 1,
+                "hred-twitter" : 1
+            }
+        },
         "ranker": {
-            "model_short" : "/root/convai/ranker/models/short_term/0.641391/1510248853.21_Estimator_args.pkl",
-            "model_long" : "/root/convai/ranker/models/long_term/1.4506/1510248853.21_short_term.0641391.151024885321_Estimator__args.pkl"
+            # forward pass of the rankers: 'numpy' (no tensorflow needed) or 'tensorflow'
+            "backend" : "numpy",
+            "model_short" : "/root/convai/ranker/models/short_term/0.641391/1510248853.21_Estimator_inference.pkl",
+            "model_long" : "/root/convai/ranker/models/long_term/1.4506/1510248853.21_short_term.0641391.151024885321_Estimator__inference.pkl"
         },
         "stopwords" : ['all', 'whoever', 'go', 'whose',
             'to', 'help', 'helps', 'sorry', 'very', 'ha', 'haha',
@@ -1,19 +1,18 @@
 # Simple Script to view the current chat leaderboard
+# Per-user stats are aggregated incrementally: the sums and counts of all users and the
+# last chat folded into them are kept in --state, and each run only reads the chats
+# stored since then, so the leaderboard stays cheap to refresh. Use --full to start over.
 
-import pymongo
 import argparse
 from texttable import Texttable
+from bson.objectid import ObjectId
 import csv
+import os
+import json
+import time
+import calendar
 
-log_db = None  # connect to main logging database
-chat_db = None  # connect to client side chat database
-PORT = 8091
-CLIENT = '132.206.3.23'
-
-client = pymongo.MongoClient(CLIENT, PORT)
-db = client.convai
-log_db = db.dialogs
-chat_db = db.local
+from ranker import dialog_db
 
 
 def valid_chat(usr_turns, bot_turns):
@@ -27,71 +26,132 @@ def valid_chat(usr_turns, bot_turns):
     voted = float(len(novote)) / len(bot_turns) < 0.15  # voted at least 95% of all bot turns
     return long_enough and polite and voted
 
-def get_top_users():
-    local_chats = list(chat_db.find({}))
-    user_dict = {}
-    if len(local_chats) > 0:
-        for local_chat in local_chats:
-            dialogId = local_chat['dialogId']
-            log_chats = list(log_db.find({'dialogId': dialogId}))
-            try:
-                assert len(log_chats) == 1
-            except:
-                continue
-            user = ''
-            user_id = ''
-            for users in log_chats[0]['users']:
-                if users['userType'] == 'ai.ipavlov.communication.TelegramChat':
-                    user = users['username']
-                    user_id = users['id']
-            if user not in user_dict:
-                user_dict[user] = {'valid_chats': 0, 'non-valid_chats': 0, 'total_turns': 0,
-                                   'max_turns': 0, 'min_turns': 99999,
-                                   'average_quality': 0, 'average_breadth': 0, 'average_engagement': 0,
-                                   'average_upvotes': 0, 'average_downvotes': 0}
-            usr_turns = [ch for ch in log_chats[0]['thread'] if ch['userId'] == user_id]
-            bot_turns = [ch for ch in log_chats[0]['thread'] if ch['userId'] != user_id]
-            if valid_chat(usr_turns, bot_turns):
-                user_dict[user]['valid_chats'] += 1
-                user_dict[user]['total_turns'] += len(usr_turns)
-                user_dict[user]['max_turns'] = max(len(usr_turns), user_dict[user]['max_turns'])
-                user_dict[user]['min_turns'] = min(len(usr_turns), user_dict[user]['min_turns'])
-
-                evaluation = {}
-                for evals in log_chats[0]['evaluation']:
-                    if evals['userId'] == user_id:
-                        evaluation = evals
-
-                av_div = 1
-                if user_dict[user]['valid_chats'] > 1:
-                    av_div = 2
-                user_dict[user]['average_quality'] = round(
-                    1.0 * (user_dict[user]['average_quality'] + evaluation['quality']) / av_div, 2)
-                user_dict[user]['average_breadth'] = round(
-                    1.0 * (user_dict[user]['average_breadth'] + evaluation['breadth']) / av_div, 2)
-                user_dict[user]['average_engagement'] = round(
-                    1.0 * (user_dict[user]['average_engagement'] + evaluation['engagement']) / av_div, 2)
-
-                upvotes = len([ch for ch in bot_turns if ch['evaluation'] == 2])
-                downvotes = len([ch for ch in bot_turns if ch['evaluation'] == 1])
-                user_dict[user]['average_upvotes'] = round(
-                    1.0 * (user_dict[user]['average_upvotes'] + upvotes) / av_div, 2)
-                user_dict[user]['average_downvotes'] = round(
-                    1.0 * (user_dict[user]['average_downvotes'] + downvotes) / av_div, 2)
-            else:
-                user_dict[user]['non-valid_chats'] += 1
+# Running per-user sums and counts, so that averages are exact
+STAT_FIELDS = ['valid_chats', 'non-valid_chats', 'total_turns', 'max_turns', 'min_turns',
+               'evaluated_chats', 'sum_quality', 'sum_breadth', 'sum_engagement', 'sum_upvotes', 'sum_downvotes']
+# file keeping the stats of all users and the high-water mark of the last dialog folded into them
+STATE_FILE = 'leaderboard_state.json'
+# dialogs stored in db.local less than GRACE seconds ago may not be in db.dialogs yet:
+# the aggregation stops at the first of them and resumes from there at the next refresh
+GRACE = 600
+
+
+def new_user_stats():
+    stats = dict([(field, 0) for field in STAT_FIELDS])
+    stats['min_turns'] = 99999
+    return stats
+
+
+def load_state(path):
+    """ :return: {'watermark': ObjectId or None, 'users': {username: stats}} """
+    if path is None or not os.path.exists(path):
+        return {'watermark': None, 'users': {}}
+    with open(path, 'r') as handle:
+        state = json.load(handle)
+    if state['watermark'] is not None:
+        state['watermark'] = ObjectId(state['watermark'])
+    return state
+
+
+def save_state(path, state):
+    # write then rename, so that an interrupted refresh keeps the previous state
+    with open(path + '.tmp', 'w') as handle:
+        json.dump({'watermark': str(state['watermark']) if state['watermark'] is not None else None,
+                   'users': state['users']}, handle)
+    os.rename(path + '.tmp', path)
+
+
+def fold_chat(users, log_chat):
+    """ add one chat of the server side to the stats of its user """
+    user = ''
+    user_id = ''
+    for usr in log_chat['users']:
+        if usr['userType'] == 'ai.ipavlov.communication.TelegramChat':
+            user = usr['username']
+            user_id = usr['id']
+    stats = users.setdefault(user, new_user_stats())
+    usr_turns = [ch for ch in log_chat['thread'] if ch['userId'] == user_id]
+    bot_turns = [ch for ch in log_chat['thread'] if ch['userId'] != user_id]
+    if not valid_chat(usr_turns, bot_turns):
+        stats['non-valid_chats'] += 1
+        return
+
+    stats['valid_chats'] += 1
+    stats['total_turns'] += len(usr_turns)
+    stats['max_turns'] = max(len(usr_turns), stats['max_turns'])
+    stats['min_turns'] = min(len(usr_turns), stats['min_turns'])
+    stats['sum_upvotes'] += len([ch for ch in bot_turns if ch['evaluation'] == 2])
+    stats['sum_downvotes'] += len([ch for ch in bot_turns if ch['evaluation'] == 1])
+
+    evaluation = None
+    for evals in log_chat['evaluation']:
+        if evals['userId'] == user_id:
+            evaluation = evals
+    if evaluation is not None:
+        stats['evaluated_chats'] += 1
+        stats['sum_quality'] += evaluation['quality']
+        stats['sum_breadth'] += evaluation['breadth']
+        stats['sum_engagement'] += evaluation['engagement']
+
+
+def update_state(state, db):
+    """
+    Fold the chats stored after the watermark of `state` into its user stats
+    :return: number of chats read
+    """
+    n_chats = 0
+    for local_chat, log_chats in dialog_db.iter_dialogs(db, since=state['watermark'], local_fields=[],
+                                                         servr_fields=['users', 'thread', 'evaluation']):
+        if len(log_chats) != 1:
+            age = time.time() - calendar.timegm(local_chat['_id'].generation_time.utctimetuple())
+            if len(log_chats) == 0 and age < GRACE:
+                break
+            state['watermark'] = local_chat['_id']
+            continue
+        fold_chat(state['users'], log_chats[0])
+        state['watermark'] = local_chat['_id']
+        n_chats += 1
+    return n_chats
+
+
+def user_row(stats):
+    """ leaderboard entry of a user """
+    row = dict((field, stats[field]) for field in ['valid_chats', 'non-valid_chats', 'total_turns', 'max_turns', 'min_turns'])
+    for field in ['quality', 'breadth', 'engagement']:
+        row['average_' + field] = round(1.0 * stats['sum_' + field] / max(1, stats['evaluated_chats']), 2)
+    for field in ['upvotes', 'downvotes']:
+        row['average_' + field] = round(1.0 * stats['sum_' + field] / max(1, stats['valid_chats']), 2)
+    return row
+
+
+def get_top_users(db=None, state_path=None):
+    """
+    :param db: convai database, default: dialog_db.connect()
+    :param state_path: file of the stats aggregated by previous runs, only the chats stored
+      since then are read and the file is updated. default: aggregate all chats
+    """
+    if db is None:
+        db = dialog_db.connect()
+    state = load_state(state_path)
+    n_chats = update_state(state, db)
+    print "Read %d new chats" % n_chats
+    if state_path is not None:
+        save_state(state_path, state)
 
     # Remove users with 0 valid chats:
-    bad_users = filter(lambda uid: user_dict[uid]['valid_chats'] < 1, user_dict.keys())
-    for uid in bad_users:
-        del(user_dict[uid])
-
+    user_dict = dict((user, user_row(stats)) for user, stats in state['users'].iteritems() if stats['valid_chats'] > 0)
     order = reversed(sorted(user_dict.keys(), key=lambda x: user_dict[x]['valid_chats']))
     return user_dict, order
 
-
 if __name__ == '__main__':
-    user_dict, order = get_top_users()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--state', type=str, default=STATE_FILE, help='file keeping the aggregated stats between runs')
+    parser.add_argument('--full', action='store_true', help='recompute the stats from all chats')
+    args = parser.parse_args()
+    if args.full and os.path.exists(args.state):
+        os.remove(args.state)
+
+    user_dict, order = get_top_users(state_path=args.state)
     t = Texttable()
     header_order = ['valid_chats', 'total_turns', 'max_turns', 'min_turns', 'non-valid_chats']
     rows = ['username'] + header_order
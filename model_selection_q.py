@@ -11,7 +11,8 @@ import json
 import cPickle as pkl
 from datetime import datetime
 from ranker import features
-from ranker.estimators import Estimator, LONG_TERM_MODE, SHORT_TERM_MODE
+from ranker import inference
+from ranker.inference import LONG_TERM_MODE, SHORT_TERM_MODE
 from Queue import Queue
 from threading import Thread
 import multiprocessing
@@ -120,43 +121,16 @@ PARENT_PULL_PIPE = 'ipc:///tmp/parent_pull.pipe'
 # Load ranker models
 ###
 
-# short term estimator
-ranker_args_short = []
-with open(conf.ranker['model_short'], 'rb') as fp:
-    data_short, hidden_dims_short, hidden_dims_extra_short, activation_short, \
-        optimizer_short, learning_rate_short, \
-        model_path_short, model_id_short, model_name_short, _, _, _ \
-        = pkl.load(fp)
-# load the feature list used in short term ranker
-feature_list_short = data_short[-1]
-# reconstruct model_path just in case file have been moved:
-model_path_short = conf.ranker['model_short'].split(model_id_short)[0]
-if model_path_short.endswith('/'):
-    model_path_short = model_path_short[:-1]  # ignore the last '/'
-logging.info(model_path_short)
-
-# long term estimator
-ranker_args_long = []
-with open(conf.ranker['model_long'], 'rb') as fp:
-    data_long, hidden_dims_long, hidden_dims_extra_long, activation_long, \
-        optimizer_long, learning_rate_long, \
-        model_path_long, model_id_long, model_name_long, _, _, _ \
-        = pkl.load(fp)
-# load the feature list user in short term ranker
-feature_list_long = data_long[-1]
-# reconstruct model_path just in case file have been moved:
-model_path_long = conf.ranker['model_long'].split(model_id_long)[0]
-if model_path_long.endswith('/'):
-    model_path_long = model_path_long[:-1]  # ignore the last '/'
-logging.info(model_path_long)
-
+# inference-only bundles written by `Estimator.export()`: architecture,
+# feature list and weights of each estimator, without their training data
+ranker_short = inference.load_bundle(conf.ranker['model_short'])
+ranker_long = inference.load_bundle(conf.ranker['model_long'])
+logging.info("short term ranker: {}_{}".format(ranker_short['model_id'], ranker_short['model_name']))
+logging.info("long term ranker: {}_{}".format(ranker_long['model_id'], ranker_long['model_name']))
+# load the feature list used in short and long term rankers
+feature_list_short = ranker_short['feature_list']
+feature_list_long = ranker_long['feature_list']
 assert feature_list_short == feature_list_long
-# NOTE: could also check equality between the following variables, but its redundant:
-# - hidden_dims_short       & hidden_dims_long
-# - hidden_dims_extra_short & hidden_dims_extra_long
-# - activation_short        & activation_long
-# - optimizer_short         & optimizer_long
-# - learning_rate_short     & learning_rate_long
 
 logging.info("creating ranker feature instances...")
 start_creation_time = time.time()
@@ -250,44 +224,13 @@ class ModelClient(multiprocessing.Process):
             self.estimate = True  # always sampled according to score 
 
         self.is_running = True
-        import tensorflow as tf
         logging.info("Building NN Ranker")
-        ###
-        # Build NN ranker models and set their parameters
-        ###
-        # NOTE: stupid theano can't load two graph within the same session -_-
-        # SOLUTION: taken from https://stackoverflow.com/a/41646443
-        self.model_graph_short = tf.Graph()
-        with self.model_graph_short.as_default():
-            self.estimator_short = Estimator(
-                data_short, hidden_dims_short, hidden_dims_extra_short, activation_short,
-                optimizer_short, learning_rate_short,
-                model_path_short, model_id_short, model_name_short
-            )
-        self.model_graph_long = tf.Graph()
-        with self.model_graph_long.as_default():
-            self.estimator_long = Estimator(
-                data_long, hidden_dims_long, hidden_dims_extra_long, activation_long,
-                optimizer_long, learning_rate_long,
-                model_path_long, model_id_long, model_name_long
-            )
-        logging.info("Init tf session")
-        # Wrap ANY call to the rankers within those two sessions:
-        self.sess_short = tf.Session(graph=self.model_graph_short)
-        self.sess_long = tf.Session(graph=self.model_graph_long)
-        logging.info("Done init tf session")
-        # example: reload trained parameters
-        logging.info("Loading trained params short-term estimator")
-        with self.sess_short.as_default():
-            with self.model_graph_short.as_default():
-                self.estimator_short.load(
-                    self.sess_short, model_path_short, model_id_short, model_name_short)
-        logging.info("Loading trained params long-term estimator")
-        with self.sess_long.as_default():
-            with self.model_graph_long.as_default():
-                self.estimator_long.load(
-                    self.sess_long, model_path_long, model_id_long, model_name_long)
-
+        # forward passes of both estimators, evaluated together
+        self.estimator = inference.build_estimator(
+            {SHORT_TERM_MODE: ranker_short, LONG_TERM_MODE: ranker_long},
+            conf.ranker['backend'])
+        # input of the estimators, filled in place for every candidate
+        self.candidate_vector = np.zeros((1, feature_dim), dtype=np.float32)
         logging.info("Done building NN ranker")
 
         self.warmup()
@@ -337,27 +280,17 @@ class ModelClient(multiprocessing.Process):
                     # Run approximator and save the score in packet
                     logging.info(
                         "Scoring the candidate response for model {}".format(self.model_name))
-                    # reshape raw_features to fit the ranker format
+                    # copy raw_features in the ranker input of shape (1, input)
                     assert len(raw_features) == feature_dim
-                    candidate_vector = raw_features.reshape(
-                        1, feature_dim)  # make an array of shape (1, input)
-                    # Get predictions for this candidate response:
-                    with self.sess_short.as_default():
-                        with self.model_graph_short.as_default():
-                            logging.info("estimator short predicting")
-                            # get predicted class (0: downvote, 1: upvote), and confidence (ie: proba of upvote)
-                            vote, conf = self.estimator_short.predict(
-                                SHORT_TERM_MODE, candidate_vector)
-                            # sanity check with batch size of 1
-                            assert len(vote) == len(conf) == 1
-                    with self.sess_long.as_default():
-                        with self.model_graph_long.as_default():
-                            logging.info("estimator long prediction")
-                            # get the predicted end-of-dialogue score:
-                            pred, _ = self.estimator_long.predict(
-                                LONG_TERM_MODE, candidate_vector)
-                            # sanity check with batch size of 1
-                            assert len(pred) == 1
+                    self.candidate_vector[0] = raw_features
+                    # Get predictions for this candidate response, both estimators in one pass:
+                    # predicted class (0: downvote, 1: upvote), confidence (ie: proba of upvote)
+                    # and predicted end-of-dialogue score
+                    logging.info("estimators predicting")
+                    (vote, conf), (pred, _) = self.estimator.predict(
+                        [SHORT_TERM_MODE, LONG_TERM_MODE], self.candidate_vector)
+                    # sanity check with batch size of 1
+                    assert len(vote) == len(conf) == len(pred) == 1
                     vote = vote[0]  # 0 = downvote ; 1 = upvote
                     conf = conf[0]  # 0.0 < Pr(upvote) < 1.0
                     score = pred[0]  # 1.0 < end-of-chat score < 5.0
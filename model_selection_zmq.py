@@ -10,14 +10,17 @@ import emoji
 import json
 import cPickle as pkl
 from datetime import datetime
+from collections import deque, OrderedDict
 from ranker import features
-from ranker.estimators import Estimator, LONG_TERM_MODE, SHORT_TERM_MODE
+from ranker import inference
+from ranker.inference import LONG_TERM_MODE, SHORT_TERM_MODE
 from Queue import Queue
-from threading import Thread
+from threading import Thread, Lock
 from multiprocessing import Pool, Process
+import argparse
+import platform
 import uuid
-from models.wrapper import Dual_Encoder_Wrapper, Human_Imitator_Wrapper, HREDQA_Wrapper, CandidateQuestions_Wrapper, DumbQuestions_Wrapper, DRQA_Wrapper, NQG_Wrapper, Echo_Wrapper, Topic_Wrapper, FactGenerator_Wrapper, AliceBot_Wrapper
-from models.wrapper import HRED_Wrapper
+import tracing
 import logging
 logging.basicConfig(
     level=logging.INFO,
@@ -100,193 +103,221 @@ BORED_COUNT = 2
 # do not wait for them!
 WAIT_TIME = 7
 
+# Latency budgets
+# Each model gets a budget learned from its last LATENCY_WINDOW response times
+# (the BUDGET_PERCENTILE-th percentile, capped to WAIT_TIME). A turn commits as
+# soon as the best candidate beats the expected value of waiting for the
+# models still within their budget. Until a model has MIN_LATENCY_SAMPLES,
+# its budget is WAIT_TIME and we always wait for it.
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+BUDGET_PERCENTILE = 95
+# time between two checks of the incoming responses, in seconds
+SELECTION_TICK = 0.05
+# selection statistics are dumped there by the main loop
+SELECTION_STATS_FILE = '/tmp/selection_stats.json'
+
+# Turn tracing: per stage and per model histograms are dumped there every
+# TRACE_DUMP_PERIOD seconds
+TRACE_FILE = '/tmp/model_selection_trace.json'
+TRACE_DUMP_PERIOD = 60
+tracer = tracing.Tracer('model_selection')
+
 # PINGBACK
 # Check every time if the time now - time last pinged back of a model
 # is within PING_TIME. If not, revive
 PING_TIME = 60
 
-# IPC pipes
+# ZMQ pipes, IPC by default. Set tcp:// endpoints in config.py to run
+# model clients on other hosts (see `--clients_only`)
 # Parent to models
-COMMAND_PIPE = 'ipc:///tmp/command.pipe'
+COMMAND_PIPE = conf.zmq['command_bind']
+COMMAND_PIPE_CONNECT = conf.zmq['command_connect']
 # models to parent
-BUS_PIPE = 'ipc:///tmp/bus.pipe'
+BUS_PIPE = conf.zmq['bus_bind']
+BUS_PIPE_CONNECT = conf.zmq['bus_connect']
 # parent to bot caller
-PARENT_PIPE = 'ipc:///tmp/parent_push.pipe'
+PARENT_PIPE = conf.zmq['parent_push']
 # bot to parent caller
-PARENT_PULL_PIPE = 'ipc:///tmp/parent_pull.pipe'
+PARENT_PULL_PIPE = conf.zmq['parent_pull']
 
 ###
 # Load ranker models
 ###
 
-# short term estimator
-ranker_args_short = []
-with open(conf.ranker['model_short'], 'rb') as fp:
-    data_short, hidden_dims_short, hidden_dims_extra_short, activation_short, \
-        optimizer_short, learning_rate_short, \
-        model_path_short, model_id_short, model_name_short, _, _, _ \
-        = pkl.load(fp)
-# load the feature list used in short term ranker
-feature_list_short = data_short[-1]
-# reconstruct model_path just in case file have been moved:
-model_path_short = conf.ranker['model_short'].split(model_id_short)[0]
-if model_path_short.endswith('/'):
-    model_path_short = model_path_short[:-1]  # ignore the last '/'
-logging.info(model_path_short)
-
-# long term estimator
-ranker_args_long = []
-with open(conf.ranker['model_long'], 'rb') as fp:
-    data_long, hidden_dims_long, hidden_dims_extra_long, activation_long, \
-        optimizer_long, learning_rate_long, \
-        model_path_long, model_id_long, model_name_long, _, _, _ \
-        = pkl.load(fp)
-# load the feature list user in short term ranker
-feature_list_long = data_long[-1]
-# reconstruct model_path just in case file have been moved:
-model_path_long = conf.ranker['model_long'].split(model_id_long)[0]
-if model_path_long.endswith('/'):
-    model_path_long = model_path_long[:-1]  # ignore the last '/'
-logging.info(model_path_long)
-
+# inference-only bundles written by `Estimator.export()`: architecture,
+# feature list and weights of each estimator, without their training data
+ranker_short = inference.load_bundle(conf.ranker['model_short'])
+ranker_long = inference.load_bundle(conf.ranker['model_long'])
+logging.info("short term ranker: {}_{}".format(ranker_short['model_id'], ranker_short['model_name']))
+logging.info("long term ranker: {}_{}".format(ranker_long['model_id'], ranker_long['model_name']))
+# load the feature list used in short and long term rankers
+feature_list_short = ranker_short['feature_list']
+feature_list_long = ranker_long['feature_list']
 assert feature_list_short == feature_list_long
-# NOTE: could also check equality between the following variables, but its redundant:
-# - hidden_dims_short       & hidden_dims_long
-# - hidden_dims_extra_short & hidden_dims_extra_long
-# - activation_short        & activation_long
-# - optimizer_short         & optimizer_long
-# - learning_rate_short     & learning_rate_long
+
+
+def replica_name(idx):
+    """ unique id of the `idx`-th replica of a model started on this host """
+    return '{}-{}'.format(platform.node(), idx)
+
+
+def replica_topic(model_name, replica_id):
+    """ topic on which a single model replica listens for its jobs """
+    return '{}:{}'.format(model_name, replica_id)
 
 
 class ModelClient():
     """
     Client Process for individual models. Initialize the model
     and subscribe to channel to listen for updates
+    Several replicas of the same model can run at once, each one
+    only receives the jobs routed to its own `replica_id`
     """
 
-    def __init__(self, model_name, estimate=True):
+    def __init__(self, model_name, estimate=True, replica_id=None):
         # Process.__init__(self)
         self.model_name = model_name
         self.estimate = estimate
-        # select and initialize models
+        self.replica_id = replica_id if replica_id else replica_name(0)
+        self.topic = replica_topic(model_name, self.replica_id)
+        # message queue. This contains the responses generated by the model
+        self.queue = Queue()
+        # process queue. This contains the responses to be processed
+        self.process_queue = Queue()
+        self.is_running = True
+        # loading / ready / failed, reported to the parent with each ack
+        self.status = 'loading'
+        self.discard_list = set()
+        self.done_process = set()
+        # preprocess messages received while the model is loading, applied once it is ready
+        self.pending_preprocess = []
+        self.preprocess_lock = Lock()
+        # open the channels right away, the model is loaded in the background
+        self.run()
+
+    def load(self):
+        """ Load the model and the rankers and warm them up, then start
+        processing jobs. Runs in its own thread so that the client keeps
+        reporting its status to the parent in the meantime
+        """
+        start = time.time()
+        try:
+            self.load_model()
+            # rankers are only needed by the models sampled according to their score
+            if self.estimate:
+                self.load_rankers()
+            self.warmup()
+        except Exception as e:
+            logging.exception("Failed to load model {}".format(self.model_name))
+            with self.preprocess_lock:
+                self.pending_preprocess = []
+                self.status = 'failed'
+            self.ack()
+            return
+        logging.info("Model {} ready in {:.1f}s".format(
+            self.model_name, time.time() - start))
+        with self.preprocess_lock:
+            # articles of the chats started while loading
+            for msg in self.pending_preprocess:
+                self.apply_preprocess(msg)
+            self.pending_preprocess = []
+            self.status = 'ready'
+        self.ack()
+        logging.info("Starting {} process thread".format(self.model_name))
+        process_thread = Thread(target=self.process)
+        process_thread.daemon = True
+        process_thread.start()
+
+    def load_model(self):
+        """ select and initialize models. Runs in the loader thread of the client:
+        the libraries of the model are only imported by its own client process
+        """
+        from models import wrapper
+        model_name = self.model_name
         if model_name == ModelID.HRED_REDDIT:
             logging.info("Initializing HRED Reddit")
-            self.model = HRED_Wrapper(conf.hred['reddit_model_prefix'],
-                                      conf.hred['reddit_dict_file'],
-                                      ModelID.HRED_REDDIT)
+            self.model = wrapper.HRED_Wrapper(conf.hred['reddit_model_prefix'],
+                                              conf.hred['reddit_dict_file'],
+                                              ModelID.HRED_REDDIT)
             self.estimate = True  # always sampled according to score
         if model_name == ModelID.HRED_TWITTER:
             logging.info("Initializing HRED Twitter")
-            self.model = HRED_Wrapper(conf.hred['twitter_model_prefix'],
-                                      conf.hred['twitter_dict_file'],
-                                      ModelID.HRED_TWITTER)
+            self.model = wrapper.HRED_Wrapper(conf.hred['twitter_model_prefix'],
+                                              conf.hred['twitter_dict_file'],
+                                              ModelID.HRED_TWITTER)
             self.estimate = True  # always sampled according to score
         # if model_name == ModelID.FOLLOWUP_QA:
         #     logging.info("Initializing HRED Followup")
-        #     self.model = HREDQA_Wrapper(conf.followup['model_prefix'],
-        #                                 conf.followup['dict_file'],
-        #                                 ModelID.FOLLOWUP_QA)
+        #     self.model = wrapper.HREDQA_Wrapper(conf.followup['model_prefix'],
+        #                                         conf.followup['dict_file'],
+        #                                         ModelID.FOLLOWUP_QA)
         #     self.estimate = True  # sampled according to score when user didn't ask a question
         if model_name == ModelID.DUAL_ENCODER:
             logging.info("Initializing Dual Encoder")
-            self.model = Dual_Encoder_Wrapper(conf.de['reddit_model_prefix'],
-                                              conf.de['reddit_data_file'],
-                                              conf.de['reddit_dict_file'],
-                                              ModelID.DUAL_ENCODER)
+            self.model = wrapper.Dual_Encoder_Wrapper(conf.de['reddit_model_prefix'],
+                                                      conf.de['reddit_data_file'],
+                                                      conf.de['reddit_dict_file'],
+                                                      ModelID.DUAL_ENCODER)
             self.estimate = True  # always sampled according to score
         if model_name == ModelID.HUMAN_IMITATOR:
             logging.info("Initializing Dual Encoder on Human data")
-            self.model = Human_Imitator_Wrapper(conf.de['convai-h2h_model_prefix'],
-                                                conf.de['convai-h2h_data_file'],
-                                                conf.de['convai-h2h_dict_file'],
-                                                ModelID.HUMAN_IMITATOR)
+            self.model = wrapper.Human_Imitator_Wrapper(conf.de['convai-h2h_model_prefix'],
+                                                        conf.de['convai-h2h_data_file'],
+                                                        conf.de['convai-h2h_dict_file'],
+                                                        ModelID.HUMAN_IMITATOR)
             self.estimate = True  # sampled according to score when user is bored
         if model_name == ModelID.DRQA:
             logging.info("Initializing DRQA")
-            self.model = DRQA_Wrapper('', '', ModelID.DRQA)
+            self.model = wrapper.DRQA_Wrapper('', '', ModelID.DRQA)
         if model_name == ModelID.DUMB_QA:
             logging.info("Initializing DUMB QA")
-            self.model = DumbQuestions_Wrapper(
+            self.model = wrapper.DumbQuestions_Wrapper(
                 '', conf.dumb['dict_file'], ModelID.DUMB_QA)
             self.estimate = False  # only used when user typed a simple enough turn
         if model_name == ModelID.NQG:
             logging.info("Initializing NQG")
-            self.model = NQG_Wrapper('', '', ModelID.NQG)
+            self.model = wrapper.NQG_Wrapper('', '', ModelID.NQG)
             # sampled according to score when user is bored or when user didn't ask a question
             self.estimate = True
         # if model_name == ModelID.ECHO:
         #     logging.info("Initializing Echo")
-        #     self.model = Echo_Wrapper('', '', ModelID.ECHO)
+        #     self.model = wrapper.Echo_Wrapper('', '', ModelID.ECHO)
         #     self.estimate = False
         if model_name == ModelID.CAND_QA:
             logging.info("Initializing Candidate Questions")
-            self.model = CandidateQuestions_Wrapper('',
-                                                    conf.candidate['dict_file'],
-                                                    ModelID.CAND_QA)
+            self.model = wrapper.CandidateQuestions_Wrapper('',
+                                                            conf.candidate['dict_file'],
+                                                            ModelID.CAND_QA)
             # sampled according to score when user is bored or when user didn't ask a question
             self.estimate = True
         if model_name == ModelID.TOPIC:
             logging.info("Initializing topic model")
-            self.model = Topic_Wrapper('', '', '', conf.topic['dir_name'],
-                                       conf.topic['model_name'], conf.topic['top_k'])
+            self.model = wrapper.Topic_Wrapper('', '', '', conf.topic['dir_name'],
+                                               conf.topic['model_name'], conf.topic['top_k'])
             self.estimate = False  # only used when user requested article topic
         if model_name == ModelID.FACT_GEN:
             logging.info("Initializing fact generator")
-            self.model = FactGenerator_Wrapper('', '', '')
+            self.model = wrapper.FactGenerator_Wrapper('', '', '')
             self.estimate = True  # sampled according to score when user is bored
         if model_name == ModelID.ALICEBOT:
             logging.info("Initializing Alicebot")
-            self.model = AliceBot_Wrapper('', '', '')
+            self.model = wrapper.AliceBot_Wrapper('', '', '')
             self.estimate = True  # always sampled according to score
-        # message queue. This contains the responses generated by the model
-        self.queue = Queue()
-        # process queue. This contains the responses to be processed
-        self.process_queue = Queue()
-        self.is_running = True
-        import tensorflow as tf
-        logging.info("Building NN Ranker")
-        ###
-        # Build NN ranker models and set their parameters
-        ###
-        # NOTE: stupid theano can't load two graph within the same session -_-
-        # SOLUTION: taken from https://stackoverflow.com/a/41646443
-        self.model_graph_short = tf.Graph()
-        with self.model_graph_short.as_default():
-            self.estimator_short = Estimator(
-                data_short, hidden_dims_short, hidden_dims_extra_short, activation_short,
-                optimizer_short, learning_rate_short,
-                model_path_short, model_id_short, model_name_short
-            )
-        self.model_graph_long = tf.Graph()
-        with self.model_graph_long.as_default():
-            self.estimator_long = Estimator(
-                data_long, hidden_dims_long, hidden_dims_extra_long, activation_long,
-                optimizer_long, learning_rate_long,
-                model_path_long, model_id_long, model_name_long
-            )
-        logging.info("Init session")
-        # Wrap ANY call to the rankers within those two sessions:
-        self.sess_short = tf.Session(graph=self.model_graph_short)
-        self.sess_long = tf.Session(graph=self.model_graph_long)
-        logging.info("Done init session")
-        # example: reload trained parameters
-        logging.info("Loading trained params short")
-        with self.sess_short.as_default():
-            with self.model_graph_short.as_default():
-                self.estimator_short.load(
-                    self.sess_short, model_path_short, model_id_short, model_name_short)
-        logging.info("Loading trained params long")
-        with self.sess_long.as_default():
-            with self.model_graph_long.as_default():
-                self.estimator_long.load(
-                    self.sess_long, model_path_long, model_id_long, model_name_long)
 
+    def load_rankers(self):
+        logging.info("Building NN Ranker")
+        # forward passes of both estimators, evaluated together
+        self.estimator = inference.build_estimator(
+            {SHORT_TERM_MODE: ranker_short, LONG_TERM_MODE: ranker_long},
+            conf.ranker['backend'])
+        # feature instances, computed again for every candidate
+        # recall: `feature_list_short` & `feature_list_long` are the same
+        self.feature_objects, self.feature_dim = features.initialize_features(feature_list_short)
+        assert self.feature_dim == self.estimator.input_dim
+        # input of the estimators, filled in place for every candidate
+        self.candidate_vector = np.zeros((1, self.feature_dim), dtype=np.float32)
         logging.info("Done building NN")
-        self.discard_list = set()
-        self.done_process = set()
-
-        self.warmup()
-        self.run()
 
     def warmup(self):
         """ Warm start the models before execution """
@@ -296,11 +327,35 @@ class ModelClient():
             _, _ = self.model.get_response(1, 'Where is Daniel?', [], nlp(
                 unicode('Daniel went to the kitchen')))
 
+    def preprocess(self, msg):
+        """ Give the article of a chat to the model. Kept until the model
+        is loaded if it is still loading, dropped if loading failed
+        """
+        with self.preprocess_lock:
+            if self.status == 'loading':
+                self.pending_preprocess.append(msg)
+            elif self.status == 'ready':
+                self.apply_preprocess(msg)
+
+    def apply_preprocess(self, msg):
+        if 'chat_id' in msg:
+            msg['user_id'] = msg['chat_id']
+        try:
+            self.model.preprocess(**msg)
+        except Exception:
+            logging.exception("Model {} failed to preprocess chat {}".format(
+                self.model_name, msg.get('chat_id')))
+
+    def ack(self):
+        """ Ping back to let parent know we are alive, and if we are ready """
+        self.queue.put({'control': 'ack', 'model_name': self.model_name,
+                        'replica': self.replica_id, 'status': self.status})
+
     def respond(self):
         """ Reply to the master on PUSH channel with the responses generated
         """
         socket = self.producer_context.socket(zmq.PUSH)
-        socket.connect(BUS_PIPE)
+        socket.connect(BUS_PIPE_CONNECT)
         logging.info("Model {} push channel active".format(self.model_name))
         while self.is_running:
             msg = self.queue.get()
@@ -317,11 +372,13 @@ class ModelClient():
         If msg contains key "control", process and exit
         """
         socket_b = self.consumer_context.socket(zmq.SUB)
-        socket_b.connect(COMMAND_PIPE)
+        socket_b.connect(COMMAND_PIPE_CONNECT)
         socket_b.setsockopt(zmq.SUBSCRIBE, "user_response")
-        # also subscribe to self topic
-        socket_b.setsockopt(zmq.SUBSCRIBE, self.model_name)
-        logging.info("Model {} subscribed to channels".format(self.model_name))
+        # also subscribe to self topic. The trailing space added by mogrify()
+        # makes sure `model:host-1` does not also receive `model:host-10` jobs
+        socket_b.setsockopt(zmq.SUBSCRIBE, self.topic + ' ')
+        logging.info("Model {} subscribed to channels as {}".format(
+            self.model_name, self.replica_id))
         while self.is_running:
             packet = socket_b.recv()
             topic, msg = demogrify(packet)
@@ -330,9 +387,7 @@ class ModelClient():
                     logging.info(
                         "Model {} received init".format(self.model_name))
                 if msg['control'] == 'preprocess':
-                    if 'chat_id' in msg:
-                        msg['user_id'] = msg['chat_id']
-                    self.model.preprocess(**msg)
+                    self.preprocess(msg)
                 if msg['control'] == 'discard':
                     if msg['chat_unique_id'] in self.done_process:
                         self.done_process.discard(msg['chat_unique_id'])
@@ -345,7 +400,7 @@ class ModelClient():
 
             else:
                 try:
-                    self.process_queue.put({'msg': msg})
+                    self.process_queue.put(tracing.stamp({'msg': msg}, 'received'))
 
                 except Exception as e:
                     logging.error(e)
@@ -358,13 +413,19 @@ class ModelClient():
         while(self.is_running):
             proc_msg = self.process_queue.get()
             msg = proc_msg['msg']
+            # time spent in each stage, sent back to the parent for tracing
+            timings = {'client_queue': tracing.since(proc_msg, 'received')}
+            if 'sent_at' in msg:
+                timings['broadcast'] = proc_msg['received'] - msg['sent_at']
             if 'chat_unique_id' not in msg:
                 self.process_queue.task_done()
                 continue
             elif  msg['chat_unique_id'] not in self.discard_list:
                 if 'chat_id' in msg:
                     msg['user_id'] = msg['chat_id']
+                    start = tracing.now()
                     response, context = self.model.get_response(**msg)
+                    timings['get_response'] = tracing.now() - start
 
                 # if blank response, do not push it in the channel
                 if len(response) > 0:
@@ -372,39 +433,33 @@ class ModelClient():
                         # calculate NN estimation
                         logging.info(
                             "Start feature calculation for model {}".format(self.model_name))
-                        feat = features.get(
-                            msg['article_text'], msg['all_context'] +
-                            [context[-1]],
-                            response, feature_list_short)
-                        # recall: `feature_list_short` & `feature_list_long` are the same
+                        start = tracing.now()
+                        raw_features = features.get(
+                            self.feature_objects,
+                            self.feature_dim,
+                            msg['article_text'],
+                            msg['all_context'] + [context[-1]],
+                            response
+                        )
+                        timings['features'] = tracing.now() - start
                         logging.info(
                             "Done feature calculation for model {}".format(self.model_name))
                         # Run approximator and save the score in packet
                         logging.info(
                             "Scoring the candidate response for model {}".format(self.model_name))
-                        # Get the input vector to the estimators from the feature instances lise:
-                        candidate_vector = np.concatenate(
-                            [feat[idx].feat for idx in range(len(feature_list_short))])
-                        input_dim = len(candidate_vector)
-                        candidate_vector = candidate_vector.reshape(
-                            1, input_dim)  # make an array of shape (1, input)
-                        # Get predictions for this candidate response:
-                        with self.sess_short.as_default():
-                            with self.model_graph_short.as_default():
-                                logging.info("estimator short predicting")
-                                # get predicted class (0: downvote, 1: upvote), and confidence (ie: proba of upvote)
-                                vote, conf = self.estimator_short.predict(
-                                    SHORT_TERM_MODE, candidate_vector)
-                                # sanity check with batch size of 1
-                                assert len(vote) == len(conf) == 1
-                        with self.sess_long.as_default():
-                            with self.model_graph_long.as_default():
-                                logging.info("estimator long prediction")
-                                # get the predicted end-of-dialogue score:
-                                pred, _ = self.estimator_long.predict(
-                                    LONG_TERM_MODE, candidate_vector)
-                                # sanity check with batch size of 1
-                                assert len(pred) == 1
+                        # copy raw_features in the ranker input of shape (1, input)
+                        assert len(raw_features) == self.feature_dim
+                        self.candidate_vector[0] = raw_features
+                        start = tracing.now()
+                        # Get predictions for this candidate response, both estimators in one pass:
+                        # predicted class (0: downvote, 1: upvote), confidence (ie: proba of upvote)
+                        # and predicted end-of-dialogue score
+                        logging.info("estimators predicting")
+                        (vote, conf), (pred, _) = self.estimator.predict(
+                            [SHORT_TERM_MODE, LONG_TERM_MODE], self.candidate_vector)
+                        # sanity check with batch size of 1
+                        assert len(vote) == len(conf) == len(pred) == 1
+                        timings['predict'] = tracing.now() - start
                         vote = vote[0]  # 0 = downvote ; 1 = upvote
                         conf = conf[0]  # 0.0 < Pr(upvote) < 1.0
                         score = pred[0]  # 1.0 < end-of-chat score < 5.0
@@ -415,13 +470,23 @@ class ModelClient():
 
                     resp_msg = {'text': response, 'context': context,
                                 'model_name': self.model_name,
+                                'replica': self.replica_id,
                                 'chat_id': msg['chat_id'],
                                 'chat_unique_id': msg['chat_unique_id'],
                                 'vote': str(vote),
                                 'conf': str(conf),
-                                'score': str(score)}
+                                'score': str(score),
+                                'timings': timings}
                     self.queue.put(resp_msg)
                     self.done_process.add(msg['chat_unique_id'])
+                else:
+                    # let the parent know we are done so it doesn't wait for us
+                    self.queue.put({'control': 'done',
+                                    'model_name': self.model_name,
+                                    'replica': self.replica_id,
+                                    'chat_id': msg['chat_id'],
+                                    'chat_unique_id': msg['chat_unique_id'],
+                                    'timings': timings})
             else:
                 # discard
                 self.discard_list.discard(msg['chat_unique_id'])
@@ -444,14 +509,13 @@ class ModelClient():
             act_thread = Thread(target=self.act)
             act_thread.daemon = True
             act_thread.start()
-            logging.info("Starting {} process thread".format(self.model_name))
-            process_thread = Thread(target=self.process)
-            process_thread.daemon = True
-            process_thread.start()
+            logging.info("Loading {} in the background".format(self.model_name))
+            load_thread = Thread(target=self.load)
+            load_thread.daemon = True
+            load_thread.start()
             while self.is_running:
                 # Ping back to let parent know its alive
-                self.queue.put(
-                    {'control': 'ack', 'model_name': self.model_name})
+                self.ack()
                 time.sleep(10)
             logging.info("Exiting {} client".format(self.model_name))
         except (KeyboardInterrupt, SystemExit):
@@ -460,8 +524,8 @@ class ModelClient():
     def shutdown(self):
         """Clean shutdown process"""
         logging.info("Shutting down {} client".format(self.model_name))
-        self.sess_short.close()
-        self.sess_long.close()
+        if hasattr(self, 'estimator'):
+            self.estimator.close()
         sys.exit(0)
 
 
@@ -476,6 +540,21 @@ boring_count = {}     # number of times the user responded with short answer
 job_queue = Queue()
 response_queue = Queue()
 model_responses = {}
+# models which answered with an empty response, per chat_unique_id
+model_done = {}
+# time at which the jobs of each chat_unique_id have been submitted
+turn_start = {}
+# chat_unique_id -> rank score of the selected response, kept to evaluate late arrivals
+committed = OrderedDict()
+MAX_COMMITTED = 1000
+# statistics to tune the selection policy, see dump_selection_stats()
+selection_stats = {
+    'turns': 0,
+    'early_commits': 0,         # committed before every model in budget answered
+    'decision_time': deque(maxlen=LATENCY_WINDOW),
+    'late': {},                 # model -> nb of responses arrived after commit
+    'would_have_won': {},       # model -> nb of late responses better than the selected one
+}
 # This dictionary should contain an array per chat_id on the history of used models
 used_models = {}
 
@@ -510,11 +589,105 @@ modelIds = [
 
 # last ack time, contains datetimes
 ack_times = {model: None for model in modelIds}
+# recent response times (seconds) and rank scores (conf * score) of each model
+latency_history = {model: deque(maxlen=LATENCY_WINDOW) for model in modelIds}
+score_history = {model: deque(maxlen=LATENCY_WINDOW) for model in modelIds}
+
+# Replica routing
+# Every model can be served by several ModelClient replicas, local or on
+# other hosts. Replicas are discovered through their acks. All jobs of a chat
+# go to the same replica of each model since wrappers keep per chat state,
+# and new chats are pinned to the replica with the fewest jobs in flight.
+replica_acks = {model: {} for model in modelIds}  # model -> replica -> last ack
+replica_status = {}  # (model, replica) -> loading / ready / failed
+inflight = {}        # (model, replica) -> set of pending chat_unique_ids
+chat_replicas = {}   # chat_id -> {model: replica}
+preprocessed = {}    # chat_id -> set of (model, replica) which got the article of the chat
+dispatched = {}      # chat_unique_id -> list of (model, replica) that got the job
+routing_lock = Lock()
+
+
+def register_replica(model, replica, ack_time=None, status='loading'):
+    with routing_lock:
+        replica_acks.setdefault(model, {})[replica] = ack_time
+        inflight.setdefault((model, replica), set())
+        if replica_status.get((model, replica)) != status:
+            logging.info("Model {} replica {} is {}".format(model, replica, status))
+        replica_status[(model, replica)] = status
+
+
+def live_replicas(model):
+    """ ready replicas of `model` which pinged back within PING_TIME """
+    now = datetime.now()
+    known = replica_acks.get(model, {})
+    return [r for r, t in known.iteritems()
+            if t and (now - t).total_seconds() <= PING_TIME
+            and replica_status.get((model, r)) == 'ready']
+
+
+def ready_models():
+    """ models with at least one replica ready to serve """
+    return [model for model in replica_acks if live_replicas(model)]
+
+
+def route(model, chat_id):
+    """ Return the replica of `model` serving `chat_id`, or None if there is none.
+    Keep the chat on its previous replica while it is alive, else pin it to
+    the least loaded one
+    """
+    with routing_lock:
+        alive = live_replicas(model)
+        if not alive:
+            return None
+        pinned = chat_replicas.setdefault(chat_id, {})
+        if pinned.get(model) not in alive:
+            pinned[model] = min(alive, key=lambda r: len(inflight[(model, r)]))
+            if chat_id in article_text and \
+                    (model, pinned[model]) not in preprocessed.get(chat_id, ()):
+                # the replica joined after the start of the chat: give it the
+                # article before the jobs of the chat
+                replay_article(model, pinned[model], chat_id)
+        return pinned[model]
+
+
+def replay_article(model, replica, chat_id):
+    """ Send the preprocess job of `chat_id` to one replica of `model` """
+    logging.info("Sending article of chat {} to model {} replica {}".format(
+        chat_id, model, replica))
+    preprocessed.setdefault(chat_id, set()).add((model, replica))
+    job_queue.put({'type': 'preprocess', 'control': 'preprocess', 'context': [],
+                   'text': '', 'chat_id': chat_id, 'chat_unique_id': '',
+                   'article_text': article_text[chat_id], 'all_context': None,
+                   'topic': replica_topic(model, replica), 'sent_at': tracing.now()})
+
+
+def release(chat_unique_id, model=None, replica=None):
+    """ Remove `chat_unique_id` from the in flight jobs of one replica, or of
+    all the replicas it was dispatched to. Return the released replicas
+    """
+    with routing_lock:
+        if model is not None:
+            inflight.get((model, replica), set()).discard(chat_unique_id)
+            return [(model, replica)]
+        targets = dispatched.pop(chat_unique_id, [])
+        for target in targets:
+            inflight.get(target, set()).discard(chat_unique_id)
+        return targets
 
 # TODO: make sure not used in other files before removing
 # dumb_qa_model = DumbQuestions_Wrapper('', conf.dumb['dict_file'], ModelID.DUMB_QA)
 
 
+def start_client(model, replica):
+    """ Start one replica of `model` in its own Process
+    """
+    register_replica(model, replica)
+    proc = Process(target=ModelClient, args=(model,),
+                   kwargs={'replica_id': replica})
+    proc.start()
+    return proc
+
+
 def start_models():
     """ Warmup models in separate Process
     """
@@ -536,24 +709,56 @@ def submit_job(job_type='preprocess', to_model=ModelID.ALL,
                context=None, text='', chat_id='', chat_unique_id='',
                article='', all_context=None):
     """ Submit Jobs to job queue, which will be consumed by the responder
+    Each job is routed to one replica per model, see `route()`, except for
+    preprocess jobs which go to every replica
     :job_type = preprocess / get_response / exit / discard
     :to_model = all / specific model name
     """
-    topic = 'user_response'
-    if to_model != ModelID.ALL:
-        topic = to_model
     # check if article is spacy instance
     if article and not isinstance(article, basestring):
         article = article.text
     if not context:
         context = []
-    job = {'type': job_type, 'topic': topic, 'context': context,
+    job = {'type': job_type, 'context': context,
            'text': text, 'chat_id': chat_id, 'chat_unique_id': chat_unique_id,
            'article_text': article, 'all_context': all_context}
     if job_type == 'preprocess' or job_type == 'exit' or job_type == 'discard':
         job['control'] = job_type
 
-    job_queue.put(job)
+    if job_type == 'exit':
+        job['topic'] = 'user_response'
+        job_queue.put(job)
+        return
+    if job_type == 'discard':
+        # only the replicas which got the job need to drop it
+        targets = release(chat_unique_id)
+    elif job_type == 'preprocess':
+        # every replica keeps the article so that the chat can move to any of them,
+        # the ones still loading apply it once ready. See `route()` for later replicas
+        models = modelIds if to_model == ModelID.ALL else [to_model]
+        with routing_lock:
+            targets = [(model, replica) for model in models
+                       for replica in replica_acks.get(model, {})]
+            preprocessed.setdefault(chat_id, set()).update(targets)
+    else:
+        models = modelIds if to_model == ModelID.ALL else [to_model]
+        targets = []
+        for model in models:
+            replica = route(model, chat_id)
+            if replica is None:
+                logging.warn("No replica available for model {}".format(model))
+                continue
+            targets.append((model, replica))
+        if job_type == 'get_response':
+            with routing_lock:
+                dispatched.setdefault(chat_unique_id, []).extend(targets)
+                for target in targets:
+                    inflight[target].add(chat_unique_id)
+    for model, replica in targets:
+        routed_job = dict(job)
+        routed_job['topic'] = replica_topic(model, replica)
+        routed_job['sent_at'] = tracing.now()
+        job_queue.put(routed_job)
 
 
 def act():
@@ -567,23 +772,43 @@ def act():
     logging.info("Child pull channel active")
     while True:
         packet = socket.recv_json()
-        if 'control' in packet:
-            # received ack response
-            ack_times[packet['model_name']] = datetime.now()
-        elif packet['chat_unique_id'] in model_responses:
-            logging.info("Receiving model response")
-            logging.info(packet)
-            # calculate the features here
-            chat_id = packet['chat_id']
-            context = packet['context']
-            logging.info("Calculating features for model {}".format(
-                packet['model_name']))
-            # Now store the packet in dict
-            model_responses[packet['chat_unique_id']
-                            ][packet['model_name']] = packet
-        else:
-            logging.info('Discarding message from model {} for chat id {}'.format(
-                packet['model_name'], packet['chat_id']))
+        try:
+            receive(packet)
+        except Exception:
+            # one bad packet must not stop the reception of all the responses
+            logging.exception("Failed to process packet {}".format(packet))
+
+
+def receive(packet):
+    """ Handle one packet sent by a model client.
+    get_response() drops the turns it is done with from another thread: the
+    per turn dicts are only read once, with get()
+    """
+    if 'control' in packet and packet['control'] == 'ack':
+        # received ack response
+        ack_times[packet['model_name']] = datetime.now()
+        register_replica(packet['model_name'], packet['replica'],
+                         ack_times[packet['model_name']], packet['status'])
+        return
+    release(packet['chat_unique_id'], packet['model_name'], packet['replica'])
+    record_arrival(packet)
+    for stage, seconds in packet.get('timings', {}).iteritems():
+        tracer.record(stage, seconds, packet['model_name'])
+    if 'control' in packet:
+        # model is done without candidate response
+        done = model_done.get(packet['chat_unique_id'])
+        if done is not None:
+            done.add(packet['model_name'])
+        return
+    responses = model_responses.get(packet['chat_unique_id'])
+    if responses is not None:
+        logging.info("Receiving model response")
+        logging.info(packet)
+        # Now store the packet in dict
+        responses[packet['model_name']] = packet
+    else:
+        logging.info('Discarding message from model {} for chat id {}'.format(
+            packet['model_name'], packet['chat_id']))
 
 
 def responder():
@@ -622,8 +847,10 @@ def consumer():
             control = 'none'
             if 'control' in msg:
                 control = msg['control']
+            trace = msg.get('trace')
+            tracer.record_since(trace, 'producer', 'transport_in')
             gthread = Thread(target=get_response, args=[msg['chat_id'], msg['text'],
-                         msg['context'], msg['allowed_model'], control])
+                         msg['context'], msg['allowed_model'], control, trace])
             gthread.daemon = True
             gthread.start()
 
@@ -637,12 +864,16 @@ def producer():
     logging.info("Parent push channel active")
     while True:
         msg = response_queue.get()
+        if msg.get('trace') is not None:
+            tracing.stamp(msg['trace'], 'reply_sent')
         socket.send_json(msg)
         response_queue.task_done()
 
 
 def clean(chat_id):
     article_text.pop(chat_id, None)
+    chat_replicas.pop(chat_id, None)
+    preprocessed.pop(chat_id, None)
     candidate_model.pop(chat_id, None)
     article_nouns.pop(chat_id, None)
     boring_count.pop(chat_id, None)
@@ -652,24 +883,27 @@ def clean(chat_id):
 
 
 def dead_models():
+    """ list of (model, replica) which did not ping back within PING_TIME
+    or failed to load
+    """
     dm = []
     now = datetime.now()
-    for model in ack_times:
-        if ack_times[model]:
-            diff = now - ack_times[model]
-            diff_seconds = diff.total_seconds()
-            if diff_seconds > PING_TIME:
-                dm.append(model)
+    for model in replica_acks:
+        for replica, ack_time in replica_acks[model].items():
+            if replica_status.get((model, replica)) == 'failed':
+                dm.append((model, replica))
+            elif ack_time:
+                diff = now - ack_time
+                diff_seconds = diff.total_seconds()
+                if diff_seconds > PING_TIME:
+                    dm.append((model, replica))
     return dm
 
 # check if all models are up
 
 
 def isEveryoneAwake():
-    for model in ack_times:
-        if not ack_times[model]:
-            return False
-    return True
+    return set(modelIds).issubset(ready_models())
 
 
 def strip_emojis(str):
@@ -723,6 +957,121 @@ def ranker(chat_unique_id):
         dont_consider = dont_consider_models
     return consider, dont_consider
 
+def rank_score(response):
+    """ score used by the ranker to compare candidate responses """
+    return float(response.get('conf', 0)) * float(response.get('score', 0))
+
+
+def record_arrival(packet):
+    """ Update the latency and score history of a model with a new packet,
+    and the late arrival stats if the turn was already committed
+    """
+    chat_unique_id = packet['chat_unique_id']
+    model = packet['model_name']
+    # get_response() moves the turn from turn_start to committed in another thread
+    start = turn_start.get(chat_unique_id)
+    selected = committed.get(chat_unique_id)
+    if start is None:
+        if selected is None:
+            return
+        start = selected[0]
+    latency_history.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(
+        time.time() - start)
+    tracer.record('response', latency_history[model][-1], model)
+    if 'control' in packet:
+        return
+    score = rank_score(packet)
+    score_history.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(score)
+    if selected is not None:
+        selected_score = selected[1]
+        late = selection_stats['late']
+        late[model] = late.get(model, 0) + 1
+        if score > selected_score:
+            won = selection_stats['would_have_won']
+            won[model] = won.get(model, 0) + 1
+
+
+def latency_budget(model):
+    """ time (seconds) we are willing to wait for `model` """
+    history = latency_history.get(model, [])
+    if len(history) < MIN_LATENCY_SAMPLES:
+        return WAIT_TIME
+    return min(WAIT_TIME, np.percentile(history, BUDGET_PERCENTILE))
+
+
+def expected_wait_value(pending, elapsed):
+    """ Expected best rank score we could get by waiting for `pending` models:
+    max over models of Pr(model answers within its budget | not answered yet)
+    times its average rank score. Infinite if we don't know a model yet.
+    """
+    value = 0.
+    for model in pending:
+        history = np.array(latency_history.get(model, []))
+        scores = score_history.get(model, [])
+        if len(history) < MIN_LATENCY_SAMPLES or len(scores) == 0:
+            return float('inf')
+        still_waiting = np.sum(history > elapsed)
+        if still_waiting == 0:
+            continue
+        in_time = np.sum((history > elapsed) & (history <= latency_budget(model)))
+        value = max(value, float(in_time) / still_waiting * np.mean(scores))
+    return value
+
+
+def pending_models(chat_unique_id):
+    """ models which got the job (ie. had a ready replica) and are not done yet """
+    finished = set(model_responses[chat_unique_id].keys()) | model_done[chat_unique_id]
+    return [m for m, _ in dispatched.get(chat_unique_id, []) if m not in finished]
+
+
+def should_commit(chat_unique_id, elapsed):
+    """ Decide if we stop waiting for the models and select a response now
+    """
+    responses = model_responses[chat_unique_id]
+    pending = pending_models(chat_unique_id)
+    if not pending:
+        return True
+    # hard cap, even with no response at all: hung models must not block the chat
+    if elapsed >= WAIT_TIME:
+        return True
+    if len(responses) == 0:
+        # nothing to select from yet
+        return False
+    # FACT_GEN is our failure handling case: wait for it while it is in budget
+    if ModelID.FACT_GEN in pending and elapsed < latency_budget(ModelID.FACT_GEN):
+        return False
+    pending = [m for m in pending if elapsed < latency_budget(m)]
+    if not pending:
+        return True
+    best = max(rank_score(r) for r in responses.values())
+    if best > 0 and best >= expected_wait_value(pending, elapsed):
+        selection_stats['early_commits'] += 1
+        return True
+    return False
+
+
+def dump_selection_stats(path=SELECTION_STATS_FILE):
+    """ Save decision times, late arrivals and per model budgets in a json file
+    """
+    decision_time = list(selection_stats['decision_time'])
+    stats = {
+        'turns': selection_stats['turns'],
+        'early_commits': selection_stats['early_commits'],
+        'late': dict(selection_stats['late']),
+        'would_have_won': dict(selection_stats['would_have_won']),
+        'budgets': {m: float(latency_budget(m)) for m in latency_history.keys()},
+    }
+    if decision_time:
+        stats['decision_time'] = {
+            'p50': float(np.percentile(decision_time, 50)),
+            'p95': float(np.percentile(decision_time, 95)),
+            'p99': float(np.percentile(decision_time, 99)),
+            'mean': float(np.mean(decision_time))
+        }
+    with open(path, 'w') as fp:
+        json.dump(stats, fp, indent=2)
+
+
 # check if any of the current generated responses fall within k previous history
 # If so, remove that response altogether
 
@@ -736,12 +1085,14 @@ def no_duplicate(chat_id, chat_unique_id, k=5):
         del model_responses[chat_unique_id][dm]
 
 
-def get_response(chat_id, text, context, allowed_model=None, control=None):
+def get_response(chat_id, text, context, allowed_model=None, control=None, trace=None):
     # create a chat_id + unique ID candidate responses field
     # chat_unique_id is needed to uniquely determine the return
     # for each call
     chat_unique_id = str(chat_id) + '_' + str(uuid.uuid4())
     model_responses[chat_unique_id] = {}
+    model_done[chat_unique_id] = set()
+    turn_start[chat_unique_id] = time.time()
     is_start = False
     logging.info("get_response context")
     logging.info(context)
@@ -823,49 +1174,52 @@ def get_response(chat_id, text, context, allowed_model=None, control=None):
     # wait for responses to come in
     # if we have answer ready before the wait period, exit and return the answer
     done_processing = False
-    wait_for = WAIT_TIME
     # response should be a dict of (text, context, model_name, policy_mode)
     response = {}
     # add feature list as another key of response
     done_features = set()
-    while not done_processing and wait_for > 0:
+    while not done_processing:
+        elapsed = time.time() - turn_start[chat_unique_id]
         if is_start:
-            if (ModelID.CAND_QA not in
-                    model_responses[chat_unique_id]
-                ) and (ModelID.NQG not in
-                       model_responses[chat_unique_id]):
-                continue
-            else:
+            if (ModelID.CAND_QA in model_responses[chat_unique_id]
+                    or ModelID.NQG in model_responses[chat_unique_id]
+                    or not pending_models(chat_unique_id)
+                    or elapsed >= WAIT_TIME):
                 # if found msg early, break
                 done_processing = True
                 break
         else:
             # Only for debugging
             if allowed_model and allowed_model != ModelID.ALL:
-                if allowed_model in model_responses[chat_unique_id]:
+                if allowed_model in model_responses[chat_unique_id] \
+                        or elapsed >= WAIT_TIME:
                     done_processing = True
                     break
-            # Wait for atleast FACT_GEN to arrive
-            elif ModelID.FACT_GEN not in set(model_responses[chat_unique_id].keys()):
-                done_processing = False
-                wait_for += 1
-            # Wait for all the models to arrive - REDUNDANT
-            elif len(set(model_responses[chat_unique_id].keys())
-                     .intersection(set(modelIds))) == len(modelIds):
+            # commit as soon as waiting for slow models is not worth it
+            elif should_commit(chat_unique_id, elapsed):
                 done_processing = True
                 break
         # tick
-        wait_for -= 1
-        time.sleep(1)
-
-    logging.info("Received responses from {}".format(
-        model_responses[chat_unique_id].keys()))
+        time.sleep(SELECTION_TICK)
+
+    decision_time = time.time() - turn_start[chat_unique_id]
+    tracer.record('wait', decision_time)
+    select_start = tracing.now()
+    selection_stats['turns'] += 1
+    selection_stats['decision_time'].append(decision_time)
+    logging.info("Received responses from {} after {:.2f}s".format(
+        model_responses[chat_unique_id].keys(), decision_time))
     if chat_id not in boring_count:
         boring_count[chat_id] = 0
     if chat_id not in chat_history:
         chat_history[chat_id] = []
     if chat_id not in used_models:
         used_models[chat_id] = []
+    # models which got the job and those which answered in time, for benchmarks.
+    # Read before the discard job releases the dispatched list and before the
+    # selection drops some of the responses
+    requested = [model for model, _ in dispatched.get(chat_unique_id, [])]
+    responded = model_responses[chat_unique_id].keys()
     # instruct models to not further process
     submit_job(job_type='discard', chat_id=chat_id, chat_unique_id=chat_unique_id)
     
@@ -883,8 +1237,10 @@ def get_response(chat_id, text, context, allowed_model=None, control=None):
         # model. This is done for debugging.
         # TODO: Probably remove this before final submission?
         if allowed_model and allowed_model != ModelID.ALL:
-            response = model_responses[chat_unique_id][allowed_model]
-            response['policyID'] = Policy.FIXED
+            # the model may not have answered within WAIT_TIME
+            if allowed_model in model_responses[chat_unique_id]:
+                response = model_responses[chat_unique_id][allowed_model]
+                response['policyID'] = Policy.FIXED
         else:
             # if text contains emoji's, strip them
             text, emojis = strip_emojis(text)
@@ -1018,8 +1374,17 @@ def get_response(chat_id, text, context, allowed_model=None, control=None):
 
     # if still no response, then just send a random fact
     if not response or 'text' not in response:
-        logging.warn("Failure to obtain a response, using fact gen")
-        response = model_responses[chat_unique_id][ModelID.FACT_GEN]
+        if ModelID.FACT_GEN in model_responses[chat_unique_id]:
+            logging.warn("Failure to obtain a response, using fact gen")
+            response = model_responses[chat_unique_id][ModelID.FACT_GEN]
+        elif len(model_responses[chat_unique_id]) > 0:
+            logging.warn("Failure to obtain a response, using best ranked model")
+            response = max(model_responses[chat_unique_id].values(), key=rank_score)
+        else:
+            # no model ready yet: the bot replies with an emoji to empty texts
+            logging.warn("Failure to obtain a response, no model available")
+            response = {'text': '', 'context': context + [text],
+                        'model_name': 'none', 'chat_id': chat_id}
         response['policyID'] = Policy.FIXED
 
     # Now we have a response, so send it back to bot host
@@ -1030,9 +1395,19 @@ def get_response(chat_id, text, context, allowed_model=None, control=None):
     # Again use ZMQ, because lulz
     response['control'] = control
     logging.info("Done selecting best model")
+    tracer.record('select', tracing.now() - select_start)
+    tracer.record_since(trace, 'producer', 'orchestrator')
+    response['trace'] = trace
+    response['dispatched'] = requested
+    response['responded'] = responded
     response_queue.put(response)
+    # keep the selected score to evaluate the responses arriving late
+    committed[chat_unique_id] = (turn_start.pop(chat_unique_id), rank_score(response))
+    if len(committed) > MAX_COMMITTED:
+        committed.popitem(last=False)
     # clean the unique chat ID
     del model_responses[chat_unique_id]
+    del model_done[chat_unique_id]
 
 
 if __name__ == '__main__':
@@ -1043,15 +1418,34 @@ if __name__ == '__main__':
             4. Child models publish channel `responder`
             5. Child models pull channel `act`
     """
-    # 1. Initializing the models
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients_only", action='store_true',
+                        help="only start the model clients of this host, which connect "
+                             "to a parent running elsewhere (needs tcp:// endpoints)")
+    args = parser.parse_args()
+
+    # 1. Initializing the models: `replicas` processes per model
     process_manager = {}
     for model in modelIds:
-        # wx = ModelClient(model)
-        # mps.append(wx)
-        process_manager[model] = Process(target=ModelClient, args=(model,))
-        process_manager[model].start()
-    # for mp in mps:
-    #    mp.start()
+        for idx in range(conf.zmq['replicas'].get(model, 1)):
+            replica = replica_name(idx)
+            process_manager[(model, replica)] = start_client(model, replica)
+
+    if args.clients_only:
+        # acks go to the remote parent, so only check the processes themselves
+        try:
+            while True:
+                time.sleep(120)
+                for (model, replica), proc in process_manager.items():
+                    if not proc.is_alive():
+                        logging.info("Reviving model {} replica {}".format(model, replica))
+                        process_manager[(model, replica)] = start_client(model, replica)
+        except (KeyboardInterrupt, SystemExit):
+            for proc in process_manager.values():
+                proc.terminate()
+            logging.info("Shutting down model clients")
+        sys.exit(0)
+
     # 2. Parent -> Bot publish channel
     child_publish_thread = Thread(target=responder)
     child_publish_thread.daemon = True
@@ -1071,12 +1465,16 @@ if __name__ == '__main__':
 
     # Model Init
     start_models()
+    tracer.start_dumping(TRACE_FILE, TRACE_DUMP_PERIOD)
 
     all_awake = False
 
     try:
         while True:
             dm = dead_models()
+            if not all_awake:
+                logging.info("Serving with {}/{} models ready: {}".format(
+                    len(ready_models()), len(modelIds), ready_models()))
             if not all_awake and isEveryoneAwake():
                 logging.info("====================================")
                 logging.info("======RLLCHatBot Active=============")
@@ -1090,12 +1488,15 @@ if __name__ == '__main__':
                 all_awake = True
 
             time.sleep(120)
+            dump_selection_stats()
             if len(dm) > 0:
                 for dead_m in dm:
-                    logging.info("Reviving model {}".format(dead_m))
-                    process_manager[dead_m] = Process(
-                        target=ModelClient, args=(dead_m,))
-                    process_manager[dead_m].start()
+                    # replicas from other hosts are revived by their own host
+                    if dead_m not in process_manager:
+                        continue
+                    logging.info("Reviving model {} replica {}".format(*dead_m))
+                    process_manager[dead_m].terminate()
+                    process_manager[dead_m] = start_client(*dead_m)
         # doesn't matter to wait for join now?
         # mp_pool.close()
         # mp_pool.join()
@@ -1104,6 +1505,6 @@ if __name__ == '__main__':
     except (KeyboardInterrupt, SystemExit):
         logging.info("Sending shutdown signal to all models")
         stop_models()
-        for model in modelIds:
-            process_manager[model].terminate()
+        for proc in process_manager.values():
+            proc.terminate()
         logging.info("Shutting down master")
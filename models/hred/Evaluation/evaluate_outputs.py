@@ -0,0 +1,369 @@
+"""
+Batch evaluation of model responses against ground truth responses.
+
+Computes in one run the metrics of embedding_metrics.py (embedding average, greedy
+matching, extrema), of tfidf_metrics.py (TF and TF-IDF cosine similarity) and of
+diversity.py (word position statistics, per-word entropy, unique words), for one or
+several model output files, and writes them to a single JSON report.
+
+Each file is read and tokenized once into a flat array of word ids (words are interned
+across all files) with the offset of each line. The embedding of each distinct word is
+looked up once; the embeddings of the words of a batch of lines are then gathered in
+one indexing operation into padded (lines, words, dim) arrays, from which the three
+embedding metrics are computed with batched products and reductions. TF and TF-IDF
+scores come from sparse count matrices of whole shards. Lines are split into shards
+scored by a pool of worker processes.
+
+Example run:
+
+    python evaluate_outputs.py path_to_ground_truth.txt path_to_predictions.txt [more_predictions.txt ...] --embeddings path_to_embeddings.bin --dictionary path_to_dictionary.pkl --workers 4 --output report.json
+
+The script assumes one example per line, where line n of the ground truth file matches
+line n of each predictions file. As in embedding_metrics.py, the ground truth files
+must be given first: the metrics are not symmetric.
+
+"""
+__docformat__ = 'restructedtext en'
+
+import numpy as np
+import argparse
+import cPickle
+import json
+import math
+import multiprocessing
+
+from scipy.sparse import csr_matrix
+
+# number of lines scored by one worker task
+SHARD_LINES = 5000
+# number of lines whose embeddings are gathered into one padded array
+BATCH_LINES = 256
+# number of word positions reported for the position statistics
+MAX_POSITION = 40
+
+
+class TokenizedFile(object):
+    def __init__(self, path, vocab):
+        """
+        Word ids of all the lines of a file
+        :param vocab: dictionary from word to id, new words are added to it
+        """
+        self.path = path
+        ids = []
+        lengths = []
+        with open(path, 'r') as handle:
+            for line in handle:
+                words = line.split()
+                ids.extend([vocab.setdefault(word, len(vocab)) for word in words])
+                lengths.append(len(words))
+        self.ids = np.asarray(ids, dtype=np.int32)
+        # words of line i are ids[offsets[i]:offsets[i+1]]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def positions(self):
+        """ position of each word in its line """
+        return np.arange(len(self.ids)) - np.repeat(self.offsets[:-1], self.lengths())
+
+    def select(self, keep):
+        """
+        :param keep: boolean array over word ids
+        :return: (ids, offsets) of the words of each line for which `keep` is true
+        """
+        kept = keep[self.ids]
+        offsets = np.concatenate([[0], np.cumsum(kept, dtype=np.int64)])[self.offsets]
+        return self.ids[kept], offsets
+
+
+class WordTables(object):
+    def __init__(self, vocab, w2v=None, raw_dict=None):
+        """
+        Per word id tables of the interned vocabulary
+        :param w2v: word embeddings, or None to skip the embedding metrics
+        :param raw_dict: list of (word, id, frequency, document frequency), or None to skip the TF-IDF metrics
+        """
+        words = [None] * len(vocab)
+        for word, idx in vocab.iteritems():
+            words[idx] = word
+        self.size = len(words)
+
+        self.embeddings = None
+        if w2v is not None:
+            # row of each word in `embeddings`, -1 for words without an embedding
+            self.has_embedding = np.array([word in w2v for word in words], dtype=bool)
+            self.embedding_row = np.cumsum(self.has_embedding) - 1
+            dim = w2v.layer1_size
+            known = [word for word in words if word in w2v]
+            self.embeddings = np.zeros((len(known), dim), dtype=np.float32)
+            for row, word in enumerate(known):
+                self.embeddings[row] = w2v[word]
+
+        self.idf = None
+        if raw_dict is not None:
+            word_freq = dict([(tok, freq) for tok, _, freq, _ in raw_dict])
+            document_freq = dict([(tok, df) for tok, _, _, df in raw_dict])
+            document_count = np.max(document_freq.values())
+            total_word_count = float(sum(word_freq.values()))
+            # words missing from the dictionary have an idf of 1 and a log-probability of 0
+            self.idf = np.array([math.log(float(document_count)/max(1.0, float(document_freq[word])))
+                                 if word in document_freq else 1.0 for word in words])
+            self.logprob = np.array([math.log(max(1.0, float(word_freq[word]))/total_word_count, 2)
+                                     if word in word_freq else 0.0 for word in words])
+
+
+def _padded(ids, offsets, lines, embeddings):
+    """
+    :return: (vectors, mask, lengths) where vectors[i, j] is the embedding of the j-th word of lines[i]
+    """
+    starts = offsets[lines]
+    lengths = offsets[lines + 1] - starts
+    positions = np.arange(max(1, np.max(lengths)))
+    mask = positions[None, :] < lengths[:, None]
+    index = np.where(mask, starts[:, None] + positions[None, :], 0)
+    vectors = embeddings[ids[index]] if len(ids) > 0 else np.zeros(mask.shape + (embeddings.shape[1],), dtype=np.float32)
+    vectors *= mask[:, :, None]
+    return vectors, mask, lengths
+
+
+def _extrema(vectors, mask):
+    """ value of largest absolute value of each dimension over the words of each line """
+    xmax = np.max(np.where(mask[:, :, None], vectors, -np.inf), axis=1)
+    xmin = np.min(np.where(mask[:, :, None], vectors, np.inf), axis=1)
+    return np.where(np.abs(xmin) > xmax, xmin, xmax)
+
+
+def _cosines(x, y):
+    return np.sum(x * y, axis=1) / np.linalg.norm(x, axis=1) / np.linalg.norm(y, axis=1)
+
+
+def embedding_scores(truth, predicted, lines, embeddings):
+    """
+    :param truth: (ids, offsets) of the ground truth words which have an embedding
+    :param predicted: (ids, offsets) of the predicted words which have an embedding
+    :return: (greedy, average, extrema) scores of each line, NaN where the line is skipped
+    """
+    x, x_mask, x_lengths = _padded(truth[0], truth[1], lines, embeddings)
+    y, y_mask, y_lengths = _padded(predicted[0], predicted[1], lines, embeddings)
+    x_known = x_lengths > 0
+    y_known = y_lengths > 0
+    both = x_known & y_known
+
+    # greedy matching: raw dot products, padding words give a zero similarity,
+    # which is also the floor of the best match of each word
+    sims = np.maximum(np.matmul(x, y.transpose(0, 2, 1)), 0.)  # (lines, truth words, predicted words)
+    x_to_y = np.sum(np.max(sims, axis=2) * x_mask, axis=1) / np.maximum(x_lengths, 1)
+    y_to_x = np.sum(np.max(sims, axis=1) * y_mask, axis=1) / np.maximum(y_lengths, 1)
+    greedy = np.where(both, (x_to_y + y_to_x) / 2.0, 0.)
+
+    # lines whose ground truth has no embedding are skipped, a response without embedding scores 0
+    x_total = np.sum(x, axis=1, dtype=np.float64)
+    y_total = np.sum(y, axis=1, dtype=np.float64)
+    x_valid = np.linalg.norm(x_total, axis=1) >= 0.00000000001
+    y_valid = np.linalg.norm(y_total, axis=1) >= 0.00000000001
+    average = np.where(x_valid, 0., np.nan)
+    average[x_valid & y_valid] = _cosines(x_total[x_valid & y_valid], y_total[x_valid & y_valid])
+
+    x_valid = np.sqrt(np.sum(x.astype(np.float64) ** 2, axis=(1, 2))) >= 0.00000000001
+    y_valid = np.sqrt(np.sum(y.astype(np.float64) ** 2, axis=(1, 2))) >= 0.00000000001
+    valid = x_valid & y_valid
+    extrema = np.where(x_valid, 0., np.nan)
+    extrema[valid] = _cosines(_extrema(x[valid], x_mask[valid]).astype(np.float64),
+                              _extrema(y[valid], y_mask[valid]).astype(np.float64))
+    return greedy, average, extrema
+
+
+def _counts(ids, offsets, weights):
+    """ CSR matrix of the weighted word counts of each line """
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return csr_matrix((weights[ids], (rows, ids)), shape=(len(offsets) - 1, len(weights)), dtype=np.float64)
+
+
+def _row_cosines(x, y):
+    dot = np.asarray(x.multiply(y).sum(axis=1)).ravel()
+    x_norm = np.sqrt(np.asarray(x.multiply(x).sum(axis=1)).ravel())
+    y_norm = np.sqrt(np.asarray(y.multiply(y).sum(axis=1)).ravel())
+    valid = (x_norm > 0.0000001) & (y_norm > 0.0000001)
+    return np.where(valid, dot / np.where(valid, x_norm * y_norm, 1.), 0.)
+
+
+def tfidf_scores(truth, predicted, idf):
+    """
+    :param truth: (ids, offsets) of the ground truth lines
+    :param predicted: (ids, offsets) of the predicted lines
+    :return: (tf, tfidf) cosine similarities of each line, NaN for empty ground truths
+    """
+    ones = np.ones(len(idf))
+    tf = _row_cosines(_counts(truth[0], truth[1], ones), _counts(predicted[0], predicted[1], ones))
+    tfidf = _row_cosines(_counts(truth[0], truth[1], idf), _counts(predicted[0], predicted[1], idf))
+    # empty targets are not counted, they would always be similar to empty responses
+    empty = np.diff(truth[1]) == 0
+    tf[empty] = np.nan
+    tfidf[empty] = np.nan
+    return tf, tfidf
+
+
+def _shard(array_offsets, start, end):
+    """ (ids, offsets) of lines start..end """
+    ids, offsets = array_offsets
+    return ids[offsets[start]:offsets[end]], offsets[start:end + 1] - offsets[start]
+
+
+_worker_data = None
+
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _score_shard(task):
+    """ per line scores of lines start..end of one predictions file """
+    name, start, end = task
+    data = _worker_data
+    scores = {}
+    if 'embedded_truth' in data:
+        truth = _shard(data['embedded_truth'], start, end)
+        predicted = _shard(data['embedded_predicted'][name], start, end)
+        greedy, average, extrema = [np.zeros(end - start) for _ in range(3)]
+        # lines of similar lengths are padded together
+        order = np.argsort(np.diff(truth[1]) + np.diff(predicted[1]), kind='mergesort')
+        for batch_start in range(0, len(order), BATCH_LINES):
+            lines = order[batch_start:batch_start + BATCH_LINES]
+            greedy[lines], average[lines], extrema[lines] = embedding_scores(truth, predicted, lines, data['embeddings'])
+        scores.update(greedy=greedy, average=average, extrema=extrema)
+    if 'idf' in data:
+        scores['tf'], scores['tfidf'] = tfidf_scores(_shard(data['truth'], start, end),
+                                                     _shard(data['predicted'][name], start, end), data['idf'])
+    return name, start, scores
+
+
+def summarize(scores):
+    """ mean, confidence interval and standard deviation as reported by embedding_metrics.py, skipped lines excluded """
+    scores = scores[~np.isnan(scores)]
+    if len(scores) == 0:
+        return {'mean': None, 'confidence': None, 'std': None, 'count': 0}
+    return {'mean': float(np.mean(scores)), 'confidence': float(1.96*np.std(scores)/float(len(scores))),
+            'std': float(np.std(scores)), 'count': len(scores)}
+
+
+def diversity(predicted, tables):
+    """ statistics of the words of the model responses, as printed by diversity.py """
+    ids = predicted.ids
+    lengths = predicted.lengths()
+    counts = np.bincount(ids, minlength=tables.size)
+    # distinct (line, word) pairs
+    lines = np.repeat(np.arange(len(predicted), dtype=np.int64), lengths)
+    unique_in_lines = len(np.unique(lines * tables.size + ids))
+    report = {
+        'unique_words': int(np.sum(counts > 0)),
+        'unique_words_per_response': float(unique_in_lines) / max(1, len(predicted)),
+        'responses_less_than_15': float(np.mean(lengths <= 15)) if len(predicted) > 0 else None,
+        'word_count_by_rank': sorted(counts[counts > 0].tolist(), reverse=True),
+    }
+    if tables.idf is not None:
+        positions = predicted.positions()
+        position_counts = np.maximum(np.bincount(positions, minlength=MAX_POSITION)[:MAX_POSITION], 1)
+        report['word_position_idf'] = (np.bincount(positions, tables.idf[ids], MAX_POSITION)[:MAX_POSITION] / position_counts).tolist()
+        report['word_position_log_likelihood'] = (-np.bincount(positions, tables.logprob[ids], MAX_POSITION)[:MAX_POSITION] / position_counts).tolist()
+        report['per_word_entropy'] = float(-np.sum(tables.logprob[ids]) / max(1, len(ids)))
+    return report
+
+
+def evaluate(ground_truth, predictions, w2v=None, raw_dict=None, workers=0, shard_lines=SHARD_LINES):
+    """
+    :param ground_truth: path of the ground truth responses
+    :param predictions: paths of the model responses
+    :param w2v: word embeddings, or None to skip the embedding metrics
+    :param raw_dict: model dictionary, or None to skip the TF-IDF metrics
+    :param workers: number of worker processes, 0 to score in this process
+    :return: report dictionary
+    """
+    vocab = {}
+    print "tokenizing %s..." % ground_truth
+    truth = TokenizedFile(ground_truth, vocab)
+    predicted = {}
+    for path in predictions:
+        print "tokenizing %s..." % path
+        predicted[path] = TokenizedFile(path, vocab)
+        assert len(predicted[path]) == len(truth), "%s does not have as many lines as %s" % (path, ground_truth)
+    tables = WordTables(vocab, w2v, raw_dict)
+
+    data = {}
+    if tables.embeddings is not None:
+        data['embeddings'] = tables.embeddings
+        ids, offsets = truth.select(tables.has_embedding)
+        data['embedded_truth'] = (tables.embedding_row[ids], offsets)
+        data['embedded_predicted'] = {}
+        for path in predictions:
+            ids, offsets = predicted[path].select(tables.has_embedding)
+            data['embedded_predicted'][path] = (tables.embedding_row[ids], offsets)
+    if tables.idf is not None:
+        data['idf'] = tables.idf
+        data['truth'] = (truth.ids, truth.offsets)
+        data['predicted'] = dict((path, (predicted[path].ids, predicted[path].offsets)) for path in predictions)
+
+    tasks = [(path, start, min(start + shard_lines, len(truth)))
+             for path in predictions for start in range(0, len(truth), shard_lines)]
+    metrics = dict((path, {}) for path in predictions)
+    print "scoring %d lines of %d files..." % (len(truth), len(predictions))
+    if workers > 0:
+        # the pool is forked after the data is built, so that workers share it
+        pool = multiprocessing.Pool(workers, _init_worker, (data,))
+        results = pool.imap_unordered(_score_shard, tasks)
+    else:
+        pool = None
+        _init_worker(data)
+        results = (_score_shard(task) for task in tasks)
+    for path, start, scores in results:
+        for metric, values in scores.iteritems():
+            metrics[path].setdefault(metric, np.zeros(len(truth)))[start:start + len(values)] = values
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    report = {'ground_truth': ground_truth, 'lines': len(truth), 'outputs': {}}
+    for path in predictions:
+        report['outputs'][path] = {
+            'metrics': dict((metric, summarize(values)) for metric, values in metrics[path].iteritems()),
+            'diversity': diversity(predicted[path], tables),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ground_truth', help="ground truth text file, one example per line")
+    parser.add_argument('predicted', nargs='+', help="predicted text files, one example per line")
+    parser.add_argument('--embeddings', help="embeddings bin file, enables the embedding metrics")
+    parser.add_argument('--dictionary', help="dictionary pickle file, enables the TF-IDF metrics")
+    parser.add_argument('--workers', type=int, default=0, help="number of worker processes")
+    parser.add_argument('--shard_lines', type=int, default=SHARD_LINES, help="number of lines scored by one worker task")
+    parser.add_argument('--output', default='evaluation_report.json', help="JSON report file")
+    args = parser.parse_args()
+
+    w2v = None
+    if args.embeddings:
+        from gensim.models import Word2Vec
+        print "loading embeddings file..."
+        w2v = Word2Vec.load_word2vec_format(args.embeddings, binary=True)
+
+    raw_dict = None
+    if args.dictionary:
+        print "loading dictionary file..."
+        raw_dict = cPickle.load(open(args.dictionary, 'r'))
+
+    report = evaluate(args.ground_truth, args.predicted, w2v, raw_dict, args.workers, args.shard_lines)
+    with open(args.output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+
+    for path, output in sorted(report['outputs'].items()):
+        print path
+        for metric, summary in sorted(output['metrics'].items()):
+            if summary['mean'] is not None:
+                print("  %s: %f +/- %f ( %f )" % (metric, summary['mean'], summary['confidence'], summary['std']))
+    print "report written to %s" % args.output
@@ -122,6 +122,22 @@ class SSFetcher(threading.Thread):
                 diter.queue.put(None)
                 return
 
+class MmapDialogues(object):
+    """
+    Dialogues written by convert-dialogues2mmap.py: a flat int32 token array
+    and the offsets of each dialogue, both memory-mapped.
+    Dialogues are sliced on demand and returned as lists of ints.
+    """
+    def __init__(self, prefix):
+        self.tokens = numpy.load(prefix + '.tokens.npy', mmap_mode='r')
+        self.offsets = numpy.load(prefix + '.offsets.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]].tolist()
+
 class SSIterator(object):
     def __init__(self,
                  dialogue_file,
@@ -150,7 +166,11 @@ class SSIterator(object):
         self.exit_flag = False
 
     def load_files(self):
-        self.data = cPickle.load(open(self.dialogue_file, 'r'))
+        if self.dialogue_file.endswith('.pkl'):
+            self.data = cPickle.load(open(self.dialogue_file, 'r'))
+        else:
+            # prefix of a memory-mapped corpus, see convert-dialogues2mmap.py
+            self.data = MmapDialogues(self.dialogue_file)
         self.data_len = len(self.data)
         logger.debug('Data len is %d' % self.data_len)
 
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 """
 This script computes dialogue embeddings for dialogues found in a text file.
+The embeddings are written to <output>.npy, a float32 matrix whose row i is the
+embedding of line i, which can be loaded with numpy.load(path, mmap_mode='r').
 """
 
 #!/usr/bin/env python
@@ -24,6 +26,12 @@ from state import prototype_state
 
 logger = logging.getLogger(__name__)
 
+# Contexts longer than this are truncated
+MAX_LENGTH = 600
+# Contexts of SORT_BATCHES batches are sorted by length, so that each batch is padded
+# to the length of its own longest context
+SORT_BATCHES = 50
+
 class Timer(object):
     def __init__(self):
         self.total = 0
@@ -54,34 +62,52 @@ def parse_args():
             action="store_true", default=False,
             help="Outputs the second last dialogue encoder state instead of the last one")
 
-    return parser.parse_args()
+    parser.add_argument("--max-length", type=int, default=MAX_LENGTH,
+            help="Maximum number of tokens of a context, longer contexts are truncated")
 
-def compute_encodings(joined_contexts, model, model_compute_encoding, output_second_last_state = False):
-    # TODO Fix seqlen below
-    seqlen = 600
-    context = numpy.zeros((seqlen, len(joined_contexts)), dtype='int32')
-    context_lengths = numpy.zeros(len(joined_contexts), dtype='int32')
-    second_last_utterance_position = numpy.zeros(len(joined_contexts), dtype='int32')
+    parser.add_argument("--sort-batches", type=int, default=SORT_BATCHES,
+            help="Number of batches whose contexts are sorted by length together")
 
+    parser.add_argument("--pickle",
+            action="store_true", default=False,
+            help="Also save the embeddings as a pickled list of vectors in <output>.pkl")
 
-    for idx in range(len(joined_contexts)):
-        context_lengths[idx] = len(joined_contexts[idx])
-        if context_lengths[idx] < seqlen:
-            context[:context_lengths[idx], idx] = joined_contexts[idx]
-        else:
-            # If context is longer tham max context, truncate it and force the end-of-utterance token at the end
-            context[:seqlen, idx] = joined_contexts[idx][0:seqlen]
-            context[seqlen-1, idx] = model.eos_sym
-            context_lengths[idx] = seqlen
+    return parser.parse_args()
 
-        eos_indices = list(numpy.where(context[:context_lengths[idx], idx] == model.eos_sym)[0])
+def context_to_indices(model, context_sentences):
+    """ word ids of a tokenized context, surrounded by end-of-utterance tokens """
+    joined_context = []
+    if len(context_sentences) > 0:
+        joined_context = model.words_to_indices(context_sentences.split())
+    if len(joined_context) == 0:
+        return [model.eos_sym]
 
-        if len(eos_indices) > 1:
-            second_last_utterance_position[idx] = eos_indices[-2]
-        else:
-            second_last_utterance_position[idx] = context_lengths[idx]
+    if joined_context[0] != model.eos_sym:
+        joined_context = [model.eos_sym] + joined_context
+
+    if joined_context[-1] != model.eos_sym:
+        joined_context += [model.eos_sym]
+    return joined_context
 
+
+def compute_encodings(joined_contexts, model, model_compute_encoding, output_second_last_state = False, max_length = MAX_LENGTH):
+    """
+    :param joined_contexts: list of contexts (lists of word ids), preferably of similar lengths
+    :return: float32 array of shape (len(joined_contexts), dim)
+    """
     n_samples = len(joined_contexts)
+    context_lengths = numpy.minimum([len(joined_context) for joined_context in joined_contexts], max_length)
+    # The batch is padded to its longest context only
+    seqlen = numpy.max(context_lengths)
+    context = numpy.zeros((seqlen, n_samples), dtype='int32')
+
+    for idx in range(n_samples):
+        if len(joined_contexts[idx]) <= max_length:
+            context[:context_lengths[idx], idx] = joined_contexts[idx]
+        else:
+            # If context is longer tham max context, truncate it and force the end-of-utterance token at the end
+            context[:max_length, idx] = joined_contexts[idx][0:max_length]
+            context[max_length-1, idx] = model.eos_sym
 
     # Generate the reversed context
     reversed_context = model.reverse_utterances(context)
@@ -92,16 +118,23 @@ def compute_encodings(joined_contexts, model, model_compute_encoding, output_sec
     #hidden_states = encoder_states[-1] # mean for the stochastic latent variable, z
 
     if output_second_last_state:
-        second_last_hidden_state = numpy.zeros((hidden_states.shape[1], hidden_states.shape[2]), dtype='float64')
-        for i in range(hidden_states.shape[1]):
-            second_last_hidden_state[i, :] = hidden_states[second_last_utterance_position[i], i, :]
-
-        return second_last_hidden_state
+        # Position of the second last end-of-utterance token of each context, or its last token
+        positions = numpy.arange(seqlen)[:, None]
+        is_eos = (context == model.eos_sym) & (positions < context_lengths[None, :])
+        last_eos = numpy.max(numpy.where(is_eos, positions, -1), axis=0)
+        second_last_eos = numpy.max(numpy.where(is_eos & (positions < last_eos[None, :]), positions, -1), axis=0)
+        second_last_utterance_position = numpy.where(second_last_eos >= 0, second_last_eos, context_lengths - 1)
+
+        return numpy.asarray(hidden_states[second_last_utterance_position, numpy.arange(n_samples), :], dtype='float32')
     else:
-        return hidden_states[-1, :, :]
+        return numpy.asarray(hidden_states[-1, :, :], dtype='float32')
 
 
-def main(model_prefix, dialogue_file, use_second_last_state):
+def main(model_prefix, dialogue_file, use_second_last_state, output_file, max_length=MAX_LENGTH, sort_batches=SORT_BATCHES):
+    """
+    Compute the embeddings of the dialogues of `dialogue_file` and write them to `output_file`
+    :return: memory-mapped float32 array of shape (number of dialogues, dim)
+    """
     state = prototype_state()
 
     state_path = model_prefix + "_state.pkl"
@@ -122,61 +155,45 @@ def main(model_prefix, dialogue_file, use_second_last_state):
     else:
         raise Exception("Must specify a valid model path")
 
-    contexts = [[]]
+    contexts = ['']
     lines = open(dialogue_file, "r").readlines()
     if len(lines):
         contexts = [x.strip() for x in lines]
 
     model_compute_encoding = model.build_encoder_function()
-    dialogue_encodings = []
+    dialogue_encodings = None
 
     # Start loop
-    joined_contexts = []
     batch_index = 0
     batch_total = int(math.ceil(float(len(contexts)) / float(model.bs)))
-    for context_id, context_sentences in enumerate(contexts):
+    window = model.bs * sort_batches
+    for window_start in range(0, len(contexts), window):
         # Convert contexts into list of ids
-        joined_context = []
-
-        if len(context_sentences) == 0:
-            joined_context = [model.eos_sym]
-        else:
-            joined_context = model.words_to_indices(context_sentences.split())
-
-            if joined_context[0] != model.eos_sym:
-                joined_context = [model.eos_sym] + joined_context
-
-            if joined_context[-1] != model.eos_sym:
-                joined_context += [model.eos_sym]
+        joined_contexts = [context_to_indices(model, context_sentences) for context_sentences in contexts[window_start:window_start + window]]
+        order = numpy.argsort([len(joined_context) for joined_context in joined_contexts], kind='mergesort')
 
-        joined_contexts.append(joined_context)
-
-        if len(joined_contexts) == model.bs:
+        for start in range(0, len(order), model.bs):
             batch_index = batch_index + 1
             logger.debug("[COMPUTE] - Got batch %d / %d" % (batch_index, batch_total))
-            encs = compute_encodings(joined_contexts, model, model_compute_encoding, use_second_last_state)
-            for i in range(len(encs)):
-                dialogue_encodings.append(encs[i])
-
-            joined_contexts = []
+            indices = order[start:start + model.bs]
+            encs = compute_encodings([joined_contexts[idx] for idx in indices], model, model_compute_encoding, use_second_last_state, max_length)
 
+            if dialogue_encodings is None:
+                dialogue_encodings = numpy.lib.format.open_memmap(output_file, mode='w+', dtype='float32', shape=(len(contexts), encs.shape[1]))
+            dialogue_encodings[window_start + indices] = encs
 
-    if len(joined_contexts) > 0:
-        logger.debug("[COMPUTE] - Got batch %d / %d" % (batch_total, batch_total))
-        encs = compute_encodings(joined_contexts, model, model_compute_encoding, use_second_last_state)
-        for i in range(len(encs)):
-            dialogue_encodings.append(encs[i])
+        dialogue_encodings.flush()
 
     return dialogue_encodings
 
 if __name__ == "__main__":
     args = parse_args()
 
-    # Compute encodings
-    dialogue_encodings = main(args.model_prefix, args.dialogues, args.use_second_last_state)
+    # Compute encodings, saved to disc as they are computed
+    dialogue_encodings = main(args.model_prefix, args.dialogues, args.use_second_last_state, args.output + '.npy', args.max_length, args.sort_batches)
 
-    # Save encodings to disc
-    cPickle.dump(dialogue_encodings, open(args.output + '.pkl', 'w'))
+    if args.pickle:
+        cPickle.dump([numpy.array(encoding) for encoding in dialogue_encodings], open(args.output + '.pkl', 'w'))
 
 
     #  THEANO_FLAGS=mode=FAST_COMPILE,floatX=float32 python compute_dialogue_embeddings.py tests/models/1462302387.69_testmodel tests/data/tvalid_contexts.txt Latent_Variable_Means --verbose --use-second-last-state
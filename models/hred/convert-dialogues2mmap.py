@@ -0,0 +1,47 @@
+"""
+Takes as input a binarized dialogue file (as written by convert-text2dict.py)
+and writes it as two numpy arrays that SSIterator memory-maps:
+ - <output>.tokens.npy: int32 array of all tokens of all dialogues, one after the other
+ - <output>.offsets.npy: int64 array of size (number of dialogues + 1),
+   dialogue i being tokens[offsets[i]:offsets[i+1]]
+
+Use <output> (without extension) as train_dialogues / valid_dialogues in the state.
+"""
+
+import numpy
+import os
+import logging
+import cPickle
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('dialogues2mmap')
+
+import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument("input", type=str, help="Binarized dialogue file (.dialogues.pkl)")
+parser.add_argument("output", type=str, help="Prefix of the memory-mapped dialogue corpus")
+args = parser.parse_args()
+
+if not os.path.isfile(args.input):
+    raise Exception("Input file not found!")
+
+dialogues = cPickle.load(open(args.input, 'r'))
+logger.info("Loaded %d dialogues" % len(dialogues))
+
+offsets = numpy.zeros((len(dialogues) + 1,), dtype='int64')
+for i, s in enumerate(dialogues):
+    # Flatten if this is a list of lists, as SSFetcher does
+    if len(s) > 0 and isinstance(s[0], list):
+        s = [item for sublist in s for item in sublist]
+        dialogues[i] = s
+    offsets[i + 1] = offsets[i] + len(s)
+
+tokens = numpy.lib.format.open_memmap(args.output + ".tokens.npy", mode='w+',
+                                      dtype='int32', shape=(offsets[-1],))
+for i, s in enumerate(dialogues):
+    tokens[offsets[i]:offsets[i + 1]] = s
+tokens.flush()
+numpy.save(args.output + ".offsets.npy", offsets)
+
+logger.info("Number of terms %d" % offsets[-1])
+logger.info("Saved %s.tokens.npy and %s.offsets.npy" % (args.output, args.output))
@@ -16,9 +16,26 @@ import random
 import datetime
 import math
 import copy
+import collections
+import multiprocessing
+import tempfile
+import glob
+import os
 
 logger = logging.getLogger(__name__)
 
+# Batch preparation workers.
+# With state['batch_workers'] > 0, each group of 'sort_k_batches' batches gathered by the
+# SSFetcher thread is sorted and padded by a pool of worker processes instead of the
+# training process. The padded arrays of every batch are written to a file in
+# SHARED_MEMORY_DIR (RAM-backed on Linux) and memory-mapped by the training process,
+# so they are never pickled back through the pool.
+# state['batch_pipeline_depth'] groups (default: one per worker) are prepared ahead of
+# the training loop. Both are off in prototype_state.
+SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+# padded arrays of a batch written to shared memory, in this order
+SHARED_KEYS = ['x', 'x_reversed', 'x_mask']
+
 
 def add_random_variables_to_batch(state, rng, batch, prev_batch, evaluate_mode):
     """
@@ -363,6 +380,120 @@ def create_padded_batch(state, rng, x, force_end_of_utterance_token = False):
 
     return batch
 
+
+def sort_and_pad(state, data_x, number_of_batches, batch_size):
+    """
+    Sort a group of dialogues by length and pad them by batches of `batch_size`
+    :param data_x: list of dialogues (lists of token ids)
+    :return: list of full batches returned by create_padded_batch()
+    """
+    x = numpy.asarray(list(itertools.chain(data_x)))
+
+    lens = numpy.asarray([map(len, x)])
+    order = numpy.argsort(lens.max(axis=0))
+
+    full_batches = []
+    for k in range(number_of_batches):
+        indices = order[k * batch_size:(k + 1) * batch_size]
+        full_batch = create_padded_batch(state, None, [x[indices]])
+
+        if full_batch['num_dialogues'] < batch_size:
+            print 'Skipping incomplete batch!'
+            continue
+
+        if full_batch['max_length'] < 3:
+            print 'Skipping small batch!'
+            continue
+
+        full_batches.append(full_batch)
+    return full_batches
+
+
+def split_padded_batch(state, full_batch):
+    """
+    Split a full batch into mini-batches of at most state['max_grad_steps'] time steps.
+    Mini-batches are views of the arrays of the full batch.
+    """
+    splits = int(math.ceil(float(full_batch['max_length']) / float(state['max_grad_steps'])))
+    batches = []
+    for i in range(0, splits):
+        batch = dict(full_batch)
+
+        # Retrieve start and end position (index) of current mini-batch
+        start_pos = state['max_grad_steps'] * i
+        if start_pos > 0:
+            start_pos = start_pos - 1
+
+        # We need to copy over the last token from each batch onto the next, 
+        # because this is what the model expects.
+        end_pos = min(full_batch['max_length'], state['max_grad_steps'] * (i + 1))
+
+        batch['x'] = full_batch['x'][start_pos:end_pos, :]
+        batch['x_reversed'] = full_batch['x_reversed'][start_pos:end_pos, :]
+        batch['x_mask'] = full_batch['x_mask'][start_pos:end_pos, :]
+        batch['max_length'] = end_pos - start_pos
+        batch['num_preds'] = numpy.sum(batch['x_mask']) - numpy.sum(batch['x_mask'][0,:])
+
+        # For each batch we compute the number of dialogues as a fraction of the full batch,
+        # that way, when we add them together, we get the total number of dialogues.
+        batch['num_dialogues'] = float(full_batch['num_dialogues']) / float(splits)
+        batch['x_reset'] = numpy.ones(state['bs'], dtype='float32')
+
+        batches.append(batch)
+
+    if len(batches) > 0:
+        batches[-1]['x_reset'] = numpy.zeros(state['bs'], dtype='float32')
+
+        # Trim the last very short batch
+        if batches[-1]['max_length'] < 3:
+            del batches[-1]
+            batches[-1]['x_reset'] = numpy.zeros(state['bs'], dtype='float32')
+            logger.debug("Truncating last mini-batch...")
+
+    return batches
+
+
+# state of the batch worker processes, set once by the pool initializer
+_worker_state = None
+
+
+def _init_batch_worker(state):
+    global _worker_state
+    _worker_state = state
+
+
+def _to_shared(full_batch, prefix):
+    """ Move the padded arrays of a batch to a shared memory file """
+    fd, path = tempfile.mkstemp(prefix=prefix, dir=SHARED_MEMORY_DIR)
+    with os.fdopen(fd, 'wb') as handle:
+        for key in SHARED_KEYS:
+            handle.write(full_batch[key].tobytes())
+    full_batch['shared_file'] = path
+    full_batch['shared_arrays'] = [(key, full_batch[key].dtype.str, full_batch[key].shape) for key in SHARED_KEYS]
+    for key in SHARED_KEYS:
+        del full_batch[key]
+    return full_batch
+
+
+def _from_shared(full_batch):
+    """ Map the padded arrays of a batch written by _to_shared() """
+    path = full_batch.pop('shared_file')
+    offset = 0
+    for key, dtype, shape in full_batch.pop('shared_arrays'):
+        # copy-on-write mapping: the batch stays writable without touching the file
+        full_batch[key] = numpy.memmap(path, dtype=dtype, mode='c', offset=offset, shape=shape)
+        offset += full_batch[key].nbytes
+    # the mappings keep the data alive until the batch is garbage collected
+    os.remove(path)
+    return full_batch
+
+
+def _prepare_group(data_x, number_of_batches, batch_size, prefix):
+    """ Worker: sort and pad a group of dialogues, return the full batches in shared memory """
+    return [_to_shared(full_batch, prefix)
+            for full_batch in sort_and_pad(_worker_state, data_x, number_of_batches, batch_size)]
+
+
 class Iterator(SSIterator):
     def __init__(self, dialogue_file, batch_size, **kwargs):
         self.state = kwargs.pop('state', None)
@@ -406,99 +537,117 @@ class Iterator(SSIterator):
 
         self.last_returned_offset = 0
 
+        # Worker processes padding the batches, forked before the fetcher thread starts
+        self.batch_workers = self.state.get('batch_workers', 0)
+        self.pipeline_depth = self.state.get('batch_pipeline_depth', 0) or max(1, self.batch_workers)
+        self.pool = None
+        self.shared_prefix = 'hred_batch_%d_%d_' % (os.getpid(), id(self))
+        if self.batch_workers > 0:
+            self.pool = multiprocessing.Pool(self.batch_workers, _init_batch_worker, (self.state,))
+
+    def next_group(self):
+        """
+        Gather the next 'sort_k_batches' batches from the fetcher thread
+        :return: (dialogues, number of batches, (offset, reshuffle count) of the last dialogue),
+          None at the end of the data
+        """
+        data = []
+        for k in range(self.k_batches):
+            batch = SSIterator.next(self)
+            if batch:
+                data.append(batch)
+
+        if not len(data):
+            return None
+
+        number_of_batches = len(data)
+        data = list(itertools.chain.from_iterable(data))
+
+        # Split list of words from the offset index and reshuffle count
+        data_x = []
+        data_offset = []
+        data_reshuffle_count = []
+        for i in range(len(data)):
+            data_x.append(data[i][0])
+            data_offset.append(data[i][1])
+            data_reshuffle_count.append(data[i][2])
+
+        position = None
+        if len(data_offset) > 0:
+            position = (data_offset[-1], data_reshuffle_count[-1])
+        return data_x, number_of_batches, position
+
+    def set_position(self, position):
+        if position:
+            self.last_returned_offset, self.last_returned_reshuffle_count = position
+
     def get_homogenous_batch_iter(self, batch_size = -1):
         while True:
             batch_size = self.batch_size if (batch_size == -1) else batch_size 
-           
-            data = []
-            for k in range(self.k_batches):
-                batch = SSIterator.next(self)
-                if batch:
-                    data.append(batch)
-            
-            if not len(data):
+
+            group = self.next_group()
+            if group is None:
                 return
-            
-            number_of_batches = len(data)
-            data = list(itertools.chain.from_iterable(data))
-
-            # Split list of words from the offset index and reshuffle count
-            data_x = []
-            data_offset = []
-            data_reshuffle_count = []
-            for i in range(len(data)):
-                data_x.append(data[i][0])
-                data_offset.append(data[i][1])
-                data_reshuffle_count.append(data[i][2])
-
-            if len(data_offset)  > 0:
-                self.last_returned_offset = data_offset[-1]
-                self.last_returned_reshuffle_count = data_reshuffle_count[-1]
-
-            x = numpy.asarray(list(itertools.chain(data_x)))
-
-            lens = numpy.asarray([map(len, x)])
-            order = numpy.argsort(lens.max(axis=0))
-                 
-            for k in range(number_of_batches):
-                indices = order[k * batch_size:(k + 1) * batch_size]
-                full_batch = create_padded_batch(self.state, self.rng, [x[indices]])
-
-                if full_batch['num_dialogues'] < batch_size:
-                    print 'Skipping incomplete batch!'
-                    continue
-
-                if full_batch['max_length'] < 3:
-                    print 'Skipping small batch!'
-                    continue
-
-
-                # Then split batches to have size 'max_grad_steps'
-                splits = int(math.ceil(float(full_batch['max_length']) / float(self.state['max_grad_steps'])))
-                batches = []
-                for i in range(0, splits):
-                    batch = copy.deepcopy(full_batch)
-
-                    # Retrieve start and end position (index) of current mini-batch
-                    start_pos = self.state['max_grad_steps'] * i
-                    if start_pos > 0:
-                        start_pos = start_pos - 1
-
-                    # We need to copy over the last token from each batch onto the next, 
-                    # because this is what the model expects.
-                    end_pos = min(full_batch['max_length'], self.state['max_grad_steps'] * (i + 1))
-
-                    batch['x'] = full_batch['x'][start_pos:end_pos, :]
-                    batch['x_reversed'] = full_batch['x_reversed'][start_pos:end_pos, :]
-                    batch['x_mask'] = full_batch['x_mask'][start_pos:end_pos, :]
-                    batch['max_length'] = end_pos - start_pos
-                    batch['num_preds'] = numpy.sum(batch['x_mask']) - numpy.sum(batch['x_mask'][0,:])
-
-                    # For each batch we compute the number of dialogues as a fraction of the full batch,
-                    # that way, when we add them together, we get the total number of dialogues.
-                    batch['num_dialogues'] = float(full_batch['num_dialogues']) / float(splits)
-                    batch['x_reset'] = numpy.ones(self.state['bs'], dtype='float32')
-
-                    batches.append(batch)
-
-                if len(batches) > 0:
-                    batches[-1]['x_reset'] = numpy.zeros(self.state['bs'], dtype='float32')
-
-                    # Trim the last very short batch
-                    if batches[-1]['max_length'] < 3:
-                        del batches[-1]
-                        batches[-1]['x_reset'] = numpy.zeros(self.state['bs'], dtype='float32')
-                        logger.debug("Truncating last mini-batch...")
-
-                for batch in batches:
+            data_x, number_of_batches, position = group
+            self.set_position(position)
+
+            # Then split batches to have size 'max_grad_steps'
+            for full_batch in sort_and_pad(self.state, data_x, number_of_batches, batch_size):
+                for batch in split_padded_batch(self.state, full_batch):
                     if batch:
                         yield batch
 
+    def get_parallel_batch_iter(self, batch_size = -1):
+        """
+        Same batches as get_homogenous_batch_iter(), sorted and padded by the worker processes.
+        Up to 'batch_pipeline_depth' groups are in preparation at any time.
+        """
+        batch_size = self.batch_size if (batch_size == -1) else batch_size
+        pending = collections.deque()
+        end_of_data = False
+        try:
+            while True:
+                while not end_of_data and len(pending) < self.pipeline_depth:
+                    group = self.next_group()
+                    if group is None:
+                        end_of_data = True
+                        break
+                    data_x, number_of_batches, position = group
+                    result = self.pool.apply_async(_prepare_group, (data_x, number_of_batches, batch_size, self.shared_prefix))
+                    pending.append((result, position))
+
+                if not pending:
+                    return
+
+                result, position = pending.popleft()
+                # a timeout keeps the wait interruptible
+                full_batches = [_from_shared(full_batch) for full_batch in result.get(10 ** 7)]
+                self.set_position(position)
+
+                for full_batch in full_batches:
+                    for batch in split_padded_batch(self.state, full_batch):
+                        if batch:
+                            yield batch
+        finally:
+            # iterator abandoned (ie: restarted), release the batches already prepared
+            for result, _ in pending:
+                for full_batch in result.get(10 ** 7):
+                    os.remove(full_batch['shared_file'])
 
     def start(self):
         SSIterator.start(self)
         self.batch_iter = None
 
+    def close(self):
+        """ Stop the worker processes and remove their leftover shared memory files """
+        self.batch_iter = None
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        for path in glob.glob(os.path.join(SHARED_MEMORY_DIR, self.shared_prefix + '*')):
+            os.remove(path)
+
     def next(self, batch_size = -1):
         """ 
         We can specify a batch size,
@@ -506,7 +655,10 @@ class Iterator(SSIterator):
         """
         # If there are no more batches in list, try to generate new batches
         if not self.batch_iter:
-            self.batch_iter = self.get_homogenous_batch_iter(batch_size)
+            if self.pool is not None:
+                self.batch_iter = self.get_parallel_batch_iter(batch_size)
+            else:
+                self.batch_iter = self.get_homogenous_batch_iter(batch_size)
 
         try:
             # Retrieve next batch
@@ -17,9 +17,7 @@ import utils
 from dialog_encdec import DialogEncoderDecoder
 from numpy_compat import argpartition
 from state import prototype_state
-
-
-from scipy.sparse import lil_matrix
+from tfidf_index import TfIdfIndex, QUERY_BATCH_SIZE
 
 
 
@@ -62,6 +60,12 @@ def parse_args():
     parser.add_argument("output",
             help="Output file with potential responses; the potential responses for each test context are tab separated tokenized text, and correspond to the context of the same line in the test context file")
 
+    parser.add_argument("--index",
+            help="TF-IDF index of the training contexts (.npz file); loaded if it exists, otherwise built and saved there")
+
+    parser.add_argument("--query_batch_size", type=int, default=QUERY_BATCH_SIZE,
+            help="Number of test contexts scored at once by the tf-idf method")
+
     return parser.parse_args()
 
 
@@ -93,20 +97,19 @@ def main():
 
     training_contexts_len = len(training_contexts)
 
-    # Populate matrix for training_contexts
+    # Build (or load) the index of training_contexts
     if (args.retrieval_method.lower() == 'tf-idf'):
-        print('Populating matrix for training contexts...')
-        training_contexts_matrix = lil_matrix((len(training_contexts), idim), dtype=numpy.float32)
-        for training_context_idx, training_context in enumerate(training_contexts):
-            if training_context_idx % 100 == 0:
-                print '     processing training context: ' + str(training_context_idx) + ' / ' + str(len(training_contexts))
-
-            word_indices = words_to_indices(training_context.split(), str_to_idx)
-            for word_index in word_indices:
-                training_contexts_matrix[training_context_idx, word_index] += numpy.log(1 + training_contexts_len/max(1.0, document_freq[word_index]))
-
-            # Normalize by L2 norm
-            training_contexts_matrix[training_context_idx, :] = training_contexts_matrix[training_context_idx, :] / numpy.linalg.norm(training_contexts_matrix[training_context_idx, :].toarray())
+        if args.index and os.path.isfile(args.index):
+            print('Loading tf-idf index of training contexts...')
+            training_contexts_index = TfIdfIndex.load(args.index)
+            assert len(training_contexts_index) == training_contexts_len
+        else:
+            print('Building tf-idf index of training contexts...')
+            training_contexts_index = TfIdfIndex.build(
+                [words_to_indices(training_context.split(), str_to_idx) for training_context in training_contexts],
+                document_freq, idim)
+            if args.index:
+                training_contexts_index.save(args.index)
 
 
     training_responses = [[]]
@@ -133,8 +136,13 @@ def main():
         # that potential response will be the only ground truth test, which is not acceptable...
         assert args.potential_responses > 1 
     
+    if (args.retrieval_method.lower() == 'tf-idf'):
+        # Best training contexts of each test context, retrieved by batches
+        test_context_word_indices = [words_to_indices(test_context.split(), str_to_idx) for test_context in test_contexts]
+        tfidf_retrieved_indices = training_contexts_index.top_k(test_context_word_indices, args.potential_responses, args.query_batch_size)
+
     print('Retrieval started...')
-    retrieved_potential_test_responses = ''
+    output_handle = open(args.output, "w")
     for test_context_idx, test_context in enumerate(test_contexts):
         potential_responses = []
         if test_context_idx % 100 == 0:
@@ -157,31 +165,16 @@ def main():
                 potential_responses += [training_responses[index_to_retrieve]]
 
         elif (args.retrieval_method.lower() == 'tf-idf'):
-            test_context_vector = numpy.zeros((idim), dtype='float32')
-            test_context_word_indices = words_to_indices(test_context.split(), str_to_idx)
-            for word_index in test_context_word_indices:
-                test_context_vector[word_index] += numpy.log(1 + training_contexts_len/max(1.0, document_freq[word_index]))
-
-            cs = training_contexts_matrix.dot(test_context_vector)
-
-            cs_largest_indices = numpy.argpartition(cs, -args.potential_responses)[-args.potential_responses:]
-            for index_to_retrieve in cs_largest_indices:
+            for index_to_retrieve in next(tfidf_retrieved_indices):
                 potential_responses += [training_responses[index_to_retrieve]]
         else:
             print 'ERROR! Please choose between the following retrieval methods: random, random-truth, tf-idf'
 
 
-        retrieved_potential_test_responses += '\t'.join(potential_responses) + '\n'
+        output_handle.write('\t'.join(potential_responses) + '\n')
 
-    print('Retrieval finished.')
-    print('Saving to file...')
-     
-    # Write to output file
-    output_handle = open(args.output, "w")
-    output_handle.write(retrieved_potential_test_responses)
     output_handle.close()
-
-    print('Saving to file finished.')
+    print('Retrieval finished.')
     print('All done!')
 
 
@@ -189,5 +182,7 @@ if __name__ == "__main__":
     main()
 
     # python generate_response_candidates.py tests/models/1450723451.38_testmodel tests/data/tvalid_contexts.txt tests/data/tvalid_responses.txt tests/data/tvalid_contexts.txt tests/data/tvalid_responses.txt 2 tf-idf Out.txt
+
+    # python generate_response_candidates.py tests/models/1450723451.38_testmodel tests/data/tvalid_contexts.txt tests/data/tvalid_responses.txt tests/data/tvalid_contexts.txt tests/data/tvalid_responses.txt 2 tf-idf Out.txt --index tvalid_contexts.tfidf.npz
     
 
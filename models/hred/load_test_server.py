@@ -0,0 +1,94 @@
+import json
+import time
+import random
+import urllib2
+import argparse
+import threading
+import numpy as np
+
+# Local load test of server.py.
+# `--concurrency` simulated users each hold their own session and post messages to
+# /hred one after the other, until `--n_requests` responses have been received.
+# Reports throughput (req/s), latency percentiles and errors.
+#
+#   python server.py --port 5000 --workers 4
+#   python load_test_server.py --port 5000 --concurrency 16 --n_requests 500
+
+MESSAGES = [
+    "hello how are you ?",
+    "what do you do for a living ?",
+    "i like to watch movies on the weekend",
+    "do you have any pets ?",
+    "where are you from ?",
+    "what is your favorite food ?",
+    "i am going to the beach tomorrow",
+    "that sounds great !",
+]
+
+
+def post(url, session_id, text, timeout):
+    data = json.dumps({'sessionId': session_id, 'result': {'resolvedQuery': text}})
+    req = urllib2.Request(url, data, {'Content-Type': 'application/json'})
+    return json.loads(urllib2.urlopen(req, timeout=timeout).read())
+
+
+def user(url, user_id, messages, counter, latencies, errors, lock, timeout):
+    session_id = 'load-test-%d-%d' % (user_id, random.randint(0, 10 ** 6))
+    while True:
+        with lock:
+            if counter[0] <= 0:
+                return
+            counter[0] -= 1
+        start = time.time()
+        try:
+            post(url, session_id, random.choice(messages), timeout)
+            with lock:
+                latencies.append(time.time() - start)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+
+
+def run(url, messages, concurrency, n_requests, timeout):
+    counter = [n_requests]
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    threads = [threading.Thread(target=user, args=(url, i, messages, counter, latencies, errors, lock, timeout))
+               for i in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(10 ** 7)
+    elapsed = time.time() - start
+
+    print "\n%d requests in %.2fs with %d concurrent users" % (n_requests, elapsed, concurrency)
+    print "throughput: %.2f req/s" % (len(latencies) / elapsed)
+    if len(latencies) > 0:
+        print "latency (s): mean %.3f - p50 %.3f - p90 %.3f - p99 %.3f - max %.3f" % (
+            np.mean(latencies), np.percentile(latencies, 50), np.percentile(latencies, 90),
+            np.percentile(latencies, 99), np.max(latencies))
+    print "errors: %d" % len(errors)
+    for error in sorted(set(errors)):
+        print "  %s" % error
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=5000)
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help="number of simultaneous users")
+    parser.add_argument('-n', '--n_requests', type=int, default=200, help="total number of requests")
+    parser.add_argument('-m', '--messages', type=str, default=None, help="file of messages to send, one per line")
+    parser.add_argument('-t', '--timeout', type=float, default=60, help="seconds before a request fails")
+    args = parser.parse_args()
+
+    messages = MESSAGES
+    if args.messages:
+        with open(args.messages, 'r') as handle:
+            messages = [line.strip() for line in handle if line.strip()]
+
+    run('http://%s:%d/hred' % (args.host, args.port), messages, args.concurrency, args.n_requests, args.timeout)
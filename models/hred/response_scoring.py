@@ -0,0 +1,260 @@
+import logging
+import numpy
+
+logger = logging.getLogger(__name__)
+
+# Batched scoring of candidate responses, used by rank_responses.py and retrieve_response.py.
+# A candidate is scored by the negative log-likelihood per word of the response given
+# its context (lower is better). The candidates of `contexts_per_call` contexts are
+# scored together, then the costs are returned context by context, in input order, so
+# that results can be written while the next contexts are scored.
+# With HRED models (no latent variables, decoder reset at the end of each utterance),
+# the response only depends on its context through the dialogue encoder state at the
+# last end-of-utterance token: each distinct context is encoded once with the encoder
+# function, and the candidates are sorted by length and decoded word by word from the
+# state of their context with the beam search step function, in batches of state['bs'].
+# Other models (latent variables, mean field inference, decoder not reset) need the
+# response to compute the context part of the graph: the dialogues (context + candidate)
+# are then sorted by length and run through the evaluation function in padded batches.
+
+# default number of contexts whose candidates are batched together
+CONTEXTS_PER_CALL = 500
+
+
+def context_to_indices(model, context):
+    """ word ids of a tokenized context, surrounded by end-of-utterance tokens """
+    if len(context) == 0:
+        return [model.eos_sym]
+
+    sentence_ids = model.words_to_indices(context.split())
+    if len(sentence_ids) == 0:
+        return [model.eos_sym]
+    if not sentence_ids[0] == model.eos_sym:
+        sentence_ids = [model.eos_sym] + sentence_ids
+    if not sentence_ids[-1] == model.eos_sym:
+        sentence_ids += [model.eos_sym]
+    return sentence_ids
+
+
+def response_to_indices(model, response):
+    """ word ids of a tokenized response, ending with an end-of-utterance token """
+    response = model.words_to_indices(response.split())
+    if len(response) > 0:
+        if response[0] == model.eos_sym:
+            del response[0]
+        if len(response) == 0 or not response[-1] == model.eos_sym:
+            response += [model.eos_sym]
+
+    if len(response) > 3:
+        if ((response[-1] == model.eos_sym)
+         and (response[-2] == model.eod_sym)
+         and (response[-3] == model.eos_sym)):
+            del response[-1]
+            del response[-1]
+    return response
+
+
+def build_dialogue(state, context_ids, response_ids, max_sequence_length):
+    dialogue = context_ids + response_ids
+
+    # Trim beginning of dialogue words if the dialogue is too long... this should be a rare event.
+    if len(dialogue) > max_sequence_length:
+        if state['do_generate_first_utterance']:
+            dialogue = dialogue[len(dialogue)-max_sequence_length:len(dialogue)]
+        else: # CreateDebate specific setting
+            dialogue = dialogue[0:max_sequence_length-1]
+            if not dialogue[-1] == state['eos_sym']:
+                dialogue += [state['eos_sym']]
+    return dialogue
+
+
+class ResponseScorer(object):
+    def __init__(self, model, max_sequence_length=None, contexts_per_call=CONTEXTS_PER_CALL, mf_inference_steps=0):
+        """
+        :param model: DialogEncoderDecoder, its state['bs'] is the number of dialogues per batch
+        :param max_sequence_length: longer dialogues are trimmed,
+          default: the maximum length we can process on a 12 GB GPU with large HRED models
+        :param contexts_per_call: number of contexts whose candidates are sorted and batched together
+        :param mf_inference_steps: mean field inference steps before scoring each batch
+        """
+        self.model = model
+        self.state = model.state
+        self.bs = self.state['bs']
+        self.max_sequence_length = max_sequence_length or 80*(80/self.bs)
+        self.contexts_per_call = contexts_per_call
+
+        self.mf_inference_steps = mf_inference_steps
+        # True: encode each context once, see the top of the file
+        self.share_context = (not model.add_latent_gaussian_per_utterance
+                              and not model.add_latent_piecewise_per_utterance
+                              and model.reset_utterance_decoder_at_end_of_utterance
+                              and not model.collaps_to_standard_rnn
+                              and mf_inference_steps == 0)
+        if self.share_context:
+            self.encode_batch = model.build_encoder_function()
+            self.next_probs = model.build_next_probs_function()
+        else:
+            self.eval_batch = model.build_eval_function()
+        if mf_inference_steps > 0:
+            self.mf_update_batch = model.build_mf_update_function()
+            self.mf_reset_batch = model.build_mf_reset_function()
+
+    def score(self, examples):
+        """
+        :param examples: iterable of (context, responses): tokenized context and list of tokenized candidates
+        :return: generator of (context, responses, costs) in the order of `examples`,
+          `costs` being the array of costs of the candidates
+        """
+        window = []
+        for example in examples:
+            window.append(example)
+            if len(window) == self.contexts_per_call:
+                for result in self.score_window(window):
+                    yield result
+                window = []
+        for result in self.score_window(window):
+            yield result
+
+    def score_window(self, window):
+        if self.share_context:
+            return self.score_window_shared(window)
+        return self.score_window_dialogues(window)
+
+    def score_window_shared(self, window):
+        contexts = []
+        candidates = []  # (context index, response ids)
+        for context, responses in window:
+            # same trimming as build_dialogue, the response is not counted
+            contexts.append(context_to_indices(self.model, context)[-self.max_sequence_length:])
+            for response in responses:
+                candidates.append((len(contexts) - 1, response_to_indices(self.model, response)))
+
+        context_states = self.encode_contexts(contexts)
+        costs = numpy.zeros((len(candidates)), dtype='float32')
+        order = numpy.argsort(numpy.asarray([len(r) for _, r in candidates], dtype='int32'))[::-1]
+        for start in range(0, len(order), self.bs):
+            indices = order[start:start + self.bs]
+            costs[indices] = self.score_responses(context_states[[candidates[idx][0] for idx in indices]],
+                                                  [candidates[idx][1] for idx in indices])
+
+        start = 0
+        for context, responses in window:
+            yield context, responses, costs[start:start + len(responses)]
+            start += len(responses)
+
+    def encode_contexts(self, contexts):
+        """
+        :param contexts: lists of word ids, ending with an end-of-utterance token
+        :return: matrix of the dialogue encoder states after each context
+        """
+        states = None
+        order = numpy.argsort(numpy.asarray(map(len, contexts), dtype='int32'))[::-1]
+        for start in range(0, len(order), self.bs):
+            indices = order[start:start + self.bs]
+            lengths = numpy.asarray([len(contexts[idx]) for idx in indices], dtype='int32')
+            batch_contexts = numpy.zeros((lengths.max(), len(indices)), dtype='int32')
+            for col, idx in enumerate(indices):
+                batch_contexts[0:lengths[col], col] = contexts[idx]
+            batch_contexts_reversed = self.model.reverse_utterances(batch_contexts)
+            _, hs = self.encode_batch(batch_contexts, batch_contexts_reversed, lengths.max())
+            if states is None:
+                states = numpy.zeros((len(contexts), hs.shape[2]), dtype='float32')
+            # padded columns: the state of the last real token
+            states[indices] = hs[lengths - 1, numpy.arange(len(indices))]
+        return states
+
+    def score_responses(self, context_states, responses):
+        """
+        :param context_states: dialogue encoder state after the context of each response
+        :param responses: at most state['bs'] lists of word ids
+        :return: cost per word of each response
+        """
+        n = len(responses)
+        eos_sym = self.state['eos_sym']
+        lengths = numpy.asarray(map(len, responses), dtype='int32')
+        prev_hd = numpy.zeros((n, self.model.utterance_decoder.complete_hidden_state_size), dtype='float32')
+        # the context ends with an end-of-utterance token, which resets the decoder
+        prev_words = numpy.zeros((n), dtype='int64') + eos_sym
+        # no latent variables, the sampling inputs are unused
+        ran_gaussian_vectors = numpy.zeros((n, self.model.latent_gaussian_per_utterance_dim), dtype='float32')
+        ran_uniform_vectors = numpy.zeros((n, self.model.latent_piecewise_per_utterance_dim), dtype='float32')
+        costs = numpy.zeros((n), dtype='float32')
+        for step in range(lengths.max() if n > 0 else 0):
+            alive = numpy.where(step < lengths)[0]
+            words = numpy.asarray([r[step] if step < len(r) else eos_sym for r in responses], dtype='int64')
+            next_probs, prev_hd = self.next_probs(context_states, prev_hd, prev_words, prev_words[None, :].astype('int32'),
+                                                  ran_gaussian_vectors, ran_uniform_vectors)
+            costs[alive] -= numpy.log(next_probs[alive, words[alive]])
+            prev_words = words
+        return costs / numpy.maximum(lengths, 1.0)
+
+    def score_window_dialogues(self, window):
+        dialogues = []
+        for context, responses in window:
+            context_ids = context_to_indices(self.model, context)
+            for response in responses:
+                response_ids = response_to_indices(self.model, response)
+                dialogues.append(build_dialogue(self.state, context_ids, response_ids, self.max_sequence_length))
+
+        costs = numpy.zeros((len(dialogues)), dtype='float32')
+        # Longest batches first, so that running out of memory happens early
+        order = numpy.argsort(numpy.asarray(map(len, dialogues), dtype='int32'))[::-1]
+        for start in range(0, len(order), self.bs):
+            indices = order[start:start + self.bs]
+            costs[indices] = self.score_batch([dialogues[idx] for idx in indices])
+
+        start = 0
+        for context, responses in window:
+            yield context, responses, costs[start:start + len(responses)]
+            start += len(responses)
+
+    def score_batch(self, dialogues):
+        """
+        :param dialogues: at most state['bs'] lists of word ids
+        :return: cost per word of the last utterance of each dialogue
+        """
+        bs = self.bs
+        eos_sym = self.state['eos_sym']
+        max_batch_sequence_length = max(len(dialogue) for dialogue in dialogues)
+
+        batch_dialogues = numpy.zeros((max_batch_sequence_length, bs), dtype='int32')
+        batch_dialogues_mask = numpy.zeros((max_batch_sequence_length, bs), dtype='float32')
+        batch_dialogues_reset_mask = numpy.zeros((bs), dtype='float32')
+        batch_dialogues_drop_mask = numpy.ones((max_batch_sequence_length, bs), dtype='float32')
+        # Index of the end-of-utterance token before the response of each dialogue
+        second_last_eos_sym = numpy.zeros((bs), dtype='int32')
+
+        for idx, dialogue in enumerate(dialogues):
+            batch_dialogues[0:len(dialogue), idx] = dialogue
+            eos_sym_list = numpy.where(batch_dialogues[0:len(dialogue), idx] == eos_sym)[0]
+            if len(eos_sym_list) > 1:
+                second_last_eos_sym[idx] = eos_sym_list[-2]
+            else:
+                logger.warning('dialogue does not have at least two EOS tokens: %s' % dialogue)
+                if len(eos_sym_list) > 0:
+                    second_last_eos_sym[idx] = eos_sym_list[-1]
+
+            # Only the response is scored
+            batch_dialogues_mask[second_last_eos_sym[idx]+1:len(dialogue), idx] = 1.0
+
+        batch_dialogues_reversed = self.model.reverse_utterances(batch_dialogues)
+
+        # The latent variables of the response are sampled once per dialogue
+        in_response = (numpy.arange(max_batch_sequence_length)[:, None] >= second_last_eos_sym[None, :])[:, :, None]
+        batch_dialogues_ran_gaussian_vectors = (in_response * self.model.rng.normal(loc=0, scale=1, size=(1, bs, self.model.latent_gaussian_per_utterance_dim))).astype('float32')
+        batch_dialogues_ran_uniform_vectors = (in_response * self.model.rng.uniform(low=0.0, high=1.0, size=(1, bs, self.model.latent_piecewise_per_utterance_dim))).astype('float32')
+
+        inputs = [batch_dialogues, batch_dialogues_reversed, max_batch_sequence_length, batch_dialogues_mask, batch_dialogues_reset_mask, batch_dialogues_ran_gaussian_vectors, batch_dialogues_ran_uniform_vectors, batch_dialogues_drop_mask]
+
+        # Carry out mean-field inference:
+        if self.mf_inference_steps > 0:
+            self.mf_reset_batch()
+            for mf_step in range(self.mf_inference_steps):
+                training_cost = self.mf_update_batch(*inputs)[0]
+                logger.debug('mf_step %d training_cost %f' % (mf_step, training_cost))
+
+        _, c_list, _ = self.eval_batch(*inputs)
+        # word costs of time steps 1..max_batch_sequence_length-1, time major
+        c_list = numpy.sum(c_list.reshape((max_batch_sequence_length-1, bs)), axis=0)
+        c_list = c_list / numpy.maximum(numpy.sum(batch_dialogues_mask, axis=0), 1.0)
+        return c_list[0:len(dialogues)]
@@ -13,8 +13,10 @@ import codecs
 import search
 import utils
 
+from itertools import izip
 from dialog_encdec import DialogEncoderDecoder
 from numpy_compat import argpartition
+from response_scoring import ResponseScorer, CONTEXTS_PER_CALL
 from state import prototype_state
 
 logger = logging.getLogger(__name__)
@@ -44,6 +46,10 @@ def parse_args():
     parser.add_argument("output",
             help="Output text file containing the retrieved responses (tokenized responses with each line being the retrived response to the corresponding context line)")
 
+    parser.add_argument("--bs", type=int, default=20, help="Number of dialogues (context and candidate response) scored at once")
+
+    parser.add_argument("--contexts_per_call", type=int, default=CONTEXTS_PER_CALL, help="Number of contexts whose candidate responses are sorted by length and batched together")
+
     parser.add_argument("--verbose",
             action="store_true", default=False,
             help="Be verbose")
@@ -62,8 +68,8 @@ def main():
 
     logging.basicConfig(level=getattr(logging, state['level']), format="%(asctime)s: %(name)s: %(levelname)s: %(message)s")
 
-    # For simplicity, we force the batch size to be one
-    state['bs'] = 1
+    state['bs'] = args.bs
+    state['compute_training_updates'] = False
     model = DialogEncoderDecoder(state) 
 
     if os.path.isfile(model_path):
@@ -73,85 +79,24 @@ def main():
         raise Exception("Must specify a valid model path")
     
 
-    eval_batch = model.build_eval_function()
-
-    contexts = [[]]
-    lines = open(args.context, "r").readlines()
-    if len(lines):
-        contexts = [x.strip() for x in lines]
-
+    scorer = ResponseScorer(model, contexts_per_call=args.contexts_per_call)
 
-    potential_responses_set = open(args.responses, "r").readlines()
-    most_probable_responses_string = ''
-    
     print('Retrieval started...')
+    with open(args.context, "r") as context_handle, open(args.responses, "r") as responses_handle, \
+         open(args.output, "w") as output_handle:
+        examples = ((context.strip(), responses.strip().split('\t'))
+                    for context, responses in izip(context_handle, responses_handle))
 
-    for context_idx, context in enumerate(contexts):
-        if context_idx % 100 == 0:
-            print '     processing example: ' + str(context_idx) + ' / ' + str(len(contexts))
-        potential_responses = potential_responses_set[context_idx].strip().split('\t')
-
-        most_probable_response_loglikelihood = -1.0
-        most_probable_response = ''
-
-        for potential_response_idx, potential_response in enumerate(potential_responses):
-            # Convert contexts into list of ids
-            dialogue = []
-            if len(context) == 0:
-                dialogue = [model.eos_sym]
-            else:
-                sentence_ids = model.words_to_indices(context.split())
-                # Add eos tokens
-                if len(sentence_ids) > 0:
-                    if not sentence_ids[0] == model.eos_sym:
-                        sentence_ids = [model.eos_sym] + sentence_ids
-                    if not sentence_ids[-1] == model.eos_sym:
-                        sentence_ids += [model.eos_sym]
-                else:
-                    sentence_ids = [model.eos_sym]
-
-                dialogue += sentence_ids
-
-            response = model.words_to_indices(potential_response.split())
-            if len(response) > 0:
-                if response[0] == model.eos_sym:
-                    del response[0]
-                if not response[-1] == model.eos_sym:
-                    response += [model.eos_sym]
-
-            dialogue += response
-            dialogue = numpy.asarray(dialogue, dtype='int32').reshape((len(dialogue), 1))
-
-            dialogue_reversed = model.reverse_utterances(dialogue)
-
-            dialogue_mask = numpy.ones((len(dialogue), 1), dtype='float32') 
-            dialogue_weight = numpy.ones((len(dialogue), 1), dtype='float32')
-            dialogue_reset_mask = numpy.zeros((1), dtype='float32')
-            dialogue_ran_vectors = model.rng.normal(size=(1,model.latent_gaussian_per_utterance_dim)).astype('float32')
-            dialogue_ran_vectors = numpy.tile(dialogue_ran_vectors, (len(dialogue),1,1))
-
-            dialogue_drop_mask = numpy.ones((len(dialogue), 1), dtype='float32')
-
-            c, _, _, _, _ = eval_batch(dialogue, dialogue_reversed, len(dialogue), dialogue_mask, dialogue_weight, dialogue_reset_mask, dialogue_ran_vectors, dialogue_drop_mask)
-            c = c / len(dialogue)
-
-            print 'c', c
-
-            if (potential_response_idx == 0) or (-c > most_probable_response_loglikelihood):
-                most_probable_response_loglikelihood = -c
-                most_probable_response = potential_response
+        # The most probable response of a context is written as soon as its candidates are scored
+        for context_idx, (context, potential_responses, costs) in enumerate(scorer.score(examples)):
+            if context_idx % 100 == 0:
+                print '     processing example: ' + str(context_idx)
+            if args.verbose:
+                print 'costs', costs
 
-        most_probable_responses_string += most_probable_response + '\n'
+            output_handle.write(potential_responses[numpy.argmin(costs)] + '\n')
 
     print('Retrieval finished.')
-    print('Saving to file...')
-     
-    # Write to output file
-    output_handle = open(args.output, "w")
-    output_handle.write(most_probable_responses_string)
-    output_handle.close()
-
-    print('Saving to file finished.')
     print('All done!')
 
 if __name__ == "__main__":
@@ -6,9 +6,47 @@ from state import prototype_state
 import cPickle
 import search
 
+import os
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+import Queue
+
+# HRED webhook.
+# Every caller has its own dialogue history, keyed by the `sessionId` of the request.
+# Histories are bounded (MAX_HISTORY utterances) and evicted once idle for SESSION_TTL
+# seconds, or least recently used first when there are more than MAX_SESSIONS.
+# Requests are served by several threads, but the model is only used by one sampler
+# thread per process: it takes every request waiting in its queue (up to --max_batch,
+# waiting at most --batch_wait seconds for more) and samples their responses in one call.
+# With --workers N, the model is loaded once and N processes are forked from it,
+# sharing its parameters and the listening socket; histories are then kept by a
+# multiprocessing manager so that a session can be served by any process.
+# Forked workers are meant for CPU models: a GPU context cannot be shared across a fork.
+#
+#   python server.py --port 5000 --workers 4
+#   python load_test_server.py --port 5000 --concurrency 16 --n_requests 500
+
 #MODEL_PREFIX = 'Output/1485188791.05_RedditHRED'
 MODEL_PREFIX = '/home/ml/mnosew1/SavedModels/Twitter/1489857182.98_TwitterModel'
 
+# number of previous utterances given to the model as context
+CONTEXT_UTTERANCES = 4
+# number of utterances kept per session
+MAX_HISTORY = 20
+MAX_SESSIONS = 10000
+# seconds of inactivity after which a session is forgotten
+SESSION_TTL = 3600
+# session of requests that do not have a sessionId
+DEFAULT_SESSION = 'default'
+# micro-batching of sample requests
+MAX_BATCH = 16
+BATCH_WAIT = 0.01
+# seconds after which a request waiting for its response fails
+SAMPLE_TIMEOUT = 60
+
 state_path = '%s_state.pkl' % MODEL_PREFIX
 model_path = '%s_model.npz' % MODEL_PREFIX
 
@@ -24,30 +62,143 @@ print 'Building sampler...'
 sampler = search.BeamSampler(model)
 print 'Loading model...'
 model.load(model_path)
+# compile before any worker is forked, so that they all share the compiled functions
+sampler.compile()
 print 'Model built.'
 
-HISTORY = []
+
+class SessionHistories(object):
+    def __init__(self, max_sessions=MAX_SESSIONS, max_history=MAX_HISTORY, ttl=SESSION_TTL, sessions=None):
+        """
+        Bounded dialogue histories of the last active sessions
+        :param sessions: dictionary-like storage of session id -> (last access time, history),
+          ie: a multiprocessing manager dict to share the histories across processes
+        """
+        self.max_sessions = max_sessions
+        self.max_history = max_history
+        self.ttl = ttl
+        self.sessions = sessions if sessions is not None else {}
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        """ list of the last utterances of the session, empty for a new or expired session """
+        entry = self.sessions.get(session_id)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return []
+        return list(entry[1])
+
+    def set(self, session_id, history):
+        with self.lock:
+            self.sessions[session_id] = (time.time(), history[-self.max_history:])
+            if len(self.sessions) > self.max_sessions:
+                self.evict()
+
+    def evict(self):
+        """ Drop expired sessions, then the least recently active ones down to 90% of max_sessions """
+        now = time.time()
+        by_access = sorted((entry[0], session_id) for session_id, entry in self.sessions.items())
+        n_drop = max(0, len(by_access) - int(self.max_sessions * 0.9))
+        for i, (last_access, session_id) in enumerate(by_access):
+            if i >= n_drop and now - last_access <= self.ttl:
+                break
+            self.sessions.pop(session_id, None)
+
+
+class SampleRequest(object):
+    def __init__(self, context):
+        self.context = context
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class SampleBatcher(object):
+    def __init__(self, sampler, max_batch=MAX_BATCH, max_wait=BATCH_WAIT):
+        """
+        Queue of sample requests served by a single thread, which owns the sampler
+        :param max_batch: maximum number of contexts sampled in one call
+        :param max_wait: seconds to wait for more requests after the first one
+        """
+        self.sampler = sampler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = Queue.Queue()
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sample(self, context, timeout=SAMPLE_TIMEOUT):
+        """ :return: response of the model to `context` (text) """
+        sample_request = SampleRequest(context)
+        self.requests.put(sample_request)
+        if not sample_request.done.wait(timeout):
+            raise RuntimeError("no response after %ds" % timeout)
+        if sample_request.error is not None:
+            raise sample_request.error
+        return sample_request.response
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(True, remaining))
+            except Queue.Empty:
+                break
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                samples, costs = self.sampler.sample([r.context for r in batch], ignore_unk=True, verbose=False, return_words=True)
+                for sample_request, context_samples in zip(batch, samples):
+                    sample_request.response = context_samples[0]
+            except Exception as e:
+                for sample_request in batch:
+                    sample_request.error = e
+            for sample_request in batch:
+                sample_request.done.set()
+
+
+HISTORIES = SessionHistories()
+BATCH_OPTIONS = {'max_batch': MAX_BATCH, 'max_wait': BATCH_WAIT}
+_batcher = None
+_batcher_pid = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """ sample batcher of the current process: threads do not survive a fork, so each worker starts its own """
+    global _batcher, _batcher_pid
+    with _batcher_lock:
+        if _batcher is None or _batcher_pid != os.getpid():
+            _batcher = SampleBatcher(sampler, **BATCH_OPTIONS)
+            _batcher_pid = os.getpid()
+        return _batcher
+
 
 @app.route('/hred', methods=['POST'])
 def hred_response():
-    print 'Generating HRED response...'
+    session_id = request.json.get('sessionId', DEFAULT_SESSION)
     text = request.json['result']['resolvedQuery']
     text = text.replace("'", " '")
     context = '<first_speaker> %s </s>' % text.strip().lower()
-    HISTORY.append(context)
-    print 'History:', HISTORY
-    print 'Context:', context
-    samples, costs = sampler.sample([' '.join(HISTORY[-4:]),], ignore_unk=True, verbose=False, return_words=True)
-    response = samples[0][0].replace('@@ ', '').replace('@@', '')
-    HISTORY.append(response)
+    history = HISTORIES.get(session_id) + [context]
+    response = get_batcher().sample(' '.join(history[-CONTEXT_UTTERANCES:]))
+    response = response.replace('@@ ', '').replace('@@', '')
+    HISTORIES.set(session_id, history + [response])
     response = response.replace('<first_speaker>', '').replace(" '", "'").replace('<at>', '')
     response = response.replace('<second_speaker>', '').strip()
-    print 'Response:', response
+    app.logger.debug('[%s] Context: %s - Response: %s' % (session_id, context, response))
     response = {'speech': response,
                 'displayText': response,
                 'source':'HRED'}
     return jsonify(response)
-    
+
 
 @app.route('/')
 def hello_world():
@@ -74,5 +225,50 @@ def echo():
     return jsonify(response)
 
 
+def serve_worker(listener, host, port):
+    from werkzeug.serving import make_server
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+    server.serve_forever()
+
+
+def serve_prefork(host, port, n_workers):
+    """ Fork `n_workers` processes from the loaded model, all accepting connections on the same socket """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+
+    # histories shared by all workers
+    manager = multiprocessing.Manager()
+    HISTORIES.sessions = manager.dict()
+
+    workers = [multiprocessing.Process(target=serve_worker, args=(listener, host, port)) for _ in range(n_workers)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    print 'Serving on %s:%d with %d workers' % (host, port, n_workers)
+    try:
+        for worker in workers:
+            # a timeout keeps the wait interruptible
+            while worker.is_alive():
+                worker.join(10 ** 7)
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+    manager.shutdown()
+
+
 if __name__ == '__main__':
-    app.run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=5000)
+    parser.add_argument('-w', '--workers', type=int, default=1, help="number of processes forked from the loaded model")
+    parser.add_argument('--max_batch', type=int, default=MAX_BATCH, help="maximum number of requests sampled together")
+    parser.add_argument('--batch_wait', type=float, default=BATCH_WAIT, help="seconds to wait for more requests to sample together")
+    args = parser.parse_args()
+    BATCH_OPTIONS.update(max_batch=args.max_batch, max_wait=args.batch_wait)
+
+    if args.workers > 1:
+        serve_prefork(args.host, args.port, args.workers)
+    else:
+        app.run(host=args.host, port=args.port, threaded=True)
@@ -248,6 +248,13 @@ def prototype_state():
     state['bs'] = 80
     # Sort by length groups of  
     state['sort_k_batches'] = 20
+    # Number of worker processes sorting and padding the training batches.
+    # If zero, batches are prepared in the training process. Enable it in the prototype
+    # or with train.py --batch_workers
+    state['batch_workers'] = 0
+    # Number of groups of 'sort_k_batches' batches prepared in advance by the workers.
+    # If zero, one group per worker
+    state['batch_pipeline_depth'] = 0
     # Training examples will be split into subsequences.
     # This parameter controls the maximum size of each subsequence.
     # Gradients will be computed on the subsequence, and the last hidden state of all RNNs will
@@ -495,6 +502,10 @@ def prototype_reddit_HRED():
     state['dictionary'] = "/home/ml/mnosew1/data/reddit/Training.dict.pkl"
     state['save_dir'] = "Output"
 
+    # Prepare the training batches in 2 worker processes
+    state['batch_workers'] = 2
+    state['batch_pipeline_depth'] = 2
+
     state['max_grad_steps'] = 80
 
     state['valid_freq'] = 5000
@@ -0,0 +1,117 @@
+import itertools
+import numpy
+
+from scipy.sparse import csr_matrix
+
+# Sparse TF-IDF index of tokenized contexts, used by generate_response_candidates.py.
+# Each row of the index is the L2-normalized TF-IDF vector of one context. The whole
+# matrix is built in one shot as a CSR matrix from the flat array of the word ids of
+# all contexts. Queries are scored by batches: the dense (vocabulary, batch) matrix of a
+# batch of queries is multiplied by chunks of `chunk_size` rows of the index, which gives
+# a dense (chunk_size, batch) block of scores, and a running top-k of each query is kept
+# across the chunks. Memory is bounded by the block size, whatever the size of the index.
+# The index is saved to a .npz file so that it is built only once.
+#
+#   index = TfIdfIndex.build(training_context_ids, document_freq, idim)
+#   index.save('Training.tfidf.npz')
+#   for best in TfIdfIndex.load('Training.tfidf.npz').top_k(test_context_ids, 10):
+#       ...
+
+# default number of queries scored together
+QUERY_BATCH_SIZE = 256
+# default number of documents scored at once: a block of 16384 x 256 float32 scores is 16 MB
+DOCUMENT_CHUNK_SIZE = 16384
+
+
+def idf_weights(document_freq, idim, n_documents):
+    """
+    :param document_freq: dictionary from word id to the number of documents containing it
+    :return: float32 array of shape (idim,): log(1 + n_documents / document frequency)
+    """
+    idf = numpy.zeros((idim), dtype=numpy.float32)
+    for word_index, df in document_freq.iteritems():
+        idf[word_index] = numpy.log(1 + float(n_documents) / max(1.0, df))
+    return idf
+
+
+def weight_matrix(token_id_lists, weights):
+    """
+    :param token_id_lists: list of lists of word ids
+    :param weights: weight of each word id
+    :return: CSR matrix of shape (len(token_id_lists), len(weights)), where each
+      occurrence of a word in a list adds its weight to the row of the list
+    """
+    lengths = numpy.fromiter((len(ids) for ids in token_id_lists), dtype=numpy.int64, count=len(token_id_lists))
+    columns = numpy.fromiter(itertools.chain.from_iterable(token_id_lists), dtype=numpy.int32, count=numpy.sum(lengths))
+    rows = numpy.repeat(numpy.arange(len(lengths), dtype=numpy.int32), lengths)
+    # duplicate (row, column) entries are summed by the conversion to CSR
+    return csr_matrix((weights[columns], (rows, columns)), shape=(len(lengths), len(weights)), dtype=numpy.float32)
+
+
+def normalize_rows(matrix):
+    """ L2-normalize the rows of a CSR matrix in place, empty rows are left as they are """
+    norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    matrix.data /= numpy.repeat(norms, numpy.diff(matrix.indptr)).astype(numpy.float32)
+    return matrix
+
+
+class TfIdfIndex(object):
+    def __init__(self, matrix, idf):
+        """
+        :param matrix: CSR matrix of shape (n_documents, idim) with normalized TF-IDF rows
+        :param idf: idf weight of each word id
+        """
+        self.matrix = matrix
+        self.idf = idf
+
+    @classmethod
+    def build(cls, token_id_lists, document_freq, idim):
+        """
+        :param token_id_lists: word ids of each document to index
+        :param document_freq: dictionary from word id to document frequency
+        :param idim: size of the vocabulary
+        """
+        idf = idf_weights(document_freq, idim, len(token_id_lists))
+        return cls(normalize_rows(weight_matrix(token_id_lists, idf)), idf)
+
+    def save(self, path):
+        numpy.savez(path, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                    shape=numpy.asarray(self.matrix.shape), idf=self.idf)
+
+    @classmethod
+    def load(cls, path):
+        arrays = numpy.load(path)
+        matrix = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape']))
+        return cls(matrix, arrays['idf'])
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def top_k(self, token_id_lists, k, batch_size=QUERY_BATCH_SIZE, chunk_size=DOCUMENT_CHUNK_SIZE):
+        """
+        :param token_id_lists: word ids of each query
+        :param k: number of documents to retrieve per query, at most len(self)
+        :param chunk_size: number of documents scored at once
+        :return: generator of arrays of the indices of the `k` documents with the highest
+          cosine similarity to each query, best first (documents with equal scores in any order)
+        """
+        for start in range(0, len(token_id_lists), batch_size):
+            # (idim, batch), so that each chunk product is sparse x dense -> dense
+            queries = weight_matrix(token_id_lists[start:start + batch_size], self.idf).T.toarray()
+            columns = numpy.arange(queries.shape[1])
+            best_scores = numpy.zeros((0, queries.shape[1]), dtype=numpy.float32)
+            best_documents = numpy.zeros((0, queries.shape[1]), dtype=numpy.int64)
+            for first in range(0, len(self), chunk_size):
+                scores = self.matrix[first:first + chunk_size].dot(queries)  # (chunk, batch)
+                documents = numpy.arange(first, first + scores.shape[0])[:, None].repeat(len(columns), axis=1)
+                best_scores = numpy.vstack([best_scores, scores])
+                best_documents = numpy.vstack([best_documents, documents])
+                if len(best_scores) > k:
+                    top = numpy.argpartition(-best_scores, k - 1, axis=0)[:k]
+                    best_scores = best_scores[top, columns]
+                    best_documents = best_documents[top, columns]
+            order = numpy.argsort(-best_scores, axis=0, kind='mergesort')
+            best_documents = best_documents[order, columns]
+            for column in columns:
+                yield best_documents[:, column]
@@ -174,6 +174,11 @@ def main(args):
     if args.force_train_all_wordemb == True:
         state['fix_pretrained_word_embeddings'] = False
 
+    if args.batch_workers is not None:
+        state['batch_workers'] = args.batch_workers
+    if args.batch_pipeline_depth is not None:
+        state['batch_pipeline_depth'] = args.batch_pipeline_depth
+
     model = DialogEncoderDecoder(state)
     rng = model.rng 
 
@@ -261,6 +266,11 @@ def main(args):
 
     batch = None
 
+    # Time spent waiting for training batches since the last report
+    data_stall_time = 0.0
+    data_stall_batches = 0
+    last_report_time = time.time()
+
     while (step < state['loop_iters'] and
         (time.time() - start_time)/60. < state['time_stop'] and
         patience >= 0):
@@ -279,7 +289,10 @@ def main(args):
             print "Sampled : {}".format(samples[0])
 
         ### Training phase
+        data_start_time = time.time()
         batch = train_data.next()
+        data_stall_time += time.time() - data_start_time
+        data_stall_batches += 1
 
         if state['use_pg']:
             display = False
@@ -418,6 +431,14 @@ def main(args):
             except:
                 pass
 
+            print ".. data stall = %.4fs per batch, %.1f%% of the time over the last %d batches" % (\
+                   data_stall_time / max(data_stall_batches, 1), \
+                   100. * data_stall_time / max(this_time - last_report_time, 1e-6), \
+                   data_stall_batches)
+            data_stall_time = 0.0
+            data_stall_batches = 0
+            last_report_time = this_time
+
 
         ### Inspection phase
         if (step % 20 == 0):
@@ -620,6 +641,9 @@ def main(args):
 
         step += 1
 
+    train_data.close()
+    if valid_data is not None:
+        valid_data.close()
     logger.debug("All done, exiting...")
 
 def parse_args():
@@ -638,6 +662,10 @@ def parse_args():
 
     parser.add_argument("--reinitialize-decoder-parameters", action='store_true', help="Can be used when resuming a model. If true, will initialize all parameters of the utterance decoder randomly instead of loading them from previous model.")
 
+    parser.add_argument("--batch_workers", type=int, default=None, help="Number of worker processes sorting and padding the training batches, overrides the prototype. Zero prepares the batches in the training process.")
+
+    parser.add_argument("--batch_pipeline_depth", type=int, default=None, help="Number of groups of batches prepared in advance by the batch workers, overrides the prototype. Zero means one group per worker.")
+
     args = parser.parse_args()
     return args
 
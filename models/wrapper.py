@@ -4,24 +4,13 @@ import logging
 import numpy as np
 import re
 
-import lasagne
-import theano
-from dual_encoder.model import Model as DE_Model
-from hredqa.hred_pytorch import HRED_QA
-
-import hred.search as search
 import utils
-from hred.dialog_encdec import DialogEncoderDecoder
-from hred.state import prototype_state
-from candidate import CandidateQuestions
-from alicebot.nlg_alicebot import NLGAlice
 import json
 import random
 import requests
 import delegator
 import codecs
 from nltk import sent_tokenize
-from gensim.models.keyedvectors import KeyedVectors
 import config
 import os
 import cPickle as pkl
@@ -34,6 +23,9 @@ logging.basicConfig(
     format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s',
 )
 
+# The libraries of each model (Theano, Lasagne, PyTorch, spaCy, gensim, ...) are imported
+# by its wrapper when it is built, so that a process only loads the ones of its model.
+
 NQG_ENDURL = 'http://localhost:8080'
 DRQA_ENDURL = 'http://0.0.0.0:8888'
 FASTTEXT_DIR = '/root/convai/models/fastText/'
@@ -103,6 +95,9 @@ class HRED_Wrapper(Model_Wrapper):
     def __init__(self, model_prefix, dict_file, name):
         # Load the HRED model.
         super(HRED_Wrapper, self).__init__(model_prefix, name)
+        import hred.search as search
+        from hred.dialog_encdec import DialogEncoderDecoder
+        from hred.state import prototype_state
         state_path = '%s_state.pkl' % model_prefix
         model_path = '%s_model.npz' % model_prefix
 
@@ -176,6 +171,7 @@ class Dual_Encoder_Wrapper(Model_Wrapper):
                 data, W, word2idx, idx2word, old_args)
 
             logging.info("Set the learned weights...")
+            import lasagne
             with open('%s_best_weights.pkl' % model_prefix, 'rb') as handle:
                 params = cPickle.load(handle)
                 lasagne.layers.set_all_param_values(self.model.l_out, params)
@@ -197,6 +193,8 @@ class Dual_Encoder_Wrapper(Model_Wrapper):
         self.n_resp = n_resp
 
     def _create_model(self, data, w, word2idx, idx2word, args):
+        import theano
+        from dual_encoder.model import Model as DE_Model
         return DE_Model(
             data=data,
             W=w.astype(theano.config.floatX),
@@ -309,6 +307,7 @@ class HREDQA_Wrapper(Model_Wrapper):
 
     def __init__(self, model_prefix, dict_fname, name):
         super(HREDQA_Wrapper, self).__init__(model_prefix, name)
+        from hredqa.hred_pytorch import HRED_QA
 
         self.model = HRED_QA(
             dictionary=dict_fname,
@@ -354,6 +353,7 @@ class CandidateQuestions_Wrapper(Model_Wrapper):
 
     def __init__(self, model_prefix, dict_fname, name):
         super(CandidateQuestions_Wrapper, self).__init__(model_prefix, name)
+        import candidate  # loads spaCy
         # Use these questions if no suitable questions are found
         # TODO: do not hardcode these, use a dictionary
         self.dict_fname = dict_fname
@@ -365,6 +365,7 @@ class CandidateQuestions_Wrapper(Model_Wrapper):
     def preprocess(self, chat_id='', article_text='', **kwargs):
         logging.info("Preprocessing CandidateQuestions")
         assert isinstance(article_text, basestring)
+        from candidate import CandidateQuestions  # already loaded by __init__
         self.models[chat_id] = CandidateQuestions(
             article_text, self.dict_fname)
         self.canned_freq_user[chat_id] = 0
@@ -709,6 +710,7 @@ class FactGenerator_Wrapper(Model_Wrapper):
                                   "I don't know. But."]
 
         self.w2v_path = '/root/convai/data/GoogleNews-vectors-negative300.bin'
+        from gensim.models.keyedvectors import KeyedVectors
         self.w2v = KeyedVectors.load_word2vec_format(
             self.w2v_path, binary=True)
         self.w2v_dim = self.w2v['hello'].shape[0]
@@ -779,6 +781,7 @@ class AliceBot_Wrapper(Model_Wrapper):
 
     def __init__(self, model_prefix, dict_fname, name):
         super(AliceBot_Wrapper, self).__init__(model_prefix, name)
+        from alicebot.nlg_alicebot import NLGAlice
         self.aliceBot = NLGAlice()
 
     def get_response(self, user_id='', text='', context=None, **kwargs):
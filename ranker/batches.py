@@ -0,0 +1,123 @@
+import numpy as np
+from threading import Thread
+from Queue import Queue
+
+# Input pipeline of the estimators.
+# Batches are gathered and shuffled in a background thread while the network
+# trains on the previous ones. Input matrices can be numpy arrays, memory-mapped
+# arrays or `IndexedRows` views of them, so that training data does not have to
+# fit in memory: only the rows of the next few batches are read from disk.
+
+# number of batches read together from disk-backed inputs and shuffled together
+CHUNK_BATCHES = 64
+# number of batches prepared in advance
+PREFETCH_BATCHES = 8
+# number of examples evaluated at once
+EVAL_CHUNK_SIZE = 8192
+
+
+def _open_rows(filename, indices):
+    return IndexedRows(np.load(filename, mmap_mode='r'), indices)
+
+
+class IndexedRows(object):
+    """
+    Read-only view of some rows of a matrix, without copying them.
+    Supports `len()`, `.shape`, `np.asarray()` and indexing by a slice or an array of positions.
+    Views of a `.npy` memory-mapped file are pickled as a reference to that file.
+    """
+
+    def __init__(self, x, indices):
+        self.x = x
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.shape = (len(self.indices),) + tuple(x.shape[1:])
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        rows = self.indices[key]
+        # read the rows in increasing order: sequential reads of memory-mapped files
+        order = np.argsort(rows, kind='mergesort')
+        out = np.empty((len(rows),) + self.shape[1:], dtype=self.x.dtype)
+        out[order] = self.x[rows[order]]
+        return out
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __reduce__(self):
+        if getattr(self.x, 'filename', None):
+            return _open_rows, (self.x.filename, self.indices)
+        return IndexedRows, (np.asarray(self.x), self.indices)
+
+
+def in_memory(x):
+    return isinstance(x, np.ndarray) and not isinstance(x, np.memmap)
+
+
+def iterate_batches(x, y, batch_size, shuffle=True):
+    """
+    Yield (x, y) batches covering all examples once.
+    In memory arrays are fully shuffled. Other inputs are read by chunks of
+    contiguous rows: chunks are visited in random order and shuffled in memory.
+    """
+    n = len(y)
+    if not shuffle:
+        for idx in range(0, n, batch_size):
+            yield np.asarray(x[idx: idx + batch_size], dtype=np.float32), y[idx: idx + batch_size]
+        return
+    if in_memory(x):
+        order = np.random.permutation(n)
+        for idx in range(0, n, batch_size):
+            batch = order[idx: idx + batch_size]
+            yield np.asarray(x[batch], dtype=np.float32), y[batch]
+        return
+    chunk_size = batch_size * CHUNK_BATCHES
+    for start in np.random.permutation(range(0, n, chunk_size)):
+        x_chunk = np.asarray(x[start: start + chunk_size], dtype=np.float32)
+        y_chunk = y[start: start + chunk_size]
+        order = np.random.permutation(len(y_chunk))
+        for idx in range(0, len(order), batch_size):
+            batch = order[idx: idx + batch_size]
+            yield x_chunk[batch], y_chunk[batch]
+
+
+class Prefetcher(object):
+    """
+    Run a generator in a background thread, `buffer_size` items ahead of the consumer
+    """
+    _END = object()
+
+    def __init__(self, generator, buffer_size=PREFETCH_BATCHES):
+        self.queue = Queue(maxsize=buffer_size)
+        self.thread = Thread(target=self._fill, args=(generator,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self, generator):
+        try:
+            for item in generator:
+                self.queue.put(item)
+        except Exception as e:
+            self.queue.put(e)
+        self.queue.put(self._END)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is self._END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def prefetch_batches(x, y, batch_size, shuffle=True, buffer_size=PREFETCH_BATCHES):
+    """ shuffled (x, y) batches of one epoch, prepared in a background thread """
+    return Prefetcher(iterate_batches(x, y, batch_size, shuffle), buffer_size)
+
+
+def eval_chunks(x, y, chunk_size=EVAL_CHUNK_SIZE):
+    """ (x, y) chunks of at most `chunk_size` examples, in order, prepared in a background thread """
+    return Prefetcher(iterate_batches(x, y, chunk_size, shuffle=False), 2)
@@ -1,13 +1,59 @@
 import argparse
 import pyprind
+import numpy as np
+import multiprocessing
+import hashlib
 import json
 import sys
 import os
 
 import inspect
+from itertools import izip
 
 sys.path.insert(1, os.path.join(sys.path[0], '..'))
+# N.B. features (and the word embeddings they use) are loaded before the
+# workers are forked, so all workers share the same embedding store.
 import features
+from feature_store import FeatureStore, store_path
+
+# number of messages per shard: each shard is computed by one worker and
+# appended to the feature store as soon as it is done and all previous shards
+# of the same feature are saved, which makes the build resumable.
+CHUNK_SIZE = 1000
+
+
+def file_hash(path):
+    """ sha1 of the content of a file """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def source_hash(feat):
+    """ sha1 of the source code of a feature class """
+    return hashlib.sha1(inspect.getsource(getattr(features, feat))).hexdigest()
+
+
+# feature instances of each worker, created at their first shard
+_feature_objects = {}
+
+
+def build_shard(shard):
+    """
+    Compute one feature for a list of messages, in a worker process
+    :param shard: (feature name, list of messages)
+    :return: float32 array of shape (len(messages), feature dim)
+    """
+    feat, messages = shard
+    if feat not in _feature_objects:
+        _feature_objects[feat] = features.initialize_features([feat])
+    feature_objects, dim = _feature_objects[feat]
+    # the whole shard at once: its candidates share few contexts and articles
+    triples = [(msg['article'], msg['context'], msg['candidate']) for msg in messages]
+    return features.get_batch(feature_objects, dim, triples).astype(np.float32)
+
 
 def main(args):
     # Get list of feature class names
@@ -15,37 +61,64 @@ def main(args):
     for name, obj in inspect.getmembers(features):
         if inspect.isclass(obj) and name not in ['SentimentIntensityAnalyzer', 'Feature']:
             feature_list.append(name)
+    if args.features:
+        feature_list = [feat for feat in feature_list if feat in args.features]
 
-    # construct feature file for each data file
+    pool = multiprocessing.Pool(args.workers)
+
+    # construct feature store for each data file
     for data_file in args.data:
         print "\nLoading %s..." % data_file
         with open(data_file, 'rb') as handle:
             data = json.load(handle)
         print "got %d examples" % len(data)
+        data_sha = file_hash(data_file)
+        store = FeatureStore(store_path(data_file))
 
-        print "building data..."
-        # show a progression bar on the screen
+        # find where to (re)start each feature
+        starts = {}
         for feat in feature_list:
-            print "feature %s" % feat
-            bar = pyprind.ProgBar(len(data), monitor=False, stream=sys.stdout)
-            data_features = []
-            for idx, msg in enumerate(data):
-                # create list of Feature instances
-                feature_object = features.get(msg['article'], msg['context'], msg['candidate'], [feat])
-                feature_object = feature_object[0]  # only one feature at a time
-                data_features.append(feature_object.feat.tolist())
-                bar.update()
-            # saving feature file
-            feature_path = data_file.replace('.json', '.features')
-            if not os.path.exists(feature_path):
-                os.makedirs(feature_path)
-            with open("%s/%s.json" % (feature_path, feat), "wb") as handle:
-                json.dump(data_features, handle)
-            print "saved feature file %s/%s.json" % (feature_path, feat)
+            feat_sha = source_hash(feat)
+            same_source = store.meta(feat, 'source_hash') == feat_sha
+            same_data = store.meta(feat, 'data_hash') == data_sha
+            if same_source and same_data and store.rows(feat) == len(data):
+                print "feature %s: up to date" % feat
+            elif same_source and (same_data or args.append) and store.rows(feat) <= len(data):
+                # interrupted build, or --append: messages added at the end of the data file
+                starts[feat] = store.rows(feat)
+            else:
+                # new feature, or its code or data changed: rebuild everything
+                store.remove(feat)
+                starts[feat] = 0
+        if not starts:
+            continue
+
+        # shard the remaining messages of every feature
+        shards = [(feat, start) for feat in feature_list if feat in starts
+                  for start in range(starts[feat], len(data), CHUNK_SIZE)]
+        for feat in feature_list:
+            if feat in starts:
+                print "feature %s: rows %d to %d" % (feat, starts[feat], len(data))
+        print "building %d shards with %d workers..." % (len(shards), args.workers)
+        # show a progression bar on the screen
+        bar = pyprind.ProgBar(len(shards), monitor=False, stream=sys.stdout)
+        # imap returns the shards in order: each one is appended after the previous ones
+        blocks = pool.imap(build_shard, [(feat, data[start: start + CHUNK_SIZE]) for feat, start in shards])
+        for (feat, start), block in izip(shards, blocks):
+            assert store.rows(feat) == start
+            store.append(feat, block, data_hash=data_sha, source_hash=source_hash(feat))
+            bar.update()
+        print "saved features in %s" % store.path
+
+    pool.close()
+    pool.join()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("data", nargs='+', type=str, help="List of files to build features for")
+    parser.add_argument("-f", "--features", nargs='+', type=str, default=None, help="List of features to build, default all")
+    parser.add_argument("-a", "--append", action='store_true', help="data files only got new messages at their end: only build the rows of those")
+    parser.add_argument("-w", "--workers", type=int, default=multiprocessing.cpu_count(), help="number of worker processes")
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import tempfile
+import pymongo
+from bson.objectid import ObjectId
+
+# Bulk reading of the conversations stored in the convai database.
+# A conversation is logged twice: by the bot in db.local (client side, only valid
+# conversations, with the model & policy of each message) and by the convai server in
+# db.dialogs (server side, with the evaluations). Both are matched by `dialogId`.
+# db.local is read with one cursor, in insertion order, and the server side dialogs of
+# each batch of `batch_size` local dialogs are fetched with a single `$in` query on the
+# indexed `dialogId`, instead of one query per conversation.
+# The `_id` of the last local dialog read is a high-water mark: passing it as `since`
+# to the next run only reads the dialogs stored after it.
+# Reading never writes to the database: the `dialogId` indexes are created once by an
+# account allowed to, with `python dialog_db.py --create_indexes` (or the --create_indexes
+# flag of extract_dialogues_from_db.py).
+# Any database object works, ie: `mongomock.MongoClient().convai` for a local stand-in,
+# which `python dialog_db.py --self_check` uses to check this module without a server.
+#
+#   db = connect()
+#   for d_local, d_servr_list in iter_dialogs(db, since=load_watermark(path)):
+#       ...
+#       save_watermark(path, d_local['_id'])
+
+PORT = 8091
+CLIENT = '132.206.3.23'
+# number of local dialogs whose server side dialogs are fetched with one query
+BATCH_SIZE = 500
+
+
+def connect(host=CLIENT, port=PORT):
+    """ :return: the convai database """
+    return pymongo.MongoClient(host, port).convai
+
+
+def ensure_indexes(db):
+    """
+    index `dialogId` on both collections, does nothing if the indexes already exist.
+    Needs write access, and building the indexes of large collections takes a while
+    """
+    db.local.create_index('dialogId')
+    db.dialogs.create_index('dialogId')
+
+
+def iter_dialogs(db, since=None, batch_size=BATCH_SIZE, local_fields=None, servr_fields=None):
+    """
+    Stream the local dialogs with their matching server side dialogs
+    :param db: convai database
+    :param since: high-water mark, only the local dialogs stored after it are read
+    :param local_fields: fields of the local dialogs to read, default: all
+    :param servr_fields: fields of the server side dialogs to read, default: all
+    :return: generator of (local dialog, list of server side dialogs with the same dialogId),
+      in the order the local dialogs were stored
+    """
+    query = {} if since is None else {'_id': {'$gt': since}}
+    if local_fields is not None:
+        local_fields = dict([(field, 1) for field in local_fields] + [('dialogId', 1)])
+    if servr_fields is not None:
+        servr_fields = dict([(field, 1) for field in servr_fields] + [('dialogId', 1)])
+
+    cursor = db.local.find(query, local_fields).sort('_id', pymongo.ASCENDING).batch_size(batch_size)
+    batch = []
+    for d_local in cursor:
+        batch.append(d_local)
+        if len(batch) == batch_size:
+            for pair in _match(db, batch, servr_fields):
+                yield pair
+            batch = []
+    for pair in _match(db, batch, servr_fields):
+        yield pair
+
+
+def _match(db, local_dialogs, servr_fields):
+    if len(local_dialogs) == 0:
+        return []
+    servr_dialogs = {}
+    d_ids = list(set(d_local['dialogId'] for d_local in local_dialogs))
+    for d_servr in db.dialogs.find({'dialogId': {'$in': d_ids}}, servr_fields):
+        servr_dialogs.setdefault(d_servr['dialogId'], []).append(d_servr)
+    return [(d_local, servr_dialogs.get(d_local['dialogId'], [])) for d_local in local_dialogs]
+
+
+def load_watermark(path):
+    """ :return: high-water mark saved in `path`, None if there is none yet """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as handle:
+        return ObjectId(json.load(handle)['_id'])
+
+
+def save_watermark(path, watermark):
+    # write then rename, so that an interrupted run never leaves a truncated file
+    with open(path + '.tmp', 'w') as handle:
+        json.dump({'_id': str(watermark)}, handle)
+    os.rename(path + '.tmp', path)
+
+
+def self_check():
+    """ run iter_dialogs and the high-water mark on a mongomock database, raise AssertionError on failure """
+    import mongomock  # only needed by the check
+    db = mongomock.MongoClient().convai
+    ensure_indexes(db)
+    # local dialog i has dialogId i % 3, the server logged dialogId 0 twice and never saw dialogId 2
+    for i in range(5):
+        db.local.insert_one({'dialogId': i % 3, 'logs': ['local %d' % i]})
+    for d_id in [0, 1, 0]:
+        db.dialogs.insert_one({'dialogId': d_id, 'thread': ['server %d' % d_id], 'users': []})
+
+    pairs = list(iter_dialogs(db, batch_size=2, servr_fields=['thread']))
+    assert [d_local['logs'] for d_local, _ in pairs] == [['local %d' % i] for i in range(5)]
+    assert [len(d_servr_list) for _, d_servr_list in pairs] == [2, 1, 0, 2, 1]
+    for d_local, d_servr_list in pairs:
+        for d_servr in d_servr_list:
+            assert d_servr['dialogId'] == d_local['dialogId']
+            assert 'users' not in d_servr
+
+    pairs = list(iter_dialogs(db, local_fields=[]))
+    assert sorted(pairs[0][0].keys()) == ['_id', 'dialogId']
+
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    os.remove(path)
+    try:
+        assert load_watermark(path) is None
+        save_watermark(path, pairs[2][0]['_id'])
+        since = load_watermark(path)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    assert [d_local['logs'] for d_local, _ in iter_dialogs(db, since=since)] == [['local 3'], ['local 4']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--create_indexes', action='store_true', help='index dialogId on both collections, needs write access')
+    parser.add_argument('--self_check', action='store_true', help='check this module on a mongomock database')
+    parser.add_argument('--host', type=str, default=CLIENT, help='mongo host')
+    parser.add_argument('--port', type=int, default=PORT, help='mongo port')
+    args = parser.parse_args()
+    if args.self_check:
+        self_check()
+        print "self check passed"
+    if args.create_indexes:
+        ensure_indexes(connect(args.host, args.port))
+        print "indexes created"
@@ -0,0 +1,147 @@
+import io
+import json
+import os
+
+# Compact store of ranker training instances.
+# Instead of repeating the article and the whole context in every instance, a store
+# keeps each distinct article and utterance once, and each dialogue as the list of
+# the ids of its turns. An instance refers to its context by (dialogue id, number of
+# turns): its context is the first turns of the final dialogue. A store is a directory:
+#  - `articles.jsonl`: one article per line, its id is its line number
+#  - `utterances.jsonl`: one utterance per line, its id is its line number
+#  - `dialogues.jsonl`: one [article id, [utterance ids]] per line
+#  - `instances.jsonl`: one [dialogue id, context length, candidate utterance id, r, R, policy, model] per line
+# All files are only appended to, so a store is written while the dialogues are read.
+#
+#   with DialogueStore(path, 'w') as store:
+#       store.add_dialogue(article, turns, instances)
+#   for instance in DialogueStore(path):  # {'article', 'context', 'candidate', 'r', 'R', 'policy', 'model'}
+#       ...
+
+FILES = ['articles', 'utterances', 'dialogues', 'instances']
+# number of characters read at once by iter_json_array
+CHUNK_SIZE = 1 << 20
+
+
+def iter_json_array(path, chunk_size=CHUNK_SIZE):
+    """
+    Read the elements of a JSON file containing one array one after the other,
+    without loading the whole file
+    """
+    decoder = json.JSONDecoder()
+    with io.open(path, 'r', encoding='utf-8') as handle:
+        buf = handle.read(chunk_size).lstrip()
+        if not buf.startswith(u'['):
+            raise ValueError("%s does not contain a JSON array" % path)
+        pos = 1
+        eof = False
+        while True:
+            # skip separators
+            while pos < len(buf) and buf[pos] in u' \t\r\n,':
+                pos += 1
+            if pos < len(buf) and buf[pos] == u']':
+                return
+            try:
+                if pos == len(buf):
+                    raise ValueError("need more data")
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise ValueError("%s: truncated JSON array" % path)
+                chunk = handle.read(chunk_size)
+                eof = len(chunk) == 0
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield element
+            pos = end
+
+
+class DialogueStore(object):
+    def __init__(self, path, mode='r'):
+        """
+        :param path: directory of the store
+        :param mode: 'r' to read instances, 'w' to write a new store
+        """
+        self.path = path
+        self.mode = mode
+        self.n_dialogues = 0
+        self.n_instances = 0
+        if mode == 'w':
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.handles = dict((name, open(self._file(name), 'wb')) for name in FILES)
+            self.article_ids = {}
+            self.utterance_ids = {}
+
+    def _file(self, name):
+        return os.path.join(self.path, '%s.jsonl' % name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.mode == 'w':
+            for handle in self.handles.values():
+                handle.close()
+
+    def _intern(self, ids, name, text):
+        idx = ids.get(text)
+        if idx is None:
+            idx = len(ids)
+            ids[text] = idx
+            self.handles[name].write(json.dumps(text) + '\n')
+        return idx
+
+    def add_dialogue(self, article, turns, instances):
+        """
+        :param article: article of the dialogue
+        :param turns: list of utterances of the dialogue
+        :param instances: list of (context length, candidate, r, R, policy, model),
+          the context of an instance being turns[:context length]
+        """
+        article_id = self._intern(self.article_ids, 'articles', article)
+        turn_ids = [self._intern(self.utterance_ids, 'utterances', turn) for turn in turns]
+        self.handles['dialogues'].write(json.dumps([article_id, turn_ids]) + '\n')
+        for context_length, candidate, r, R, policy, model in instances:
+            assert context_length <= len(turns)
+            candidate_id = self._intern(self.utterance_ids, 'utterances', candidate)
+            self.handles['instances'].write(json.dumps([self.n_dialogues, context_length, candidate_id, r, R, policy, model]) + '\n')
+            self.n_instances += 1
+        self.n_dialogues += 1
+
+    def _read_lines(self, name):
+        with open(self._file(name), 'rb') as handle:
+            return [json.loads(line) for line in handle]
+
+    def __iter__(self):
+        """ instances in the format of the JSON files of extract_dialogues_from_*.py """
+        articles = self._read_lines('articles')
+        utterances = self._read_lines('utterances')
+        dialogues = self._read_lines('dialogues')
+        with open(self._file('instances'), 'rb') as handle:
+            for line in handle:
+                dialogue_id, context_length, candidate_id, r, R, policy, model = json.loads(line)
+                article_id, turn_ids = dialogues[dialogue_id]
+                yield {
+                    'article': articles[article_id],
+                    'context': [utterances[idx] for idx in turn_ids[:context_length]],
+                    'candidate': utterances[candidate_id],
+                    'r': r,
+                    'R': R,
+                    'policy': policy,
+                    'model': model
+                }
+
+    def to_json(self, path):
+        """ write the instances to a JSON file readable by train.py, one instance at a time """
+        with open(path, 'wb') as handle:
+            handle.write('[')
+            for i, instance in enumerate(self):
+                if i > 0:
+                    handle.write(', ')
+                json.dump(instance, handle)
+            handle.write(']')
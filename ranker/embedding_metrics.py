@@ -1,117 +1,176 @@
 from gensim.models import KeyedVectors
 import numpy as np
+import argparse
 
 
 print "loading word2vec embeddings..."
 w2v = KeyedVectors.load_word2vec_format("/root/convai/data/GoogleNews-vectors-negative300.bin", binary=True)
 # w2v = KeyedVectors.load_word2vec_format("/home/ml/nangel3/research/data/embeddings/GoogleNews-vectors-negative300.bin", binary=True)
 
+# Embedding metrics between two texts (tokens separated by spaces).
+# Each text is turned once into the (n_tokens, 300) matrix of the embeddings of its
+# known tokens, gathered from the embedding matrix in one indexing operation.
+# The greedy score of both directions comes from one product of the row-normalized
+# matrices of the two texts. Recently seen texts are cached, since the ranker
+# features compare every candidate to the same context and article.
+# batch_similarity_scores() goes further when scoring many candidates: the ones
+# compared to the same text are stacked and matched to it with a single product.
+
+# embedding matrix and vocabulary of w2v (attribute names depend on the gensim version)
+VECTORS = w2v.vectors if hasattr(w2v, 'vectors') else w2v.syn0
+VOCAB = w2v.vocab
+# maximum number of texts whose embeddings are cached
+CACHE_SIZE = 1024
+_cache = {}
+
+
+class TextEmbeddings(object):
+    def __init__(self, text):
+        """
+        Embeddings of the known tokens of `text`
+        :param text: tokens separated by spaces
+        """
+        indices = [VOCAB[tok].index for tok in text.strip().split(" ") if tok in VOCAB]
+        matrix = VECTORS[indices]  # (n_tokens, dim)
+        norms = np.sqrt(np.sum(matrix.astype(np.float64) ** 2, axis=1))
+        self.n_tokens = len(indices)
+        # Frobenius norm of the token matrix
+        self.norm = np.sqrt(np.sum(norms ** 2))
+        # row-normalized embeddings
+        self.unit = matrix / np.maximum(norms, 1e-12)[:, None]
+        self.total = np.sum(matrix, axis=0, dtype=np.float64)
+        if self.n_tokens > 0:
+            xmax = np.max(matrix, axis=0)
+            xmin = np.min(matrix, axis=0)
+            self.extrema = np.where(np.abs(xmin) > xmax, xmin, xmax)
+        else:
+            self.extrema = np.zeros((VECTORS.shape[1],), dtype=VECTORS.dtype)
 
-def greedy_score(one, two):
-    """Greedy matching between two texts"""
-    dim = w2v.vector_size  # dimension of embeddings
-
-    tokens1 = one.strip().split(" ")
-    tokens2 = two.strip().split(" ")
-    # X = np.zeros((dim,))  # array([ 0.,  0.,  0.,  0.])
-    y_count = 0
-    x_count = 0
-    score = 0.0
-    Y = np.zeros((dim,1))  # array([ [0.],  [0.],  [0.],  [0.] ])
-    for tok in tokens2:    # for each token in the second text, add its column to Y
-        if tok in w2v:
-            y = np.array(w2v[tok])
-            y /= np.linalg.norm(y)
-            Y = np.hstack((Y, y.reshape((dim,1)) ))
-            y_count += 1
-    # Y ~ (dim, #of tokens in second text)
-    # Y /= np.linalg.norm(Y)
-
-    for tok in tokens1:  # for each token in the first text,
-        if tok in w2v:
-            x = np.array(w2v[tok])
-            x /= np.linalg.norm(x)
-            tmp = x.reshape((1,dim)).dot(Y)  # dot product with all other tokens from Y
-            score += np.max(tmp)  # add the max value between this token and any token in Y
-            x_count += 1
 
-    # if none of the words in response or ground truth have embeddings, return zero
-    if x_count < 1 or y_count < 1:
-        return 0.0
+def embed(text):
+    """ TextEmbeddings of `text`, cached """
+    embeddings = _cache.get(text)
+    if embeddings is None:
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        embeddings = TextEmbeddings(text)
+        _cache[text] = embeddings
+    return embeddings
 
-    score /= float(x_count)
-    return score
 
+def _greedy(x, y):
+    """ greedy matching score of x to y and of y to x """
+    # if none of the words in response or ground truth have embeddings, return zero
+    if x.n_tokens < 1 or y.n_tokens < 1:
+        return 0.0, 0.0
+    sims = np.dot(x.unit, y.unit.T)  # (x tokens, y tokens)
+    # each token is matched with its most similar token of the other text, or 0 if all are negative
+    return np.mean(np.maximum(np.max(sims, axis=1), 0.)), np.mean(np.maximum(np.max(sims, axis=0), 0.))
 
-def extrema_score(one, two):
-    """Extrema embedding score between two texts"""
-    tokens1 = one.strip().split(" ")
-    tokens2 = two.strip().split(" ")
-    X = []
-    for tok in tokens1:
-        if tok in w2v:
-            X.append(w2v[tok])
-    Y = []
-    for tok in tokens2:
-        if tok in w2v:
-            Y.append(w2v[tok])
-
-    # if none of the words in text1 have embeddings, return 0
-    if np.linalg.norm(X) < 0.00000000001:
-        return 0.0
 
-    # if none of the words in text2 have embeddings, return 0
-    if np.linalg.norm(Y) < 0.00000000001:
+def _average(x, y):
+    # if none of the words in one of the texts have embeddings, return 0
+    if np.linalg.norm(x.total) < 0.00000000001 or np.linalg.norm(y.total) < 0.00000000001:
         return 0.0
+    return np.dot(x.total, y.total) / np.linalg.norm(x.total) / np.linalg.norm(y.total)
 
-    xmax = np.max(X, 0)  # get positive max
-    xmin = np.min(X, 0)  # get abs of min
-    xtrema = []
-    for i in range(len(xmax)):
-        if np.abs(xmin[i]) > xmax[i]:
-            xtrema.append(xmin[i])
-        else:
-            xtrema.append(xmax[i])
-    X = np.array(xtrema)  # get extrema
-
-    ymax = np.max(Y, 0)
-    ymin = np.min(Y, 0)
-    ytrema = []
-    for i in range(len(ymax)):
-        if np.abs(ymin[i]) > ymax[i]:
-            ytrema.append(ymin[i])
-        else:
-            ytrema.append(ymax[i])
-    Y = np.array(ytrema)  # get extrema
 
-    score = np.dot(X, Y.T)/np.linalg.norm(X)/np.linalg.norm(Y)
-    return score
+def _extrema(x, y):
+    # if none of the words in one of the texts have embeddings, return 0
+    if x.norm < 0.00000000001 or y.norm < 0.00000000001:
+        return 0.0
+    return np.dot(x.extrema, y.extrema) / np.linalg.norm(x.extrema) / np.linalg.norm(y.extrema)
 
 
-def average_score(one, two):
-    """Average embedding score between two texts"""
-    dim = w2v.vector_size # dimension of embeddings
-    tokens1 = one.strip().split(" ")
-    tokens2 = two.strip().split(" ")
-    X = np.zeros((dim,))
-    for tok in tokens1:
-        if tok in w2v:
-            X += w2v[tok]
-    Y = np.zeros((dim,))
-    for tok in tokens2:
-        if tok in w2v:
-            Y += w2v[tok]
-
-    # if none of the words in text1 have embeddings, return 0
-    if np.linalg.norm(X) < 0.00000000001:
-        return 0.0
+def greedy_score(one, two):
+    """Greedy matching between two texts"""
+    return _greedy(embed(one), embed(two))[0]
 
-    # if none of the words in text2 have embeddings, return 0
-    if np.linalg.norm(Y) < 0.00000000001:
-        return 0.0
 
-    X = np.array(X)/np.linalg.norm(X)
-    Y = np.array(Y)/np.linalg.norm(Y)
-    score = np.dot(X, Y.T)/np.linalg.norm(X)/np.linalg.norm(Y)
-    return score
+def extrema_score(one, two):
+    """Extrema embedding score between two texts"""
+    return _extrema(embed(one), embed(two))
+
 
+def average_score(one, two):
+    """Average embedding score between two texts"""
+    return _average(embed(one), embed(two))
+
+
+def similarity_scores(one, two):
+    """
+    All embedding scores between two texts
+    :return: (mean of the greedy scores of both directions, average score, extrema score)
+    """
+    x, y = embed(one), embed(two)
+    greedy_xy, greedy_yx = _greedy(x, y)
+    return (greedy_xy + greedy_yx) / 2.0, _average(x, y), _extrema(x, y)
+
+
+def _row_cosines(a, b, valid):
+    """ cosine similarity of each row of `a` with the same row of `b`, 0 where not `valid` """
+    denominator = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return np.where(valid, np.sum(a * b, axis=1) / np.where(valid, denominator, 1.), 0.)
+
+
+def batch_similarity_scores(pairs):
+    """
+    `similarity_scores()` of many pairs of texts at once
+    :param pairs: list of (one, two) texts
+    :return: array of shape (len(pairs), 3)
+    """
+    scores = np.zeros((len(pairs), 3))
+    if len(pairs) == 0:
+        return scores
+    xs = [embed(one) for one, _ in pairs]
+    ys = [embed(two) for _, two in pairs]
+    # greedy: all pairs sharing the same second text are matched with one product
+    groups = {}
+    for i, (_, two) in enumerate(pairs):
+        if xs[i].n_tokens > 0 and ys[i].n_tokens > 0:
+            groups.setdefault(two, []).append(i)
+    for members in groups.values():
+        y = ys[members[0]]
+        counts = np.array([xs[i].n_tokens for i in members])
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sims = np.dot(np.concatenate([xs[i].unit for i in members]), y.unit.T)  # (x tokens of all members, y tokens)
+        greedy_xy = np.add.reduceat(np.maximum(np.max(sims, axis=1), 0.), starts) / counts
+        greedy_yx = np.mean(np.maximum(np.maximum.reduceat(sims, starts, axis=0), 0.), axis=1)
+        scores[members, 0] = (greedy_xy + greedy_yx) / 2.0
+    # average and extrema: row-wise cosines of the stacked vectors
+    totals_x = np.array([x.total for x in xs])
+    totals_y = np.array([y.total for y in ys])
+    scores[:, 1] = _row_cosines(totals_x, totals_y, (np.linalg.norm(totals_x, axis=1) >= 0.00000000001) &
+                                (np.linalg.norm(totals_y, axis=1) >= 0.00000000001))
+    scores[:, 2] = _row_cosines(np.array([x.extrema for x in xs], dtype=np.float64),
+                                np.array([y.extrema for y in ys], dtype=np.float64),
+                                np.array([x.norm >= 0.00000000001 and y.norm >= 0.00000000001 for x, y in zip(xs, ys)]))
+    return scores
+
+
+def self_check():
+    """ compare batch_similarity_scores() to similarity_scores(), raise AssertionError on failure """
+    context = "what do you think about the article"
+    article = "the cat sat on the mat while the dog was barking at the mailman"
+    candidates = ["i think it is about a cat", "dogs bark", "the the the", "", "qzxqzv vqzxqz",
+                  "what about the dog ?", "i think it is about a cat"]
+    # candidates sharing the context or the article, unknown and empty texts on both sides
+    pairs = [(c, context) for c in candidates] + [(c, article) for c in candidates] + \
+            [(context, article), (article, context), ("a cat", ""), ("a cat", "qzxqzv"), ("", "")]
+    scores = batch_similarity_scores(pairs)
+    assert scores.shape == (len(pairs), 3)
+    for (one, two), row in zip(pairs, scores):
+        assert np.allclose(row, similarity_scores(one, two), atol=1e-6), (one, two, row, similarity_scores(one, two))
+    # the result must not depend on the embedding cache
+    _cache.clear()
+    assert np.allclose(batch_similarity_scores(pairs[::-1]), scores[::-1], atol=1e-6)
+    assert batch_similarity_scores([]).shape == (0, 3)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--self_check', action='store_true', help='check batch_similarity_scores() against similarity_scores()')
+    args = parser.parse_args()
+    if args.self_check:
+        self_check()
+        print "self check passed"
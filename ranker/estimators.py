@@ -1,7 +1,10 @@
 import tensorflow as tf
+import numpy as np
 import time
 import cPickle as pkl
 
+from batches import prefetch_batches, eval_chunks
+
 
 ACTIVATIONS = {
     'swish': lambda x: x * tf.sigmoid(x),
@@ -157,7 +160,7 @@ class Estimator(object):
         # Add ops to save and restore all the variables.
         self.saver = tf.train.Saver()
 
-    def train(self, session, mode, patience, batch_size, dropout_rate, save=True, pretrained=None, previous_accuracies=None, verbose=True):
+    def train(self, session, mode, patience, batch_size, dropout_rate, save=True, pretrained=None, previous_accuracies=None, verbose=True, stop_trial=None):
         """
         :param session: tensorflow session
         :param mode: Estimator.SHORT_TERM or Estimator.LONG_TERM
@@ -168,6 +171,8 @@ class Estimator(object):
         :param pretrained: list of (model_path, model_id, model_name) for the pretrained model, or None
         :param previous_accuracies: list of (train_accuracies, valid_accuracies) from pretrained model, or None
         :param verbose: print statements all over the place or not
+        :param stop_trial: function(fold, epoch, valid_accs) called after each epoch, returns True
+            to stop training because this configuration is hopeless. Sets `self.stopped`
         """
         self.batch_size = batch_size
         self.dropout_rate = dropout_rate
@@ -179,13 +184,14 @@ class Estimator(object):
             self.train_accuracies = []
             self.valid_accuracies = []
 
+        self.stopped = False
+
         # Perform k-fold cross validation: train/valid on k different part of the data
         fold = 0
         for (x_train, y_train), (x_valid, y_valid) in zip(self.trains, self.valids):
             fold += 1
             train_accs = []  # accuracies for this fold, to be added at the end of the fold
             valid_accs = []  # accuracies for this fold, to be added at the end of the fold
-            n, _ = x_train.shape
 
             best_valid_acc = -100000.
             p = patience
@@ -200,16 +206,15 @@ class Estimator(object):
                 session.run(self.init_op)
 
             for epoch in range(20000):  # will probably stop before 20k epochs due to early stop
-                # do 1 epoch: go through all training_batches
-                for idx in range(0, n, batch_size):
+                # do 1 epoch: go through all training_batches, shuffled and prepared in the background
+                for step, (x_batch, y_batch) in enumerate(prefetch_batches(x_train, y_train, batch_size)):
                     _, loss = session.run(
                         [self.train_step, self.loss],
-                        feed_dict={self.x: x_train[idx: idx + batch_size],
-                                   self.y: y_train[idx: idx + batch_size],
+                        feed_dict={self.x: x_batch,
+                                   self.y: y_batch,
                                    self.keep_prob: 1.0 - dropout_rate,
                                    self.mode: mode}
                     )
-                    step = idx / batch_size
                     # if step % 10 == 0:
                     #     print "[fold %d] epoch %d - step %d - training loss: %g" % (fold, epoch+1, step, loss)
                 if verbose: print "[fold %d] epoch %d - step %d - training loss: %g" % (fold, epoch+1, step, loss)
@@ -236,6 +241,10 @@ class Estimator(object):
                 if verbose: print "[fold %d] epoch %d: patience: %d" % (fold, epoch+1, p)
                 if p == 0:
                     break
+                if stop_trial is not None and stop_trial(fold, epoch+1, valid_accs):
+                    if verbose: print "[fold %d] epoch %d: stop hopeless trial" % (fold, epoch+1)
+                    self.stopped = True
+                    break
 
             self.train_accuracies.append(train_accs)
             self.valid_accuracies.append(valid_accs)
@@ -244,6 +253,8 @@ class Estimator(object):
                 # save the arguments and the timings when done this fold
                 self.save(session, save_model=False)
             if verbose: print "------------------------------"
+            if self.stopped:
+                break
 
     def test(self, mode, x=None, y=None):
         """
@@ -260,26 +271,39 @@ class Estimator(object):
         """
         :param mode: SHORT_TERM or LONG_TERM: different accuracy definition
         """
-        # Evaluate accuracy, so no dropout
-        acc = self.accuracy.eval(
-            feed_dict={self.x: x, self.y: y, self.keep_prob: 1.0, self.mode: mode}
-        )
-        return acc
+        # Evaluate accuracy, so no dropout, on chunks of bounded size.
+        # Both accuracies are averages over the examples: weight each chunk by its size
+        acc = 0.
+        for x_chunk, y_chunk in eval_chunks(x, y):
+            acc += len(y_chunk) * self.accuracy.eval(
+                feed_dict={self.x: x_chunk, self.y: y_chunk, self.keep_prob: 1.0, self.mode: mode}
+            )
+        return acc / len(y)
 
     def predict(self, mode, x):
         """
-        :param mode: SHORT_TERM or LONG_TERM: different prediction definition
+        :param mode: SHORT_TERM or LONG_TERM: different prediction definition,
+          or a list of modes to evaluate on the same `x`
+        :param x: batch of candidates, shape (bs, input_dim)
         :return: prediction tensor to the user and the model's confidence:
           if mode is LONG_TERM, then confidence and predictions are the same
           if mode is SHORT_TERM, confidence is the probability of an up-vote
+          if mode is a list, one (predictions, confidences) tuple per mode
         """
-        preds = self.predictions.eval(
-            feed_dict={self.x: x, self.keep_prob: 1.0, self.mode: mode}
-        )
-        confs = self.confidences.eval(
-            feed_dict={self.x: x, self.keep_prob: 1.0, self.mode: mode}
-        )
-        return preds, confs
+        # convert the input once, for all modes
+        x = np.asarray(x, dtype=np.float32)
+        session = tf.get_default_session()
+        # predictions and confidences in one pass. The mode is a tf.cond
+        # placeholder, so each mode still needs its own pass.
+        many = isinstance(mode, (list, tuple))
+        outputs = []
+        for m in (mode if many else [mode]):
+            preds, confs = session.run(
+                [self.predictions, self.confidences],
+                feed_dict={self.x: x, self.keep_prob: 1.0, self.mode: m}
+            )
+            outputs.append((preds, confs))
+        return outputs if many else outputs[0]
 
     def save(self, session, save_model=True, save_args=True, save_timings=True):
         prefix = "%s/%s_%s" % (self.model_path, self.model_id, self.model_name)
@@ -305,6 +329,9 @@ class Estimator(object):
                     pkl.HIGHEST_PROTOCOL
                 )
             print "Args (and data) saved."
+            # save the weights needed at inference time, without the data
+            if tf.train.checkpoint_exists("%s_model.ckpt" % prefix):
+                self.export()
         # Save timings measured during training
         if save_timings:
             with open("%s_timings.pkl" % prefix, 'wb') as handle:
@@ -315,6 +342,21 @@ class Estimator(object):
                 )
             print "Timings saved."
 
+    def export(self, model_path=None, model_id=None, model_name=None):
+        """
+        Save an inference-only bundle of this model to `<prefix>_inference.pkl`,
+        see ranker/inference.py. Weights are read from the saved checkpoint.
+        Default is this model path, id, name.
+        """
+        if model_path is None or model_id is None or model_name is None:
+            model_path = self.model_path
+            model_id   = self.model_id
+            model_name = self.model_name
+        return export_inference_bundle(
+            model_path, model_id, model_name, self.feature_list, self.input_dim,
+            self.hidden_dims, self.hidden_dims_extra, self.activation
+        )
+
     def load(self, session, model_path=None, model_id=None, model_name=None):
         """
         Load graph from given model path, id, name. Default is this model path, id, name.
@@ -327,3 +369,45 @@ class Estimator(object):
         print "Model restored to %s/%s_%s" % (model_path, model_id, model_name)
 
 
+
+
+def export_inference_bundle(model_path, model_id, model_name, feature_list, input_dim, hidden_dims, hidden_dims_extra, activation):
+    """
+    Read the weights of a saved estimator from its checkpoint and pickle them
+    with its architecture and feature list into `<prefix>_inference.pkl`
+    :return: path of the saved bundle
+    """
+    prefix = "%s/%s_%s" % (model_path, model_id, model_name)
+    reader = tf.train.NewCheckpointReader("%s_model.ckpt" % prefix)
+
+    def _layer(name):
+        return reader.get_tensor('%s/kernel' % name), reader.get_tensor('%s/bias' % name)
+
+    # output layers are the unnamed dense layers of the `logits_layer` condition:
+    # find them by their number of units. Optimizer slots (ie: 'dense/kernel/Adam') are ignored.
+    outputs = {}
+    for name, shape in reader.get_variable_to_shape_map().items():
+        if name.endswith('/kernel') and not name.startswith('dense_layer') and not name.startswith('extra_dense_layer'):
+            outputs[shape[-1]] = _layer(name[:-len('/kernel')])
+
+    bundle = {
+        'feature_list': feature_list,
+        'input_dim': input_dim,
+        'hidden_dims': hidden_dims,
+        'hidden_dims_extra': hidden_dims_extra,
+        'activation': activation,
+        'model_id': model_id,
+        'model_name': model_name,
+        # the estimators are trained on raw features: nothing to normalize
+        'input_mean': None,
+        'input_std': None,
+        'layers': [_layer('dense_layer%d' % (idx + 1)) for idx in range(len(hidden_dims))],
+        'extra_layers': [_layer('extra_dense_layer_%d' % (idx + 1)) for idx in range(len(hidden_dims_extra))],
+        'short_term': outputs[2],
+        'long_term': outputs[1]
+    }
+    path = "%s_inference.pkl" % prefix
+    with open(path, 'wb') as handle:
+        pkl.dump(bundle, handle, pkl.HIGHEST_PROTOCOL)
+    print "Inference bundle saved in file: %s" % path
+    return path
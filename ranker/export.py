@@ -0,0 +1,123 @@
+import numpy as np
+import cPickle as pkl
+import argparse
+import sys
+
+from estimators import export_inference_bundle
+import inference
+
+# Write the inference-only bundle of previously trained estimators.
+# Models trained after this script was added already have one.
+#   python export.py models/short_term/0.641391/1510248853.21_Estimator_
+# With --check, also compare the outputs of the numpy and tensorflow inference
+# backends to the trained estimator on its test set (exit code 1 if they differ):
+#   python export.py models/short_term/0.641391/1510248853.21_Estimator_ --check
+
+
+def load_args(prefix):
+    """
+    :param prefix: example: models/short_term/0.643257/1510158946.66_VoteEstimator_
+    :return: data, hidden_dims, hidden_dims_extra, activation, optimizer, learning_rate,
+      model_path, model_id, model_name ; or None if the arguments are not recognized
+    """
+    print "Loading model arguments %sargs.pkl ..." % prefix
+    with open("%sargs.pkl" % prefix, 'rb') as handle:
+        model_args = pkl.load(handle)
+
+    if len(model_args) == 12:
+        data, \
+        hidden_dims, hidden_dims_extra, activation, \
+        optimizer, learning_rate, \
+        model_path, model_id, model_name, \
+        batch_size, dropout_rate, pretrained = model_args
+    elif len(model_args) == 8:
+        data, \
+        hidden_dims, activation, \
+        optimizer, learning_rate, \
+        model_id, \
+        batch_size, dropout_rate = model_args
+        # reconstruct missing parameters
+        hidden_dims_extra = [hidden_dims[-1]]
+        model_name = prefix.split(model_id)[1].replace('_', '')
+    else:
+        print "WARNING: %d model arguments, cannot load %s" % (len(model_args), prefix)
+        return
+
+    # reconstruct model_path just in case it has been moved:
+    model_path = prefix.split(model_id)[0]
+    if model_path.endswith('/'):
+        model_path = model_path[:-1]  # ignore the last '/'
+
+    return data, \
+        hidden_dims, hidden_dims_extra, activation, \
+        optimizer, learning_rate, \
+        model_path, model_id, model_name
+
+
+def export(model_args):
+    data, \
+        hidden_dims, hidden_dims_extra, activation, \
+        _, _, \
+        model_path, model_id, model_name = model_args
+    feature_list = data[-1]
+    _, input_dim = data[0][0][0].shape
+    return export_inference_bundle(
+        model_path, model_id, model_name, feature_list, input_dim,
+        hidden_dims, hidden_dims_extra, activation
+    )
+
+
+def check(model_args, bundle_path, n_samples, tolerance):
+    """
+    Compare the inference backends to the trained estimator on its test set
+    :return: True if all predictions and confidences match within `tolerance`
+    """
+    import tensorflow as tf
+    from estimators import Estimator, SHORT_TERM_MODE, LONG_TERM_MODE
+    modes = [SHORT_TERM_MODE, LONG_TERM_MODE]
+
+    data = model_args[0]
+    x_test = np.asarray(data[2][0][:n_samples], dtype=np.float32)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        estimator = Estimator(*model_args)
+        with tf.Session(graph=graph) as sess:
+            estimator.load(sess)
+            expected = estimator.predict(modes, x_test)
+
+    bundle = inference.load_bundle(bundle_path)
+    ok = True
+    for backend in sorted(inference.BACKENDS):
+        ranker = inference.build_estimator(bundle, backend)
+        outputs = ranker.predict(modes, x_test)
+        ranker.close()
+        for mode, (preds, confs), (exp_preds, exp_confs) in zip(modes, outputs, expected):
+            pred_diff = np.max(np.abs(preds - exp_preds))
+            conf_diff = np.max(np.abs(confs - exp_confs))
+            print "[%s] mode %d on %d samples: max prediction diff: %g - max confidence diff: %g" % (
+                backend, mode, len(x_test), pred_diff, conf_diff)
+            if pred_diff > tolerance or conf_diff > tolerance:
+                ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("prefixes", nargs='+', type=str, help="List of model prefixes to export, ie: models/short_term/0.641391/1510248853.21_Estimator_")
+    parser.add_argument("-c", "--check", action='store_true', help="compare the inference backends to the trained estimator")
+    parser.add_argument("-n", "--n_samples", type=int, default=1000, help="number of test examples to compare")
+    parser.add_argument("-tol", "--tolerance", type=float, default=1e-4, help="maximum absolute difference allowed")
+    args = parser.parse_args()
+    all_ok = True
+    for prefix in args.prefixes:
+        model_args = load_args(prefix)
+        if model_args is None:
+            all_ok = False
+            continue
+        bundle_path = export(model_args)
+        if args.check:
+            ok = check(model_args, bundle_path, args.n_samples, args.tolerance)
+            print "%s: %s" % (prefix, "OK" if ok else "MISMATCH")
+            all_ok = all_ok and ok
+    sys.exit(0 if all_ok else 1)
@@ -6,6 +6,8 @@ import time
 from collections import defaultdict
 import copy
 
+import dialog_db
+
 
 score_map = {0: 0,
              1: -1,
@@ -16,45 +18,38 @@ def is_regular_alphabet(string):
     return all(ord(c) < 128 for c in string)
 
 
-def query_db():
+def query_db(db, since=None):
     """
     Collect messages from db.local (client side) and db.dialogs (server side)
     Builds a list of conversation with evaluation fields (from db.dialogs)
       and model & policy fields for each message in each conversation.
-    - Loop through conversations in the client side (db.local)
-    - Get the corresponding server's dialog and add to the list we want to return
+    - Stream conversations in the client side (db.local), stored after `since` if given
+    - Get the corresponding server's dialogs by batches and yield them
     - Use the client's dialog to get model & policy fields of each convo msg
-    :return: array of dictionaries. each dictionary is a conversation.
+    :param db: convai database
+    :param since: high-water mark of a previous extraction
+    :return: generator of dictionaries. each dictionary is a conversation,
+      with the `_id` of its local dialog in 'localId'.
     """
-    PORT = 8091
-    CLIENT = '132.206.3.23'
-
-    client = pymongo.MongoClient(CLIENT, PORT)
-    db = client.convai
-
-    chats = []
-
     # loop through each conversation on the client side because it only has valid
     #   conversations. db.dialogs also contains old and invalid convos.
-    for d_local in list(db.local.find({})):
+    for d_local, d_servr in dialog_db.iter_dialogs(db, since=since, local_fields=['logs']):
         d_id = d_local['dialogId']  # convo ID
-        # get the same conversation from the server side (db.dialogs)
-        d_servr = list(db.dialogs.find({'dialogId': d_id}))
         if len(d_servr) > 1:
             print "Error: two dialogs with same id (%s)!" % d_id
             continue
         elif len(d_servr) < 1:
             print "Warning: no dialog found in db.dialogs for dialogId %s." % d_id
             continue
-        d_servr = d_servr[0]
-        data = copy.deepcopy(d_servr)  # make hard copy of convo
+        data = d_servr[0]
+        data['localId'] = d_local['_id']
 
         # map from local msg text to local msg object
         local_msgs = dict(
             [(msg['text'], msg) for msg in d_local['logs'] if msg['text'] is not None]
         )
         # list of messages in the server's convo: the order we want to keep
-        servr_msgs = [msg for msg in d_servr['thread'] if msg['text'] is not None]
+        servr_msgs = [msg for msg in data['thread'] if msg['text'] is not None]
 
         # for each message in the server's dialog (the one we want to keep)
         for msg in servr_msgs:
@@ -70,9 +65,21 @@ def query_db():
             msg['policy'] = policy
 
         data['thread'] = servr_msgs
-        chats.append(data)
+        yield data
 
-    return chats
+
+class Counted(object):
+    """ iterate over `iterable`, counting the items and keeping the last one """
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.count = 0
+        self.last = None
+
+    def __iter__(self):
+        for item in self.iterable:
+            self.count += 1
+            self.last = item
+            yield item
 
 def valid_chat(usr_turns, bot_turns, k=2):
     # Check that user sent at least k messages and bot replied with 2 more messages
@@ -212,18 +219,28 @@ def reformat(json_data, voted_only=False):
 def main():
     parser = argparse.ArgumentParser(description='Create pickle data for training, testing ranker neural net')
     parser.add_argument('--voted_only', action='store_true', help='consider only voted messages')
+    parser.add_argument('--host', type=str, default=dialog_db.CLIENT, help='mongo host')
+    parser.add_argument('--port', type=int, default=dialog_db.PORT, help='mongo port')
+    parser.add_argument('--incremental', action='store_true', help='only extract the dialogues stored since the last incremental run')
+    parser.add_argument('--watermark', type=str, default='./data/db_watermark.json', help='file keeping the high-water mark of incremental runs')
+    parser.add_argument('--create_indexes', action='store_true', help='index dialogId on both collections before reading, needs write access')
     args = parser.parse_args()
     print args
 
-    print "\nGet conversations from database..."
-    json_data = query_db()
-    print "Got %d dialogues" % len(json_data)
-
-    # print '\n', json_data[0]
+    since = dialog_db.load_watermark(args.watermark) if args.incremental else None
+    if since is not None:
+        print "\nGet conversations stored after %s from database..." % since
+    else:
+        print "\nGet conversations from database..."
+    db = dialog_db.connect(args.host, args.port)
+    if args.create_indexes:
+        dialog_db.ensure_indexes(db)
+    json_data = Counted(query_db(db, since))
 
     # extract array of dictionaries of the form {'article':<str>, 'context':<list of str>, 'candidate':<str>, 'r':<-1,0,1>, 'R':<0-5>}
     print "\nReformat dialogues into list of training examples..."
     full_data = reformat(json_data, args.voted_only)
+    print "Got %d dialogues" % json_data.count
     print "Got %d examples" % len(full_data)
 
     # print '\n', json.dumps(full_data[:5], indent=4, sort_keys=True)
@@ -232,6 +249,8 @@ def main():
     file_prefix = "voted" if args.voted_only else "full"
     with open('./data/%s_data_db_%s.json' % (file_prefix, str(time.time())), 'wb') as handle:
         json.dump(full_data, handle)
+    if args.incremental and json_data.last is not None:
+        dialog_db.save_watermark(args.watermark, json_data.last['localId'])
     print "done."
 
 
@@ -1,10 +1,11 @@
 import json
 import cPickle as pkl
 import time
-import copy
 from collections import defaultdict
 import argparse
 
+from dialogue_store import DialogueStore, iter_json_array
+
 
 score_map = {0: 0,
              1: -1,
@@ -31,6 +32,93 @@ def valid_chat(turns, k=2):
     return True
 
 
+def reformat_dialog(dialog, voted_only=False):
+    """
+    Training instances of one conversation.
+    Contexts are not copied: a context is always the first turns of the final list of
+    turns of the conversation, so an instance only keeps the number of turns of its context.
+    :param dialog: conversation dictionary
+    :param voted_only: consider only the messages which have been up- or down- voted
+    :return: None if the conversation is skipped, else (article, turns, instances) where
+      instances is a list of (context length, candidate, r, R, policy, model)
+    """
+    # get the bot id for this chat if there is one
+    bid = None
+    for usr in dialog['users']:
+        if usr['userType'] == 'Bot':
+           bid = usr['id']
+
+    both_human = (bid is None)
+
+    if not valid_chat(dialog['thread'], k=2):
+        return None
+
+    # get article text for that conversation
+    article = dialog['context'].strip().lower()
+    # get evaluations for that conversation from all humans involved
+    full_evals = defaultdict(float)
+    for evl in dialog['evaluation']:
+        full_evals[evl['userId']] = (2.0*evl['quality'] + 1.0*evl['breadth'] + 1.0*evl['engagement']) / 4.0
+    if len(full_evals) == 0:
+        print "Warning: no full evaluation found for this conversation, skipping it"
+        return None
+
+    # Go through conversation to create a list of (context length, candidate, score, reward, policy, model) instances
+    instances = []
+    context = []
+    last_sender_id = None
+    added_instances_from_this_chat = False  # True as soon as we add an instance
+    for msg in dialog['thread']:
+        text = msg['text'].strip().lower()
+        # skip empty messages or messages written in non-unicode characters
+        if len(text.split()) == 0 or not is_regular_alphabet(text):
+            continue
+
+        # if begining of the converesation, just fill in the context
+        if len(context) == 0:
+            context.append(text)
+            last_sender_id = msg['userId']
+
+        # if both human or the bot talked: create an instance for each message and add each message to context
+        elif both_human or msg['userId'] == bid:
+            model = 'human_from_round1' if both_human else 'bot_from_round1'
+            # same speaker spoke twice in a row:
+            if last_sender_id == msg['userId']:
+                prev_candidate = context.pop()  # remove last turn from context
+                if added_instances_from_this_chat:  # replace last instance by most recent
+                    r_prev = instances[-1][2]
+                    r_new = min(max(r_prev + score_map[int(msg['evaluation'])], -1), 1)  # sum evaluations of the two msg [-1,+1]
+                    # include last turn in this turn
+                    instances[-1] = (len(context), prev_candidate+' '+text, r_new, full_evals[msg['userId']], -1, model)
+                # add response to context now
+                context.append(prev_candidate+' '+text)
+            # replied to the other speaker:
+            else:
+                if (not voted_only) or (voted_only and score_map[int(msg['evaluation'])] != 0):
+                    # create new instance
+                    instances.append((len(context), text, score_map[int(msg['evaluation'])], full_evals[msg['userId']], -1, model))
+                    added_instances_from_this_chat = True
+                # add response to context now
+                context.append(text)
+                last_sender_id = msg['userId']
+
+        # if the (lonly) human talked
+        else:
+            # same human spoke twice in a row:
+            if last_sender_id == msg['userId']:
+                context[-1] = context[-1]+' '+text
+            else:
+                context.append(text)
+                last_sender_id = msg['userId']
+
+    if voted_only:  # filter out messages here again
+        # sometimes msg[r] is still 0 because msg[candidate] is composed of two msgs:
+        #  one with +1, the other with -1, summing to 0
+        instances = [instance for instance in instances if instance[2] != 0]
+
+    return article, context, instances
+
+
 def reformat(json_data, voted_only=False):
     """
     Create a list of dictionaries of the form {'article':<str>, 'context':<list of str>, 'candidate':<str>, 'r':<-1,0,1>, 'R':<0-5>}
@@ -40,172 +128,51 @@ def reformat(json_data, voted_only=False):
     :return: list of training instances. each instance is a dictionary
     """
     formated_data = []
-
     for dialog in json_data:
-        # get the bot id for this chat if there is one
-        bid = None
-        for usr in dialog['users']:
-            if usr['userType'] == 'Bot':
-               bid = usr['id']
-        
-        both_human = (bid is None)
-
-        if valid_chat(dialog['thread'], k=2):
-            # print json.dumps(dialog, indent=4, sort_keys=True)
-            # get article text for that conversation
-            article = dialog['context'].strip().lower()
-            # get evaluations for that conversation from all humans involved
-            full_evals = defaultdict(float)
-            for evl in dialog['evaluation']:
-                full_evals[evl['userId']] = (2.0*evl['quality'] + 1.0*evl['breadth'] + 1.0*evl['engagement']) / 4.0
-            if len(full_evals) == 0:
-                print "Warning: no full evaluation found for this conversation, skipping it"
-                continue
-
-            # Go through conversation to create a list of (article, context, candidate, score, reward, policy, model) instances
-            context = []
-            last_sender_id = None
-            added_instances_from_this_chat = False  # True as soon as we add an instance
-            for msg in dialog['thread']:
-                # skip empty messages or messages written in non-unicode characters
-                if len(msg['text'].strip().split()) == 0 or not is_regular_alphabet(msg['text'].strip().lower()):
-                    continue
-
-                # if begining of the converesation, just fill in the context
-                if len(context) == 0:
-                    context.append(msg['text'].strip().lower())
-                    last_sender_id = msg['userId']
-
-                # if both human: create an instance for all messages and add each message to context
-                elif both_human:
-                    # same human spoke twice in a row:
-                    if last_sender_id == msg['userId']:
-                        c = copy.deepcopy(context)
-                        m = copy.deepcopy(msg)
-                        prev_candidate = c[-1]  # save previous turn
-                        context = c[:-1]        # remove last turn from context
-                        if added_instances_from_this_chat:  # replace last instance by most recent
-                            r_prev = formated_data[-1]['r']
-                            r_new = min(max(r_prev + score_map[int(m['evaluation'])], -1), 1)  # sum evaluations of the two msg [-1,+1]
-                            formated_data[-1] = {
-                                'article': article,
-                                'context': copy.deepcopy(context),
-                                'candidate': prev_candidate+' '+m['text'].strip().lower(),  # include last turn in this turn
-                                'r': r_new,
-                                'R': full_evals[m['userId']],
-                                'policy': -1,
-                                'model': 'human_from_round1'
-                            }
-                        # add human response to context now
-                        context.append(prev_candidate+' '+m['text'].strip().lower())
-                    # other human replied to this human:
-                    else:
-                        c = copy.deepcopy(context)
-                        m = copy.deepcopy(msg)
-                        if (not voted_only) or (voted_only and score_map[int(m['evaluation'])] != 0):
-                            # create new instance
-                            formated_data.append({
-                                'article': article,
-                                'context': c,
-                                'candidate': m['text'].strip().lower(),
-                                'r': score_map[int(m['evaluation'])],
-                                'R': full_evals[m['userId']],
-                                'policy': -1,
-                                'model': 'human_from_round1'
-                            })
-                            added_instances_from_this_chat = True
-                        # add human response to context now
-                        context.append(m['text'].strip().lower())
-                        last_sender_id = m['userId']
-
-                # if the bot talked
-                elif msg['userId'] == bid:
-                    # the bot spoke twice in a row:
-                    if last_sender_id == msg['userId']:
-                        c = copy.deepcopy(context)
-                        m = copy.deepcopy(msg)
-                        prev_candidate = c[-1]  # save previous turn
-                        context = c[:-1]        # remove last turn from context
-                        if added_instances_from_this_chat:  # replace last instance by most recent
-                            r_prev = formated_data[-1]['r']
-                            r_new = min(max(r_prev + score_map[int(m['evaluation'])], -1), 1)  # sum evaluations of the two msg [-1,+1]
-                            formated_data[-1] = {
-                                'article': article,
-                                'context': copy.deepcopy(context),
-                                'candidate': prev_candidate+' '+m['text'].strip().lower(),  # include last turn in this turn
-                                'r': r_new,
-                                'R': full_evals[m['userId']],
-                                'policy': -1,
-                                'model': 'bot_from_round1'
-                            }
-                        # add bot response to context now
-                        context.append(prev_candidate+' '+m['text'].strip().lower())
-                    # bot replied to human:
-                    else:
-                        c = copy.deepcopy(context)
-                        m = copy.deepcopy(msg)
-                        if (not voted_only) or (voted_only and score_map[int(m['evaluation'])] != 0):
-                            # create new instance
-                            formated_data.append({
-                                'article': article,
-                                'context': c,
-                                'candidate': m['text'].strip().lower(),
-                                'r': score_map[int(m['evaluation'])],
-                                'R': full_evals[m['userId']],
-                                'policy': -1,
-                                'model': 'bot_from_round1'
-                            })
-                            added_instances_from_this_chat = True
-                        # add bot response to context now
-                        context.append(m['text'].strip().lower())
-                        last_sender_id = m['userId']
-
-                # if the (lonly) human talked
-                else:
-                    c = copy.deepcopy(context)
-                    # same human spoke twice in a row:
-                    if last_sender_id == msg['userId']:
-                        context[-1] = c[-1]+' '+msg['text'].strip().lower()
-                    else:
-                        context.append(msg['text'].strip().lower())
-                        last_sender_id = msg['userId']
-
-                # print json.dumps(formated_data, indent=4, sort_keys=True)
-
-    if voted_only:  # filter out messages here again
-        # sometimes msg[r] is still 0 because msg[candidate] is composed of two msgs:
-        #  one with +1, the other with -1, summing to 0
-        formated_data = filter(lambda msg: msg['r'] != 0, formated_data)
-
+        reformated = reformat_dialog(dialog, voted_only)
+        if reformated is None:
+            continue
+        article, turns, instances = reformated
+        for context_length, candidate, r, R, policy, model in instances:
+            formated_data.append({
+                'article': article,
+                'context': turns[:context_length],
+                'candidate': candidate,
+                'r': r,
+                'R': R,
+                'policy': policy,
+                'model': model
+            })
     return formated_data
 
 
 def main():
     parser = argparse.ArgumentParser(description='Process some integers.')
     parser.add_argument('--voted_only', action='store_true', help='only consider messages which has been voted')
+    parser.add_argument('--json_file', type=str, default="/home/ml/nangel3/research/data/convai/round1.json", help='round 1 dump')
+    parser.add_argument('--json', action='store_true', help='also write the instances to the json file read by train.py')
     args = parser.parse_args()
     print args
 
-    json_file = "/home/ml/nangel3/research/data/convai/round1.json"
-    print "\nGet json data from %s..." % json_file
-    with open(json_file, 'r') as handle:
-        json_data = json.load(handle)
-    print "Got %d dialogues" % len(json_data)
-
-    # extract array of dictionaries of the form {'article':<str>, 'context':<list of str>, 'candidate':<str>, 'r':<-1,0,1>, 'R':<0-5>}
-    print "\nReformat dialogues into list of training examples..."
-    full_data = reformat(json_data, args.voted_only)
-    print "Got %d examples" % len(full_data)
-
-    # print json.dumps(full_data[4:20], indent=4, sort_keys=True)
-
-    print "\nSaving to json file..."
+    # conversations are read and converted one at a time
+    print "\nReformat dialogues from %s into training examples..." % args.json_file
     file_prefix = "voted" if args.voted_only else "full"
-    with open('./data/%s_data_round1_%s.json' % (file_prefix, str(time.time())), 'wb') as handle:
-        json.dump(full_data, handle)
+    store_path = './data/%s_data_round1_%s.store' % (file_prefix, str(time.time()))
+    n_dialogues = 0
+    with DialogueStore(store_path, 'w') as store:
+        for dialog in iter_json_array(args.json_file):
+            n_dialogues += 1
+            reformated = reformat_dialog(dialog, args.voted_only)
+            if reformated is not None:
+                store.add_dialogue(*reformated)
+    print "Got %d dialogues" % n_dialogues
+    print "Got %d examples from %d valid dialogues, saved in %s" % (store.n_instances, store.n_dialogues, store_path)
+
+    if args.json:
+        print "\nSaving to json file..."
+        DialogueStore(store_path).to_json(store_path.replace('.store', '.json'))
     print "done."
 
-
 if __name__ == '__main__':
     main()
 
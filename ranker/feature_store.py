@@ -0,0 +1,149 @@
+import numpy as np
+import argparse
+import json
+import os
+
+# Columnar feature store.
+# The features of a data file `<data>.json` are saved in `<data>.features/`:
+#  - one `<Feature>.f32` file per feature: float32 block of shape (rows, dim),
+#    row `i` being the feature of the `i`-th message of the data file
+#  - `index.json`: row index of the store: {<Feature>: {"dim": dim, "rows": rows, ...}}
+#    with optional metadata (ie: hashes used by build_feature_data.py)
+# Blocks are memory-mapped, so any subset of features and rows is loaded by
+# slicing them, and new rows can be appended at the end of a block.
+#
+# To convert the old `<data>.features/<Feature>.json` files:
+#   python feature_store.py ./data/voted_data_db_1510012489.57.json ...
+
+INDEX_FILE = 'index.json'
+DTYPE = np.float32
+
+
+def store_path(data_file):
+    """ path of the feature store of `data_file` """
+    return data_file.replace('.json', '.features')
+
+
+class FeatureStore(object):
+    def __init__(self, path):
+        """
+        :param path: directory of the store, created if it does not exist
+        """
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.index = {}
+        if os.path.exists(self._index_path()):
+            with open(self._index_path(), 'rb') as handle:
+                self.index = json.load(handle)
+
+    def _index_path(self):
+        return os.path.join(self.path, INDEX_FILE)
+
+    def _block_path(self, feature):
+        return os.path.join(self.path, '%s.f32' % feature)
+
+    def _save_index(self):
+        # write to a temporary file first so that the index is never left half written
+        tmp_path = self._index_path() + '.tmp'
+        with open(tmp_path, 'wb') as handle:
+            json.dump(self.index, handle, indent=2, sort_keys=True)
+        os.rename(tmp_path, self._index_path())
+
+    def features(self):
+        """ list of features saved in this store """
+        return sorted(self.index.keys())
+
+    def dim(self, feature):
+        return self.index[feature]['dim']
+
+    def rows(self, feature):
+        """ number of rows saved for `feature`, 0 if it is not in the store """
+        return self.index.get(feature, {}).get('rows', 0)
+
+    def meta(self, feature, key):
+        """ metadata saved with the last rows of `feature`, None if not set """
+        return self.index.get(feature, {}).get(key)
+
+    def append(self, feature, block, **meta):
+        """
+        Add rows at the end of the `feature` block
+        :param block: array of shape (n, dim)
+        :param meta: metadata to save in the index with these rows
+        """
+        block = np.asarray(block, dtype=DTYPE)
+        assert block.ndim == 2, "expected a block of shape (n, dim), got %s" % (block.shape,)
+        if feature in self.index:
+            assert block.shape[1] == self.dim(feature), \
+                "%s: dim %d != %d" % (feature, block.shape[1], self.dim(feature))
+        else:
+            self.index[feature] = {'dim': block.shape[1], 'rows': 0}
+            # start a new block
+            open(self._block_path(feature), 'wb').close()
+        with open(self._block_path(feature), 'r+b') as handle:
+            # drop rows that were written but not indexed (ie: interrupted append)
+            handle.truncate(self.rows(feature) * self.dim(feature) * DTYPE().itemsize)
+            handle.seek(0, os.SEEK_END)
+            handle.write(block.tobytes())
+        self.index[feature]['rows'] += block.shape[0]
+        self.index[feature].update(meta)
+        self._save_index()
+
+    def write(self, feature, block):
+        """ Replace all rows of `feature` by `block` """
+        self.remove(feature)
+        self.append(feature, block)
+
+    def remove(self, feature):
+        if feature in self.index:
+            del self.index[feature]
+            self._save_index()
+        if os.path.exists(self._block_path(feature)):
+            os.remove(self._block_path(feature))
+
+    def get(self, feature):
+        """ read-only memory-mapped array of shape (rows, dim) """
+        shape = (self.rows(feature), self.dim(feature))
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=DTYPE)
+        return np.memmap(self._block_path(feature), dtype=DTYPE, mode='r', shape=shape)
+
+    def load(self, feature_list, indices=None):
+        """
+        Build an input matrix from the blocks of a list of features
+        :param feature_list: list of feature names (str), in the order of the input
+        :param indices: list of rows to take, default all
+        :return: float32 array of shape (len(indices), sum of feature dims)
+        """
+        if indices is None:
+            indices = np.arange(min(self.rows(feat) for feat in feature_list))
+        indices = np.asarray(indices, dtype=np.int64)
+        x = np.empty((len(indices), sum(self.dim(feat) for feat in feature_list)), dtype=DTYPE)
+        col = 0
+        for feat in feature_list:
+            dim = self.dim(feat)
+            x[:, col: col + dim] = self.get(feat)[indices]
+            col += dim
+        return x
+
+
+def convert_json(data_file):
+    """ Move the old `<data>.features/<Feature>.json` files of `data_file` to its store """
+    store = FeatureStore(store_path(data_file))
+    for file_name in sorted(os.listdir(store.path)):
+        if not file_name.endswith('.json') or file_name == INDEX_FILE:
+            continue
+        feat = file_name[:-len('.json')]
+        with open(os.path.join(store.path, file_name), 'rb') as handle:
+            block = np.array(json.load(handle), dtype=DTYPE)
+        store.write(feat, block.reshape(len(block), -1))
+        print "converted %s: %s" % (feat, block.shape)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data", nargs='+', type=str, help="List of data files whose json features to convert")
+    args = parser.parse_args()
+    for data_file in args.data:
+        print "\nConverting features of %s..." % data_file
+        convert_json(data_file)
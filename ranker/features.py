@@ -4,7 +4,7 @@ import numpy as np
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
 from embedding_metrics import w2v
-from embedding_metrics import greedy_score, extrema_score, average_score
+from embedding_metrics import similarity_scores, batch_similarity_scores
 
 import time
 import os
@@ -78,6 +78,40 @@ def get(feature_objects, dim, article, context, candidate):
     return raw_features
 
 
+def get_batch(feature_objects, dim, triples):
+    """
+    `get()` of many (article, context, candidate) triples.
+    The features which compare two texts (they have a `texts()` method) are computed
+    for all triples with one call to `batch_similarity_scores()`: the candidates
+    compared to the same context or article are matched to it together.
+    :param feature_objects: list of `Feature` instances to measure for each triple.
+    :param dim: total dimension of all features
+    :param triples: list of (article, context, candidate)
+    :return: an array of shape (len(triples), dim)
+    """
+    raw_features = np.zeros((len(triples), dim))
+    idx = 0
+    for f in feature_objects:
+        if hasattr(f, 'texts'):
+            pairs = [f.texts(article, context, candidate) for article, context, candidate in triples]
+            rows = [i for i, pair in enumerate(pairs) if pair is not None]
+            if len(rows) < len(triples):
+                logger.warning("unable to compute feature %s for %d triples" % (
+                    f.__class__.__name__, len(triples) - len(rows)))
+            raw_features[rows, idx: idx+f.dim] = batch_similarity_scores([pairs[i] for i in rows])
+        else:
+            for i, (article, context, candidate) in enumerate(triples):
+                f.set(article, context, candidate)  # compute feature
+                if f.feat is None or len(f.feat) != f.dim:
+                    logger.warning("unable to compute feature %s" % f.__class__.__name__)
+                    logger.warning("dim: %d --- feat: %s" % (f.dim, f.feat))
+                else:
+                    raw_features[i, idx: idx+f.dim] = f.feat  # set raw features
+        idx += f.dim
+
+    return raw_features
+
+
 #####################
 ### GENERIC CLASS ###
 #####################
@@ -242,18 +276,19 @@ class Similarity_CandidateUser(Feature):
         - average embedding score (dim: 1) between candidate response & last user turn
         - extrema embedding score (dim: 1) between candidate response & last user turn
         """
-        if candidate is None or context is None:
+        texts = self.texts(article, context, candidate)
+        if texts is None:
             self.feat = None
         else:
-            candidate = candidate.lower()
-            last_turn = context[-1].lower()
+            self.feat = np.array(similarity_scores(*texts), dtype=np.float64)
 
-            res1 = greedy_score(candidate, last_turn)
-            res2 = greedy_score(last_turn, candidate)
-            self.feat = np.zeros(3)
-            self.feat[0] = (res1 + res2) / 2.0
-            self.feat[1] = float(average_score(candidate, last_turn))
-            self.feat[2] = float(extrema_score(candidate, last_turn))
+    def texts(self, article, context, candidate):
+        """ the two texts to compare, None if the feature can not be computed """
+        if candidate is None or context is None:
+            return None
+        candidate = candidate.lower()
+        last_turn = context[-1].lower()
+        return candidate, last_turn
 
 
 ### Candidate -- last k turns match ###
@@ -273,19 +308,20 @@ class Similarity_CandidateLastK(Feature):
         - average embedding score (dim: 1) between candidate response & last k turns
         - extrema embedding score (dim: 1) between candidate response & last k turns
         """
-        if candidate is None or context is None:
+        texts = self.texts(article, context, candidate)
+        if texts is None:
             self.feat = None
         else:
-            candidate = candidate.lower()
-            last_turns = ' '.join(context[-self.k:]).lower()
-            logger.debug("last %d turns: %s" % (self.k, last_turns))
+            self.feat = np.array(similarity_scores(*texts), dtype=np.float64)
 
-            res1 = greedy_score(candidate, last_turns)
-            res2 = greedy_score(last_turns, candidate)
-            self.feat = np.zeros(3)
-            self.feat[0] = (res1 + res2) / 2.0
-            self.feat[1] = float(average_score(candidate, last_turns))
-            self.feat[2] = float(extrema_score(candidate, last_turns))
+    def texts(self, article, context, candidate):
+        """ the two texts to compare, None if the feature can not be computed """
+        if candidate is None or context is None:
+            return None
+        candidate = candidate.lower()
+        last_turns = ' '.join(context[-self.k:]).lower()
+        logger.debug("last %d turns: %s" % (self.k, last_turns))
+        return candidate, last_turns
 
 
 ### Candidate -- last k turns without stop words match ###
@@ -305,20 +341,21 @@ class Similarity_CandidateLastK_noStop(Feature):
         - average embedding score (dim: 1) between candidate response & last k turns without stop words
         - extrema embedding score (dim: 1) between candidate response & last k turns without stop words
         """
-        if candidate is None or context is None:
+        texts = self.texts(article, context, candidate)
+        if texts is None:
             self.feat = None
         else:
-            candidate = candidate.lower()
-            last_turns = ' '.join(context[-self.k:]).lower()
-            last_turns = ' '.join(filter(lambda word: word not in stop, word_tokenize(last_turns)))
-            logger.debug("last %d turns: %s" % (self.k, last_turns))
+            self.feat = np.array(similarity_scores(*texts), dtype=np.float64)
 
-            res1 = greedy_score(candidate, last_turns)
-            res2 = greedy_score(last_turns, candidate)
-            self.feat = np.zeros(3)
-            self.feat[0] = (res1 + res2) / 2.0
-            self.feat[1] = float(average_score(candidate, last_turns))
-            self.feat[2] = float(extrema_score(candidate, last_turns))
+    def texts(self, article, context, candidate):
+        """ the two texts to compare, None if the feature can not be computed """
+        if candidate is None or context is None:
+            return None
+        candidate = candidate.lower()
+        last_turns = ' '.join(context[-self.k:]).lower()
+        last_turns = ' '.join(filter(lambda word: word not in stop, word_tokenize(last_turns)))
+        logger.debug("last %d turns: %s" % (self.k, last_turns))
+        return candidate, last_turns
 
 
 ### Candidate -- last k user turns match ###
@@ -338,21 +375,22 @@ class Similarity_CandidateKUser(Feature):
         - average embedding score (dim: 1) between candidate response & last k user turns
         - extrema embedding score (dim: 1) between candidate response & last k user turns
         """
-        if candidate is None or context is None:
+        texts = self.texts(article, context, candidate)
+        if texts is None:
             self.feat = None
         else:
-            candidate = candidate.lower()
-            start = min(len(context), 2*self.k+1)
-            user_turns = np.array(context)[range(-start, 0, 2)]
-            user_turns = ' '.join(user_turns).lower()
-            logger.debug("last %d user turns: %s" % (self.k, user_turns))
+            self.feat = np.array(similarity_scores(*texts), dtype=np.float64)
 
-            res1 = greedy_score(candidate, user_turns)
-            res2 = greedy_score(user_turns, candidate)
-            self.feat = np.zeros(3)
-            self.feat[0] = (res1 + res2) / 2.0
-            self.feat[1] = float(average_score(candidate, user_turns))
-            self.feat[2] = float(extrema_score(candidate, user_turns))
+    def texts(self, article, context, candidate):
+        """ the two texts to compare, None if the feature can not be computed """
+        if candidate is None or context is None:
+            return None
+        candidate = candidate.lower()
+        start = min(len(context), 2*self.k+1)
+        user_turns = np.array(context)[range(-start, 0, 2)]
+        user_turns = ' '.join(user_turns).lower()
+        logger.debug("last %d user turns: %s" % (self.k, user_turns))
+        return candidate, user_turns
 
 
 ### Candidate -- last k user turns without stop words match ###
@@ -372,22 +410,23 @@ class Similarity_CandidateKUser_noStop(Feature):
         - average embedding score (dim: 1) between candidate response & last k user turns without stop words
         - extrema embedding score (dim: 1) between candidate response & last k user turns without stop words
         """
-        if candidate is None or context is None:
+        texts = self.texts(article, context, candidate)
+        if texts is None:
             self.feat = None
         else:
-            candidate = candidate.lower()
-            start = min(len(context), 2*self.k+1)
-            user_turns = np.array(context)[range(-start, 0, 2)]
-            user_turns = ' '.join(user_turns).lower()
-            user_turns = ' '.join(filter(lambda word: word not in stop, word_tokenize(user_turns)))
-            logger.debug("last %d user turns: %s" % (self.k, user_turns))
+            self.feat = np.array(similarity_scores(*texts), dtype=np.float64)
 
-            res1 = greedy_score(candidate, user_turns)
-            res2 = greedy_score(user_turns, candidate)
-            self.feat = np.zeros(3)
-            self.feat[0] = (res1 + res2) / 2.0
-            self.feat[1] = float(average_score(candidate, user_turns))
-            self.feat[2] = float(extrema_score(candidate, user_turns))
+    def texts(self, article, context, candidate):
+        """ the two texts to compare, None if the feature can not be computed """
+        if candidate is None or context is None:
+            return None
+        candidate = candidate.lower()
+        start = min(len(context), 2*self.k+1)
+        user_turns = np.array(context)[range(-start, 0, 2)]
+        user_turns = ' '.join(user_turns).lower()
+        user_turns = ' '.join(filter(lambda word: word not in stop, word_tokenize(user_turns)))
+        logger.debug("last %d user turns: %s" % (self.k, user_turns))
+        return candidate, user_turns
 
 
 ### Candidate -- article match ###
@@ -406,18 +445,19 @@ class Similarity_CandidateArticle(Feature):
         - average embedding score (dim: 1) between candidate response & article
         - extrema embedding score (dim: 1) between candidate response & article
         """
-        if candidate is None or article is None:
+        texts = self.texts(article, context, candidate)
+        if texts is None:
             self.feat = None
         else:
-            candidate = candidate.lower()
-            article = article.lower()
+            self.feat = np.array(similarity_scores(*texts), dtype=np.float64)
 
-            res1 = greedy_score(candidate, article)
-            res2 = greedy_score(article, candidate)
-            self.feat = np.zeros(3)
-            self.feat[0] = (res1 + res2) / 2.0
-            self.feat[1] = float(average_score(candidate, article))
-            self.feat[2] = float(extrema_score(candidate, article))
+    def texts(self, article, context, candidate):
+        """ the two texts to compare, None if the feature can not be computed """
+        if candidate is None or article is None:
+            return None
+        candidate = candidate.lower()
+        article = article.lower()
+        return candidate, article
 
 
 ### Candidate -- article without stop words match ###
@@ -436,19 +476,20 @@ class Similarity_CandidateArticle_noStop(Feature):
         - average embedding score (dim: 1) between candidate response & article without stop words
         - extrema embedding score (dim: 1) between candidate response & article without stop words
         """
-        if candidate is None or article is None:
+        texts = self.texts(article, context, candidate)
+        if texts is None:
             self.feat = None
         else:
-            candidate = candidate.lower()
-            article = article.lower()
-            article = ' '.join(filter(lambda word: word not in stop, word_tokenize(article)))
+            self.feat = np.array(similarity_scores(*texts), dtype=np.float64)
 
-            res1 = greedy_score(candidate, article)
-            res2 = greedy_score(article, candidate)
-            self.feat = np.zeros(3)
-            self.feat[0] = (res1 + res2) / 2.0
-            self.feat[1] = float(average_score(candidate, article))
-            self.feat[2] = float(extrema_score(candidate, article))
+    def texts(self, article, context, candidate):
+        """ the two texts to compare, None if the feature can not be computed """
+        if candidate is None or article is None:
+            return None
+        candidate = candidate.lower()
+        article = article.lower()
+        article = ' '.join(filter(lambda word: word not in stop, word_tokenize(article)))
+        return candidate, article
 
 
 ### n-gram & entity overlaps ###
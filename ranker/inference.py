@@ -0,0 +1,205 @@
+import numpy as np
+import cPickle as pkl
+
+# Inference-only rankers.
+# `Estimator.export()` (or `python export.py <prefix>`) writes a
+# `<prefix>_inference.pkl` bundle with the architecture, the feature list and
+# the trained weights of an estimator, but none of its training data.
+# The estimators below rebuild the forward pass from that bundle, so serving
+# processes never load the `*_args.pkl` files and their training matrices:
+#  - NumpyEstimator: plain numpy, serving does not need tensorflow at all
+#  - TensorflowEstimator: same graph ops as the trained `Estimator`
+# `python export.py <prefix> --check` compares both of them to the trained model.
+
+# same values as in estimators.py, repeated here to serve without importing tensorflow
+SHORT_TERM_MODE = 0
+LONG_TERM_MODE = 1
+
+
+def _sigmoid(x):
+    # tanh formulation does not overflow for large negative x
+    return 0.5 * (np.tanh(0.5 * x) + 1.)
+
+
+NUMPY_ACTIVATIONS = {
+    'swish': lambda x: x * _sigmoid(x),
+    'relu': lambda x: np.maximum(x, 0.),
+    'sigmoid': _sigmoid
+}
+
+
+def load_bundle(path):
+    """
+    :param path: `<prefix>_inference.pkl` file written by `Estimator.export()`
+    :return: dictionary with keys:
+      - feature_list, input_dim, hidden_dims, hidden_dims_extra, activation
+      - model_id, model_name
+      - input_mean, input_std: None if the features are fed as they are
+      - layers: list of (kernel, bias) of the shared layers
+      - extra_layers: list of (kernel, bias) of the long term layers
+      - short_term: (kernel, bias) of the 2 units output layer
+      - long_term: (kernel, bias) of the 1 unit output layer
+    """
+    with open(path, 'rb') as handle:
+        return pkl.load(handle)
+
+
+def _by_mode(bundles):
+    """
+    :param bundles: bundle used for both modes, or dictionary from mode to bundle
+    :return: dictionary from mode to bundle
+    """
+    if 'feature_list' in bundles:
+        bundles = {SHORT_TERM_MODE: bundles, LONG_TERM_MODE: bundles}
+    feature_lists = [bundle['feature_list'] for bundle in bundles.values()]
+    # all estimators must take the same features as input
+    assert all(f == feature_lists[0] for f in feature_lists)
+    return bundles
+
+
+class NumpyEstimator(object):
+    def __init__(self, bundles):
+        """
+        Forward pass of exported estimators with numpy only
+        :param bundles: dictionary returned by `load_bundle()` used for both modes,
+          or dictionary from mode (SHORT_TERM or LONG_TERM) to such a bundle.
+          All bundles must take the same features as input.
+        """
+        self.bundles = _by_mode(bundles)
+        self.feature_list = self.bundles.values()[0]['feature_list']
+        self.input_dim = self.bundles.values()[0]['input_dim']
+
+    @staticmethod
+    def _dense(h, layer, act=None):
+        kernel, bias = layer
+        h = np.dot(h, kernel) + bias
+        return act(h) if act else h
+
+    def _hidden(self, bundle, x, layers):
+        activation = NUMPY_ACTIVATIONS[bundle['activation']]
+        h_fc = x
+        for layer in layers:
+            h_fc = self._dense(h_fc, layer, activation)  # (bs, hidd)
+        return h_fc
+
+    def predict(self, mode, x):
+        """
+        Same as `Estimator.predict()`, all modes are evaluated in the same call
+        :param mode: SHORT_TERM or LONG_TERM, or a list of modes
+        :param x: batch of candidates, shape (bs, input_dim), preferably float32
+        :return: predictions and confidences, each of shape (bs,),
+          or a list of (predictions, confidences) tuples if `mode` is a list
+        """
+        many = isinstance(mode, (list, tuple))
+        x = np.asarray(x, dtype=np.float32)
+        shared = {}  # id of bundle -> output of its shared layers, reused across modes
+        outputs = []
+        for m in (mode if many else [mode]):
+            bundle = self.bundles[m]
+            if id(bundle) not in shared:
+                h_in = x
+                if bundle.get('input_mean') is not None:
+                    h_in = (x - bundle['input_mean']) / bundle['input_std']
+                shared[id(bundle)] = self._hidden(bundle, h_in, bundle['layers'])
+            h_fc = shared[id(bundle)]
+            if m == LONG_TERM_MODE:
+                # LONG TERM: predictions and confidences are the same
+                h_fc = self._hidden(bundle, h_fc, bundle['extra_layers'])
+                logits = self._dense(h_fc, bundle['long_term'])[:, 0]  # (bs,)
+                outputs.append((logits, logits))
+            else:
+                # SHORT TERM: predicted class and probability of up-vote
+                logits = self._dense(h_fc, bundle['short_term'])  # (bs, 2)
+                preds = np.argmax(logits, axis=1).astype(np.float32)
+                confs = _sigmoid(logits[:, 1] - logits[:, 0])  # softmax(logits)[:, 1]
+                outputs.append((preds, confs))
+        return outputs if many else outputs[0]
+
+    def close(self):
+        pass
+
+
+class TensorflowEstimator(object):
+    def __init__(self, bundles):
+        """
+        Build the forward pass of exported estimators in one graph & session
+        :param bundles: dictionary returned by `load_bundle()` used for both modes,
+          or dictionary from mode (SHORT_TERM or LONG_TERM) to such a bundle.
+          All bundles must take the same features as input.
+        """
+        import tensorflow as tf
+        bundles = _by_mode(bundles)
+        self.feature_list = bundles.values()[0]['feature_list']
+        self.input_dim = bundles.values()[0]['input_dim']
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.build(bundles)
+        self.session = tf.Session(graph=self.graph)
+
+    @staticmethod
+    def _dense(h, layer, act=None):
+        import tensorflow as tf
+        kernel, bias = layer
+        h = tf.nn.bias_add(tf.matmul(h, tf.constant(kernel)), tf.constant(bias))
+        return act(h) if act else h
+
+    def _hidden(self, bundle, extra):
+        """ hidden representation of self.x in the network of `bundle` """
+        from estimators import ACTIVATIONS
+        activation = ACTIVATIONS[bundle['activation']]
+        h_fc = self.x
+        if bundle.get('input_mean') is not None:
+            h_fc = (h_fc - bundle['input_mean']) / bundle['input_std']
+        for layer in bundle['layers'] + (bundle['extra_layers'] if extra else []):
+            h_fc = self._dense(h_fc, layer, activation)  # (bs, hidd)
+        return h_fc
+
+    def build(self, bundles):
+        import tensorflow as tf
+        self.x = tf.placeholder(tf.float32, shape=[None, self.input_dim], name="input_layer")  # (bs, feat_size)
+        self.outputs = {}
+        if SHORT_TERM_MODE in bundles:
+            # SHORT TERM: predicted class and probability of up-vote
+            logits = self._dense(self._hidden(bundles[SHORT_TERM_MODE], False),
+                                 bundles[SHORT_TERM_MODE]['short_term'])  # (bs, 2)
+            self.outputs[SHORT_TERM_MODE] = (tf.cast(tf.argmax(logits, axis=1), tf.float32),
+                                             tf.nn.softmax(logits, dim=1)[:, 1])
+        if LONG_TERM_MODE in bundles:
+            # LONG TERM: predictions and confidences are the same
+            logits = self._dense(self._hidden(bundles[LONG_TERM_MODE], True),
+                                 bundles[LONG_TERM_MODE]['long_term'])[:, 0]  # (bs,)
+            self.outputs[LONG_TERM_MODE] = (logits, logits)
+
+    def predict(self, mode, x):
+        """
+        Same as `Estimator.predict()`, but all modes are evaluated in one pass
+        :param mode: SHORT_TERM or LONG_TERM, or a list of modes
+        :param x: batch of candidates, shape (bs, input_dim), preferably float32
+        :return: predictions and confidences, each of shape (bs,),
+          or a list of (predictions, confidences) tuples if `mode` is a list
+        """
+        many = isinstance(mode, (list, tuple))
+        outputs = self.session.run(
+            [self.outputs[m] for m in (mode if many else [mode])],
+            feed_dict={self.x: np.asarray(x, dtype=np.float32)}
+        )
+        return outputs if many else outputs[0]
+
+    def close(self):
+        self.session.close()
+
+
+BACKENDS = {
+    'numpy': NumpyEstimator,
+    'tensorflow': TensorflowEstimator
+}
+
+
+def build_estimator(bundles, backend='numpy'):
+    """
+    :param bundles: dictionary returned by `load_bundle()` used for both modes,
+      or dictionary from mode (SHORT_TERM or LONG_TERM) to such a bundle
+    :param backend: 'numpy' or 'tensorflow'
+    """
+    return BACKENDS[backend](bundles)
@@ -2,14 +2,22 @@ import tensorflow as tf
 import numpy as np
 import cPickle as pkl
 import argparse
+import multiprocessing
+import traceback
+import Queue
 import copy
+import glob
 import json
+import time
 import sys
 import os
+from collections import deque
 
-from estimators import Estimator, SHORT_TERM_MODE, LONG_TERM_MODE
+from estimators import Estimator, SHORT_TERM_MODE, LONG_TERM_MODE, export_inference_bundle
 
 import features as _features
+from feature_store import FeatureStore, store_path
+from batches import IndexedRows
 import inspect
 
 ALL_FEATURES = []
@@ -57,7 +65,22 @@ TARGET_TO_FEATURES = {
 }
 
 
-def get_data(files, target, feature_list=None, val_prop=0.1, test_prop=0.1):
+# number of examples copied at once from the feature stores
+LOAD_CHUNK_SIZE = 10000
+
+# data files already parsed, reused across the configurations of an exploration
+_MESSAGES = {}
+
+
+def load_messages(data_file):
+    """ list of messages of `data_file`, parsed only once """
+    if data_file not in _MESSAGES:
+        with open(data_file, 'rb') as handle:
+            _MESSAGES[data_file] = json.load(handle)
+    return _MESSAGES[data_file]
+
+
+def get_data(files, target, feature_list=None, val_prop=0.1, test_prop=0.1, stream_dir=None):
     """
     Load data to train ranker. Build `k` fold cross validation train/val data
     :param files: list of data files to load
@@ -68,6 +91,8 @@ def get_data(files, target, feature_list=None, val_prop=0.1, test_prop=0.1):
     :param val_prop: proportion of data to consider for validation set.
         Will also define the number of train/valid folds
     :param test_prop: proportion of data to consider for test set
+    :param stream_dir: if set, the input matrices are written to memory-mapped files in this
+        directory and the folds are views of their rows, so the data does not have to fit in memory
     :return: collections of train x & y, valid x & y, and one test x & y
         x = numpy array of size (data, feature_length)
           ie: np.array( [[f1, f2, ..., fn], ..., [f1, f2, ..., fn]] )
@@ -86,18 +111,12 @@ def get_data(files, target, feature_list=None, val_prop=0.1, test_prop=0.1):
     '''
     n = 0  # total number of examples
     for data_file in files:
-        if target == 'r' and 'data/voted_data_' in data_file:
-            with open(data_file, 'rb') as handle:
-                raw_data[data_file] = json.load(handle)
-                n += len(raw_data[data_file])
-                # get the time id of the data
-                # file_ids.append(data_file.split('_')[-1].replace('pkl', ''))
-        elif target == 'R' and 'data/full_data_' in data_file:
-            with open(data_file, 'rb') as handle:
-                raw_data[data_file] = json.load(handle)
-                n += len(raw_data[data_file])
-                # get the time id of the data
-                # file_ids.append(data_file.split('_')[-1].replace('pkl', ''))
+        if (target == 'r' and 'data/voted_data_' in data_file) or \
+                (target == 'R' and 'data/full_data_' in data_file):
+            raw_data[data_file] = load_messages(data_file)
+            n += len(raw_data[data_file])
+            # get the time id of the data
+            # file_ids.append(data_file.split('_')[-1].replace('pkl', ''))
         else:
             print "Warning: will not consider file %s because target=%s" % (data_file, target)
     print "got %d examples" % n
@@ -144,33 +163,37 @@ def get_data(files, target, feature_list=None, val_prop=0.1, test_prop=0.1):
                 remain_data[data_file].extend(indices)
                 remain_n += len(indices)
 
-    # create list of Feature instances
     if feature_list is None:
         feature_list = TARGET_TO_FEATURES[target]
-    feature_objects = _features.get(article=None, context=None, candidate=None, feature_list=feature_list)
-    input_size = np.sum([f.dim for f in feature_objects])
-    del feature_objects  # now that we have the input_size, don't need those anymore
+    # feature stores of each data file, see feature_store.py
+    stores = dict((data_file, FeatureStore(store_path(data_file))) for data_file in raw_data)
+    input_size = np.sum([stores.values()[0].dim(feat) for feat in feature_list])
 
     # construct data to save & return
-    remain_x = []  # np.zeros((remain_n, input_size))
+    if stream_dir:
+        if not os.path.exists(stream_dir):
+            os.makedirs(stream_dir)
+        remain_x = np.lib.format.open_memmap("%s/remain_x.npy" % stream_dir, mode='w+',
+                                             dtype=np.float32, shape=(remain_n, input_size))
+        test_x = np.lib.format.open_memmap("%s/test_x.npy" % stream_dir, mode='w+',
+                                           dtype=np.float32, shape=(test_n, input_size))
+    else:
+        remain_x = np.empty((remain_n, input_size), dtype=np.float32)
+        test_x = np.empty((test_n, input_size), dtype=np.float32)
     remain_y = []
-    test_x = []    # np.zeros((test_n, input_size))
     test_y = []
 
     print "building data..."
     for x, y, data in [(remain_x, remain_y, remain_data), (test_x, test_y, test_data)]:
+        row = 0
         for data_file, indices in data.iteritems():
-            # load the required features for that file
-            features = {}
-            feature_path = data_file.replace('.json', '.features')
-            for feat in feature_list:
-                with open("%s/%s.json" % (feature_path, feat), 'rb') as handle:
-                    features[feat] = json.load(handle)
+            # slice the required features of these messages from the store, by bounded chunks
+            for start in range(0, len(indices), LOAD_CHUNK_SIZE):
+                chunk = indices[start: start + LOAD_CHUNK_SIZE]
+                x[row: row + len(chunk)] = stores[data_file].load(feature_list, chunk)
+                row += len(chunk)
             for idx in indices:
                 msg = raw_data[data_file][idx]
-                # create input features for this msg:
-                tmp = np.concatenate( [features[feat][idx] for feat in feature_list] )
-                x.append(tmp.tolist())
                 # set y labels
                 if target == 'r':
                     if int(msg[target]) == -1: y.append(0)
@@ -179,11 +202,9 @@ def get_data(files, target, feature_list=None, val_prop=0.1, test_prop=0.1):
                 else:
                     y.append(msg[target])
 
-    remain_x = np.array(remain_x)
     assert remain_x.shape == (remain_n, input_size), "%s != %s" % (remain_x.shape, (remain_n, input_size))
     remain_y = np.array(remain_y)
     assert len(remain_y) == remain_n, "%d != %d" % (len(remain_y), remain_n)
-    test_x = np.array(test_x)
     assert test_x.shape == (test_n, input_size), "%s != %s" % (test_x.shape, (test_n, input_size))
     test_y = np.array(test_y)
     assert len(test_y) == test_n, "%d != %d" % (len(test_y), test_n)
@@ -196,16 +217,25 @@ def get_data(files, target, feature_list=None, val_prop=0.1, test_prop=0.1):
         start = valid_max_n * k_fold  # start index of validation set
         stop =  valid_max_n * (k_fold+1)  # stop index of validation set
         # define validation set for this fold
-        tmp_valid_x = remain_x[start: stop]
+        if stream_dir:
+            tmp_valid_x = IndexedRows(remain_x, np.arange(start, stop))
+        else:
+            tmp_valid_x = remain_x[start: stop]
         tmp_valid_y = remain_y[start: stop]
         valids.append((tmp_valid_x, tmp_valid_y))
         print "[fold %d] valid: %s" % (k_fold+1, tmp_valid_x.shape)
         # define training set for this fold
         # print "[fold %d] train indices: %s" % (k+fold+1, np.array(range(stop, n+start)) % n)
-        tmp_train_x = remain_x[np.array(range(stop, n+start)) % n]
+        if stream_dir:
+            # view of the rows on disk instead of a copy in memory
+            tmp_train_x = IndexedRows(remain_x, np.array(range(stop, n+start)) % n)
+        else:
+            tmp_train_x = remain_x[np.array(range(stop, n+start)) % n]
         tmp_train_y = remain_y[np.array(range(stop, n+start)) % n]
         trains.append((tmp_train_x, tmp_train_y))
         print "[fold %d] train: %s" % (k_fold+1, tmp_train_x.shape)
+    if stream_dir:
+        test_x = IndexedRows(test_x, np.arange(test_n))
     print "test: %s" % (test_x.shape,)
 
     return trains, valids, (test_x, test_y), feature_list
@@ -319,105 +349,252 @@ def load_previous_model(prefix):
            train_accuracies, valid_accuracies
 
 
+# Parallel exploration:
+# every (configuration, fold) pair is trained by a CPU worker process. The
+# features of all sampled configurations are loaded once before the workers
+# are forked, so they share the same read-only matrices and each configuration
+# only takes its columns. A fold stops early when its best valid accuracy is
+# below the median of the folds already finished at the same epoch.
+
+# shared, read-only data of the exploration, set before the workers are forked
+_explore_data = {}
+
+# minimum number of finished folds before stopping hopeless trials
+MIN_FINISHED_FOLDS = 5
+# do not stop a fold before this number of epochs
+MIN_EPOCHS = 5
+
+
+def feature_columns(feature_list, all_features, dims):
+    """ indices of the columns of `feature_list` in a matrix of all `all_features` """
+    offsets = dict(zip(all_features, np.cumsum([0] + [dims[f] for f in all_features])))
+    return np.concatenate([np.arange(offsets[f], offsets[f] + dims[f]) for f in feature_list])
+
+
+def trial_data(columns, feature_list, folds=None):
+    """ data of one configuration: train, valid, test sets with only its feature columns """
+    trains, valids, (x_test, y_test) = _explore_data['trains'], _explore_data['valids'], _explore_data['test']
+    if folds is None:
+        folds = range(len(trains))
+    return [(trains[k][0][:, columns], trains[k][1]) for k in folds], \
+           [(valids[k][0][:, columns], valids[k][1]) for k in folds], \
+           (x_test[:, columns], y_test), \
+           feature_list
+
+
+def stop_below(reference, percentile):
+    """
+    :param reference: list of best-so-far valid accuracy curves of finished folds
+    :return: function to give as `stop_trial` to `Estimator.train`
+    """
+    def _stop_trial(fold, epoch, valid_accs):
+        if len(reference) < MIN_FINISHED_FOLDS or epoch < MIN_EPOCHS:
+            return False
+        # finished folds keep their best accuracy after their last epoch
+        others = [curve[min(epoch, len(curve)) - 1] for curve in reference]
+        return max(valid_accs) < np.percentile(others, percentile)
+    return _stop_trial
+
+
+def train_fold(trial, fold, columns, params, mode, patience, model_path, model_id, save_model, reference, percentile):
+    """
+    Train one configuration on one fold, in a worker process
+    :param save_model: save the weights at the end of training (done for the last fold,
+        as the sequential exploration used to save the model after its last fold)
+    :return: (trial, fold, train_accs, valid_accs, stopped, error)
+    """
+    feature_list, hidd, activ, optim, lr, dr, bs = params
+    try:
+        graph = tf.Graph()
+        with graph.as_default():
+            estimator = Estimator(
+                trial_data(columns, feature_list, folds=[fold]),
+                hidd, [hidd[-1]], activ, optim, lr,
+                model_path=model_path, model_id=model_id
+            )
+            # CPU workers: one thread each, they run in parallel
+            config = tf.ConfigProto(device_count={'GPU': 0},
+                                    intra_op_parallelism_threads=1,
+                                    inter_op_parallelism_threads=1)
+            with tf.Session(graph=graph, config=config) as sess:
+                estimator.train(
+                    sess, MODE_TO_FLAG[mode], patience, bs, dr,
+                    save=False,  # don't save for now
+                    pretrained=None,
+                    verbose=False,
+                    stop_trial=stop_below(reference, percentile) if percentile > 0 else None
+                )
+                if save_model and not estimator.stopped:
+                    estimator.save(sess, save_args=False, save_timings=False)
+        return trial, fold, estimator.train_accuracies[0], estimator.valid_accuracies[0], estimator.stopped, None
+    except Exception:
+        return trial, fold, None, None, False, traceback.format_exc()
+
+
+def save_trial(model_path, model_id, data, params, train_accuracies, valid_accuracies):
+    """
+    Save the arguments and the timings of a trial next to its checkpoint,
+    in the same format as `Estimator.save()` (read by models/*/get_best_params.py)
+    """
+    feature_list, hidd, activ, optim, lr, dr, bs = params
+    prefix = "%s/%s_%s" % (model_path, model_id, 'Estimator')
+    with open("%s_args.pkl" % prefix, 'wb') as handle:
+        pkl.dump(
+            [data, hidd, [hidd[-1]], activ, optim, lr,
+             model_path, model_id, 'Estimator', bs, dr, None],
+            handle,
+            pkl.HIGHEST_PROTOCOL
+        )
+    with open("%s_timings.pkl" % prefix, 'wb') as handle:
+        pkl.dump([train_accuracies, valid_accuracies], handle, pkl.HIGHEST_PROTOCOL)
+    _, input_dim = data[0][0][0].shape
+    export_inference_bundle(model_path, model_id, 'Estimator', feature_list, input_dim,
+                            hidd, [hidd[-1]], activ)
+    print "Args and timings saved in %s_*" % prefix
+
+
+def remove_checkpoint(model_path, model_id):
+    for path in glob.glob("%s/%s_Estimator_model.ckpt*" % (model_path, model_id)):
+        os.remove(path)
+
+
+def print_best(best_model, best_args, best_valid_acc):
+    print "best model: %s" % best_model
+    if not best_args:
+        return
+    print "with parameters:"
+    print " - features:\n%s"     % (best_args[0],)
+    print " - hidden_sizes: %s"  % (best_args[1],)
+    print " - activation: %s"    % (best_args[2],)
+    print " - optimizer: %s"     % (best_args[3],)
+    print " - learning rate: %g" % (best_args[4],)
+    print " - dropout rate: %g"  % (best_args[5],)
+    print " - batch size: %d"    % (best_args[6],)
+    print "with average valid accuracy: %g" % best_valid_acc
+
+
+def explore(args):
+    """
+    sample a bunch of parameters, and run those experiments in parallel
+    """
+    feats, hidds, activs, optims, lrs, drs, bss = sample_parameters(args.explore)
+    model_path = 'models/%s' % args.mode
+    if not os.path.exists(model_path):
+        os.makedirs(model_path)
+
+    # Load the features of all configurations once, shared by all workers
+    all_features = sorted(set(f for feature_list in feats for f in feature_list))
+    trains, valids, test, _ = get_data(args.data, MODE_TO_TARGET[args.mode], feature_list=all_features)
+    _explore_data.update({'trains': trains, 'valids': valids, 'test': test})
+    n_folds = len(trains)
+    store = FeatureStore(store_path(args.data[0]))
+    dims = dict((f, store.dim(f)) for f in all_features)
+
+    trials = []
+    base_id = time.time()
+    for idx in range(args.explore):
+        trials.append({
+            'params': [feats[idx], hidds[idx], activs[idx], optims[idx], lrs[idx], drs[idx], bss[idx]],
+            'columns': feature_columns(feats[idx], all_features, dims),
+            'model_id': '%.2f.%d' % (base_id, idx),
+            'train': [None] * n_folds, 'valid': [None] * n_folds,
+            'finished': 0, 'stopped': False
+        })
+
+    best_args = []  # store the best combination
+    best_valid_acc = -100000.  # store the best validation accuracy
+    best_model = None  # store the best model id
+    valid_threshold = args.threshold  # accuracy must be higher for model to be saved
+    curves = []  # best-so-far valid accuracies of each finished fold
+
+    print "Will try %d different configurations with %d workers..." % (args.explore, args.workers)
+    pool = multiprocessing.Pool(args.workers)
+    results = Queue.Queue()
+    # folds of the same configuration are scheduled together to finish configurations early
+    pending = deque((t, k) for t in range(len(trials)) for k in range(n_folds))
+    running = 0
+    try:
+        while pending or running:
+            while pending and running < args.workers:
+                t, k = pending.popleft()
+                if trials[t]['stopped']:
+                    continue
+                pool.apply_async(train_fold, (
+                    t, k, trials[t]['columns'], trials[t]['params'], args.mode, args.patience,
+                    model_path, trials[t]['model_id'], k == n_folds - 1,
+                    list(curves), args.prune_percentile
+                ), callback=results.put)
+                running += 1
+            if running == 0:
+                continue
+            # N.B. a timeout keeps the wait interruptible by CTRL+C
+            t, k, train_accs, valid_accs, stopped, error = results.get(True, 10 ** 7)
+            running -= 1
+            trial = trials[t]
+            if error:
+                print "[%d] fold %d failed:\n%s" % (t+1, k+1, error)
+                stopped = True
+            if stopped and not trial['stopped']:
+                print "[%d] stopped at fold %d" % (t+1, k+1)
+                trial['stopped'] = True
+            if trial['stopped']:
+                # the last fold may have been saved before another fold was stopped
+                remove_checkpoint(model_path, trial['model_id'])
+                continue
+            curves.append(np.maximum.accumulate(valid_accs).tolist())
+            trial['train'][k], trial['valid'][k] = train_accs, valid_accs
+            trial['finished'] += 1
+            if trial['finished'] < n_folds:
+                continue
+
+            # all folds of this configuration are done
+            params = trial['params']
+            print "\n[%d] sampled features:\n%s" % (t+1, params[0])
+            print "[%d] sampled hidden_sizes: %s" % (t+1, params[1])
+            print "[%d] sampled activation: %s, optimizer: %s, learning rate: %g, dropout rate: %g, batch size: %d" % (
+                (t+1,) + tuple(params[2:]))
+            max_train = [max(accs) for accs in trial['train']]
+            max_valid = [max(accs) for accs in trial['valid']]
+            print "[%d] max train accuracies: %s" % (t+1, max_train)
+            print "[%d] max valid accuracies: %s" % (t+1, max_valid)
+            train_acc = np.mean(max_train)
+            valid_acc = np.mean(max_valid)
+            print "[%d] best avg. train accuracy: %g" % (t+1, train_acc)
+            print "[%d] best avg. valid accuracy: %g" % (t+1, valid_acc)
+
+            # save now if we got a good model
+            if valid_acc > valid_threshold:
+                save_trial(model_path, trial['model_id'], trial_data(trial['columns'], params[0]),
+                           params, trial['train'], trial['valid'])
+            else:
+                remove_checkpoint(model_path, trial['model_id'])
+
+            # update variables if we got better model
+            if valid_acc > best_valid_acc:
+                print "[%d] got better accuracy! new: %g > old: %g" % (t+1, valid_acc, best_valid_acc)
+                best_valid_acc = valid_acc
+                best_model = trial['model_id']
+                best_args = params
+            else:
+                print "[%d] best validation accuracy is still %g" % (t+1, best_valid_acc)
+
+    # catch CTRL+C errors to print current results
+    except KeyboardInterrupt as e:
+        print e
+        pool.terminate()
+        print_best(best_model, best_args, best_valid_acc)
+        sys.exit()
+
+    pool.close()
+    pool.join()
+    # end of exploration, print best results:
+    print "done!"
+    print_best(best_model, best_args, best_valid_acc)
+
+
 def main(args):
     if args.explore:
-        # sample a bunch of parameters, and run those experiments
-        feats, hidds, activs, optims, lrs, drs, bss = sample_parameters(args.explore)
-        best_args = []  # store the best combination
-        best_valid_acc = -100000.  # store the best validation accuracy
-        best_model = None  # store the best model id
-        valid_threshold = args.threshold  # accuracy must be higher for model to be saved
-        print "Will try %d different configurations..." % args.explore
-        for idx in range(args.explore):
-            with tf.Session() as sess:
-                try:
-                    # print sampled parameters
-                    print "\n[%d] sampled features:\n%s" % (idx+1, feats[idx])
-                    print "[%d] sampled hidden_sizes: %s" % (idx+1, hidds[idx])
-                    print "[%d] extra hidden_sizes: %s" % (idx+1, hidds[idx][-1])
-                    print "[%d] sampled activation: %s" % (idx+1, activs[idx])
-                    print "[%d] sampled optimizer: %s" % (idx+1, optims[idx])
-                    print "[%d] sampled learning rate: %g" % (idx+1, lrs[idx])
-                    print "[%d] sampled dropout rate: %g" % (idx+1, drs[idx])
-                    print "[%d] sampled batch size: %d" % (idx+1, bss[idx])
-
-                    # Load datasets
-                    data = get_data(args.data, MODE_TO_TARGET[args.mode], feature_list=feats[idx])
-                    n_folds = len(data[0])
-                    print "[%d] Building the network..." % (idx+1,)
-                    estimator = Estimator(
-                        data,
-                        hidds[idx],
-                        [hidds[idx][-1]],
-                        activs[idx],
-                        optims[idx],
-                        lrs[idx],
-                        model_path='models/%s' % args.mode
-                    )
-                    print "[%d] Training the network..." % (idx+1,)
-                    estimator.train(
-                        sess,
-                        MODE_TO_FLAG[args.mode],
-                        args.patience,
-                        bss[idx],
-                        drs[idx],
-                        save=False,  # don't save for now
-                        pretrained=None,
-                        verbose=False
-                    )
-                    # Only consider last `n_folds` accuracies!
-                    max_train = [max(estimator.train_accuracies[i]) for i in range(-n_folds, 0)]
-                    max_valid = [max(estimator.valid_accuracies[i]) for i in range(-n_folds, 0)]
-                    print "[%d] max train accuracies: %s" % (idx+1, max_train)
-                    print "[%d] max valid accuracies: %s" % (idx+1, max_valid)
-                    train_acc = np.mean(max_train)
-                    valid_acc = np.mean(max_valid)
-                    print "[%d] best avg. train accuracy: %g" % (idx+1, train_acc)
-                    print "[%d] best avg. valid accuracy: %g" % (idx+1, valid_acc)
-
-                    # save now if we got a good model
-                    if valid_acc > valid_threshold:
-                        estimator.save(sess)
-
-                    # update variables if we got better model
-                    if valid_acc > best_valid_acc:
-                        print "[%d] got better accuracy! new: %g > old: %g" % (idx+1, valid_acc, best_valid_acc)
-                        best_valid_acc = valid_acc
-                        best_model = estimator.model_id
-                        best_args = [feats[idx], hidds[idx], activs[idx], optims[idx], lrs[idx], drs[idx], bss[idx]]
-                    else:
-                        print "[%d] best validation accuracy is still %g" % (idx+1, best_valid_acc)
-
-                # end of try block, catch CTRL+C errors to print current results
-                except KeyboardInterrupt as e:
-                    print e
-                    print "best model: %s" % best_model
-                    print "with parameters:"
-                    print " - features:\n%s"     % (best_args[0],)
-                    print " - hidden_sizes: %s"  % (best_args[1],)
-                    print " - activation: %s"    % (best_args[2],)
-                    print " - optimizer: %s"     % (best_args[3],)
-                    print " - learning rate: %g" % (best_args[4],)
-                    print " - dropout rate: %g"  % (best_args[5],)
-                    print " - batch size: %d"    % (best_args[6],)
-                    print "with average valid accuracy: %g" % best_valid_acc
-                    sys.exit()
-
-            # end of tensorflow session, reset for the next graph
-            tf.reset_default_graph()
-
-        # end of exploration, print best results:
-        print "done!"
-        print "best model: %s" % best_model
-        print "with parameters:"
-        print " - features:\n%s"     % (best_args[0],)
-        print " - hidden_sizes: %s"  % (best_args[1],)
-        print " - activation: %s"    % (best_args[2],)
-        print " - optimizer: %s"     % (best_args[3],)
-        print " - learning rate: %g" % (best_args[4],)
-        print " - dropout rate: %g"  % (best_args[5],)
-        print " - batch size: %d"    % (best_args[6],)
-        print "with average valid accuracy: %g" % best_valid_acc
+        explore(args)
 
     else:
         # run one experiment with provided parameters
@@ -430,7 +607,7 @@ def main(args):
             batch_size, dropout_rate, pretrained, \
             train_accuracies, valid_accuracies = load_previous_model(args.previous_model)
             # Load provided dataset, but with the same features as previous model
-            data = get_data(args.data, MODE_TO_TARGET[args.mode], feature_list=old_data[-1])
+            data = get_data(args.data, MODE_TO_TARGET[args.mode], feature_list=old_data[-1], stream_dir=args.stream)
             # set pretrained to this model name
             pretrained = (model_path, model_id, model_name)
             # now update this model name to not override previous one
@@ -439,7 +616,7 @@ def main(args):
             previous_accuracies = (train_accuracies, valid_accuracies)
         else:
             # else, build current parameters
-            data = get_data(args.data, MODE_TO_TARGET[args.mode])
+            data = get_data(args.data, MODE_TO_TARGET[args.mode], stream_dir=args.stream)
             hidden_sizes = args.hidden_sizes
             hidden_sizes_extra = [args.hidden_sizes[-1]]
             activation = args.activation
@@ -495,9 +672,12 @@ if __name__ == '__main__':
     parser.add_argument("-g",  "--gpu", type=int, default=0, help="GPU number to use")
     parser.add_argument("-ex", "--explore", type=int, default=None, help="Number of times to sample parameters. If None, will use the one provided")
     parser.add_argument("-t",  "--threshold", type=float, default=0.63, help="minimum accuracy to reach in order to save the model (only used in exploration mode)")
+    parser.add_argument("-w",  "--workers", type=int, default=multiprocessing.cpu_count(), help="number of configurations and folds trained in parallel (only used in exploration mode)")
+    parser.add_argument("-pp", "--prune_percentile", type=float, default=50, help="stop a fold when its best valid accuracy is below this percentile of the finished folds at the same epoch, 0 to never stop (only used in exploration mode)")
     # training parameters:
     parser.add_argument("-pm", "--previous_model", default=None, help="path and prefix_ of the model to continue training from")
     parser.add_argument("-bs", "--batch_size", type=int, default=128, help="batch size during training")
+    parser.add_argument("-s",  "--stream", type=str, default=None, help="directory where to write the training matrices and stream them from disk, for data that does not fit in memory")
     parser.add_argument("-p",  "--patience", type=int, default=20, help="Number of training steps to wait before stoping when validatiaon accuracy doesn't increase")
     # network architecture:
     parser.add_argument("-hs", "--hidden_sizes", nargs='+', type=int, default=[500, 300, 100, 10], help="List of hidden sizes for the network")
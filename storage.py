@@ -1,21 +1,210 @@
 # Store the history of logs into the database
 # Should store the logs in the same database as the server is being stored
+#
+# Dialogs are never written by the caller: store_data() only puts them in a bounded
+# in-memory queue, and a background thread inserts them into the database by batches
+# with insert_many. When the database cannot be reached, batches are appended to a
+# local spill file (one JSON document per line) instead, and the spill file is replayed
+# into the database once it is reachable again, including at the next start.
+# Every dialog gets its `_id` when it is queued, so a batch inserted twice (ie: the
+# connection dropped after the insert) does not create duplicates.
 
+import os
+import time
+import Queue
+import atexit
+import logging
+import threading
 import pymongo
+from pymongo.errors import PyMongoError, BulkWriteError
+from bson import json_util
+from bson.objectid import ObjectId
 
+logger = logging.getLogger(__name__)
+
+MONGO_HOST = "132.206.3.23"
 MONGO_PORT = 8091
-client = pymongo.MongoClient("132.206.3.23", MONGO_PORT)
-db = client.convai
-dialogs = db.local
+# maximum number of dialogs waiting to be written, more are spilled directly
+QUEUE_SIZE = 10000
+# maximum number of dialogs inserted by one insert_many
+BATCH_SIZE = 100
+# seconds to wait for more dialogs after the first one of a batch
+BATCH_WAIT = 1.0
+# seconds between two attempts to reach the database after a failure
+RETRY_WAIT = 30
+# milliseconds before an unreachable database is reported
+SERVER_TIMEOUT_MS = 3000
+SPILL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dialogs_spill.jsonl')
+# duplicate key error code of MongoDB
+DUPLICATE_KEY = 11000
+
+
+class LogWriter(object):
+    def __init__(self, host=MONGO_HOST, port=MONGO_PORT, spill_path=SPILL_FILE,
+                 queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, batch_wait=BATCH_WAIT, retry_wait=RETRY_WAIT):
+        """
+        Background writer of documents into the db.local collection
+        :param spill_path: file receiving the documents which could not be written
+        """
+        self.host = host
+        self.port = port
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.retry_wait = retry_wait
+        self.queue = Queue.Queue(queue_size)
+        self.spill_lock = threading.Lock()
+        self._collection = None
+        # time after which the database can be tried again, 0: replay a previous spill file first
+        self.retry_time = 0
+        self.thread = threading.Thread(target=self._run, name='LogWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, document):
+        """ queue `document` to be written, never blocks """
+        document.setdefault('_id', ObjectId())
+        try:
+            self.queue.put_nowait(document)
+        except Queue.Full:
+            logger.warning("log queue is full, spilling dialog %s" % document.get('dialogId'))
+            self.spill([document])
+
+    def close(self, timeout=10):
+        """ write the queued documents, spilling those left after `timeout` seconds """
+        try:
+            self.queue.put(None, True, timeout)
+        except Queue.Full:
+            pass
+        self.thread.join(timeout)
+        remaining = []
+        while True:
+            try:
+                document = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if document is not None:
+                remaining.append(document)
+        if len(remaining) > 0:
+            self.spill(remaining)
+
+    def collection(self):
+        if self._collection is None:
+            client = pymongo.MongoClient(self.host, self.port, connect=False, serverSelectionTimeoutMS=SERVER_TIMEOUT_MS)
+            self._collection = client.convai.local
+        return self._collection
+
+    def spill(self, documents):
+        with self.spill_lock:
+            with open(self.spill_path, 'a') as handle:
+                for document in documents:
+                    handle.write(json_util.dumps(document) + '\n')
+
+    def _next_batch(self):
+        """ :return: (documents, stop) """
+        batch = []
+        try:
+            document = self.queue.get(True, self.retry_wait)
+        except Queue.Empty:
+            return batch, False
+        if document is None:
+            return batch, True
+        batch.append(document)
+        deadline = time.time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                document = self.queue.get(True, remaining)
+            except Queue.Empty:
+                break
+            if document is None:
+                return batch, True
+            batch.append(document)
+        return batch, False
+
+    def _insert(self, documents):
+        """ :return: True if the documents are in the database """
+        try:
+            self.collection().insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # documents already written by a previous attempt
+            errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != DUPLICATE_KEY]
+            if len(errors) > 0 or e.details.get('writeConcernErrors'):
+                logger.error("could not write %d dialogs: %s" % (len(errors), errors[:1]))
+                return False
+        except PyMongoError as e:
+            logger.error("database unreachable, spilling %d dialogs: %s" % (len(documents), e))
+            return False
+        return True
+
+    def _write(self, documents):
+        if len(documents) == 0:
+            return
+        if time.time() < self.retry_time or not self._insert(documents):
+            self.retry_time = max(self.retry_time, time.time() + self.retry_wait)
+            self.spill(documents)
+
+    def _replay(self):
+        """ insert the spilled documents into the database, those that still fail are spilled again """
+        replay_path = self.spill_path + '.replay'
+        with self.spill_lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.rename(self.spill_path, replay_path)
+        with open(replay_path, 'r') as handle:
+            documents = [json_util.loads(line) for line in handle if line.strip()]
+        logger.info("replaying %d spilled dialogs" % len(documents))
+        for start in range(0, len(documents), self.batch_size):
+            batch = documents[start:start + self.batch_size]
+            if not self._insert(batch):
+                self.retry_time = time.time() + self.retry_wait
+                self.spill(documents[start:])
+                break
+        os.remove(replay_path)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            if time.time() >= self.retry_time:
+                try:
+                    self._replay()
+                except Exception as e:
+                    logger.error("could not replay the spill file: %s" % e)
+                    self.retry_time = time.time() + self.retry_wait
+            documents, stop = self._next_batch()
+            try:
+                self._write(documents)
+            except Exception as e:
+                logger.error("could not write dialogs: %s" % e)
+                self.spill(documents)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """ writer of this process, started at the first dialog stored """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LogWriter()
+            atexit.register(_writer.close)
+        return _writer
+
 
 # stores the log history in the database by dialog id
 
 
 def store_data(dialog_id, dialog_history):
-    dialogs.insert({'dialogId': dialog_id, 'logs': dialog_history })
+    get_writer().put({'dialogId': dialog_id, 'logs': dialog_history})
 
 # Stub: will use it later
 def match_data():
+    dialogs = get_writer().collection()
     db_logs = list(dialogs.find({"dialogId": dialog_id}))
     if len(db_logs) > 0:
         thread = db_logs[0]['thread']
@@ -0,0 +1,110 @@
+# Turn level tracing
+# Every turn carries a `trace` dict mapping stage names to timestamps.
+# Each process stamps the stages it goes through and records the time spent
+# in each stage in a Tracer, which keeps the last samples of every stage
+# (overall and per model) and periodically dumps their percentiles in a file.
+
+import json
+import time
+import logging
+from collections import deque
+from threading import Lock, Thread
+
+import numpy as np
+
+# Timestamps are compared across processes, so we need a system wide clock:
+# CLOCK_MONOTONIC on python 3, wall clock on python 2.
+try:
+    now = time.monotonic
+except AttributeError:
+    now = time.time
+
+
+def stamp(trace, stage):
+    """ Save the current time of `stage` in `trace` and return it """
+    if trace is None:
+        trace = {}
+    trace[stage] = now()
+    return trace
+
+
+def since(trace, stage):
+    """ seconds elapsed since `stage` was stamped, None if it never was """
+    if not trace or stage not in trace:
+        return None
+    return now() - trace[stage]
+
+
+class Tracer(object):
+    """
+    Collect the duration of each stage of a turn and report their histograms
+    """
+
+    def __init__(self, name, window=1000):
+        """
+        :param name: name of the process, saved in the dumps
+        :param window: number of recent samples to keep for each stage
+        """
+        self.name = name
+        self.window = window
+        self.stages = {}  # stage -> deque of durations
+        self.models = {}  # model -> stage -> deque of durations
+        self.lock = Lock()
+
+    def record(self, stage, seconds, model=None):
+        """ Add one duration (in seconds) for `stage`, optionally for a given `model` """
+        if seconds is None:
+            return
+        with self.lock:
+            self.stages.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+            if model is not None:
+                self.models.setdefault(model, {}).setdefault(
+                    stage, deque(maxlen=self.window)).append(seconds)
+
+    def record_since(self, trace, stage_start, stage, model=None):
+        """ Record the time elapsed since `stage_start` was stamped in `trace` """
+        self.record(stage, since(trace, stage_start), model)
+
+    @staticmethod
+    def _histogram(samples):
+        samples = np.array(samples)
+        return {
+            'count': len(samples),
+            'mean': float(np.mean(samples)),
+            'p50': float(np.percentile(samples, 50)),
+            'p95': float(np.percentile(samples, 95)),
+            'p99': float(np.percentile(samples, 99)),
+            'max': float(np.max(samples))
+        }
+
+    def summary(self):
+        """ percentiles of every stage, overall and per model """
+        with self.lock:
+            stages = {s: list(d) for s, d in self.stages.items()}
+            models = {m: {s: list(d) for s, d in st.items()}
+                      for m, st in self.models.items()}
+        return {
+            'name': self.name,
+            'time': time.time(),
+            'stages': {s: self._histogram(d) for s, d in stages.items() if d},
+            'models': {m: {s: self._histogram(d) for s, d in st.items() if d}
+                       for m, st in models.items()}
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.summary(), fp, indent=2, sort_keys=True)
+
+    def start_dumping(self, path, period=60):
+        """ Dump the summary to `path` every `period` seconds in a daemon thread """
+        def _dump_loop():
+            while True:
+                time.sleep(period)
+                try:
+                    self.dump(path)
+                except (IOError, ValueError) as e:
+                    logging.error("Could not dump traces to {}: {}".format(path, e))
+        thread = Thread(target=_dump_loop)
+        thread.daemon = True
+        thread.start()
+        return thread
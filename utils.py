@@ -1,12 +1,64 @@
 import re
 import random
-import urlparse
 import string
 
 
 HTTP = re.compile('(http|ftp|https)://([\w_-]+(?:(?:\.[\w_-]+)+))([\w.,@?^=%&:/~+#-]*[\w@?^=%&/~+#-])?')
 
 
+# tokenize_utterance() normalizes the text in a few passes instead of one pass per rule:
+#  - one regex pass for the multi-character rules, with a dispatch table (MULTI_CHAR_RULES)
+#  - one translate() for the single character rules (CHAR_RULES)
+#  - whitespace collapsing, then the @username / #hashtag / number rules, only when they can apply
+# Urls are tagged by their domain, read from the match of HTTP and turned into a tag with one
+# translate() (URL_TAG_CHARS) instead of urlparse and one replace per punctuation character.
+# Its output is identical to applying the rules one after the other, see benchmark_tokenizer.py
+
+# rules applied before the single character rules (no two of them can overlap)
+MULTI_CHAR_RULES = {
+    u" (cont) ": u"<cont>",
+    u"& lt": u"<",
+    u"& gt": u">",
+    u"&lt;": u"<",
+    u"&gt;": u">",
+}
+# runs of dots and commas are reduced to one character
+MULTI_CHAR = re.compile('|'.join(re.escape(rule) for rule in MULTI_CHAR_RULES) + r'|\.{2,}|,{2,}')
+CHAR_RULES = dict((ord(char), replacement) for char, replacement in {
+    u"'": u" '", u'"': u' " ', u";": u" ", u"`": u" ",
+    u".": u" . ", u"!": u" ! ", u"?": u" ? ", u",": u" , ",
+    u"~": None, u"-": u" - ", u"*": u" * ",
+    u"(": u" ", u")": u" ", u"[": u" ", u"]": u" ",
+    u">": u"> ", u"/": u" ",
+}.items())
+# the domain of a url (urlparse netloc) ends at the first of these characters
+URL_PATH = re.compile('[/?#]')
+URL_TAG_CHARS = dict((ord(char), u'_') for char in string.punctuation)
+WHITESPACES = re.compile(r'\s+')
+AT_USER = re.compile(r'@[^\s]+')
+HASHTAG = re.compile(r'#([^\s]+)')
+NUMBER = re.compile(r" \d+")
+
+
+def _multi_char_rule(match):
+    text = match.group()
+    return MULTI_CHAR_RULES.get(text, text[0])
+
+
+def _replace_urls(utterance):
+    """ replace each url of a unicode string by a <domain> tag """
+    res = HTTP.search(utterance)
+    while res is not None:
+        url_string = res.group()
+        # host, and port or credentials if any: same as urlparse.urlparse(url_string).netloc
+        url_tld = res.group(2) + URL_PATH.split(utterance[res.end(2):res.end()], 1)[0]
+        url_tag = u'<' + url_tld.replace(u'www.', u'').translate(URL_TAG_CHARS) + u'>'
+        utterance = utterance.replace(url_string, url_tag)
+        # there is no url before this one, and a tag cannot be part of a url
+        res = HTTP.search(utterance, res.start() + len(url_tag))
+    return utterance
+
+
 def tokenize_utterance(utterance):
     """
     Process an utterance to be like in the training data to avoid out-of-vocab cases
@@ -14,59 +66,40 @@ def tokenize_utterance(utterance):
     :type utterance: str
     :return: processed string
     """
+    is_unicode = isinstance(utterance, unicode)
     utterance = utterance.lower()
-    res = HTTP.search(utterance)
-    while res is not None:
-        url_string = utterance[res.start():res.end()]
-        url_tld = urlparse.urlparse(url_string).netloc
-        url_tag = url_tld.replace('www.', '')
-        for p in string.punctuation:
-            url_tag = url_tag.replace(p, '_')
-        url_tag = '<' + url_tag.strip() + '>'
-        utterance = utterance.replace(url_string, url_tag)
-        res = HTTP.search(utterance)
-
-    utterance = utterance.replace(" (cont) ", "<cont>")
-    utterance = utterance.replace('& lt', '<')
-    utterance = utterance.replace('& gt', '>')
-    utterance = utterance.replace('&lt;', '<')
-    utterance = utterance.replace('&gt;', '>')
-    utterance = utterance.replace('\'', ' \'')
-    utterance = utterance.replace('"', ' " ')
-    utterance = utterance.replace(";", " ")
-    utterance = utterance.replace("`", " ")
-    utterance = re.sub('\.+', '.', utterance)
-    utterance = re.sub(',+', ',', utterance)
-    utterance = utterance.replace('.', ' . ')
-    utterance = utterance.replace('!', ' ! ')
-    utterance = utterance.replace('?', ' ? ')
-    utterance = utterance.replace(',', ' , ')
-    utterance = utterance.replace('~', '')
-    utterance = utterance.replace('-', ' - ')
-    utterance = utterance.replace('*', ' * ')
-    utterance = utterance.replace('(', ' ')
-    utterance = utterance.replace(')', ' ')
-    utterance = utterance.replace('[', ' ')
-    utterance = utterance.replace(']', ' ')
-    utterance = utterance.replace('>', '> ')
-    utterance = utterance.replace('/', ' ')
-    utterance = re.sub('\s+', ' ', utterance)
-    utterance = utterance.strip()
+    if not is_unicode:
+        # bytes are processed as the code points 0-255, and decoded at the end as before:
+        # the rules only act on ascii characters, and may remove non-ascii bytes
+        utterance = utterance.decode('latin-1')
+    if u'://' in utterance:
+        utterance = _replace_urls(utterance)
+
+    utterance = MULTI_CHAR.sub(_multi_char_rule, utterance)
+    utterance = utterance.translate(CHAR_RULES)
+    utterance = WHITESPACES.sub(' ', utterance)
+    # bytes.strip() only removes ascii whitespaces, which are all spaces by now
+    utterance = utterance.strip() if is_unicode else utterance.strip(u' ')
 
     #utterance = utterance.replace('\xe2', ' <heart> ')
 
-    # Convert @username to AT_USER
-    utterance = re.sub('@[^\s]+', '<at>', utterance)
+    if u'@' in utterance:
+        # Convert @username to AT_USER
+        utterance = AT_USER.sub(u'<at>', utterance)
 
-    # Remove hashtag sign from hashtags
-    utterance = re.sub(r'#([^\s]+)', r'\1', utterance)
+    if u'#' in utterance:
+        # Remove hashtag sign from hashtags
+        utterance = HASHTAG.sub(r'\1', utterance)
 
     # Replace numbers with <number> token
-    utterance = re.sub(" \d+", " <number> ", utterance)
+    utterance = NUMBER.sub(u" <number> ", utterance)
 
-    utterance = utterance.replace('@', '')
+    if u'@' in utterance:
+        utterance = utterance.replace(u'@', u'')
 
-    return unicode(utterance)
+    if not is_unicode:
+        return unicode(utterance.encode('latin-1'))
+    return utterance
 
 
 def detokenize_utterance(utterance, spacy_article=None):